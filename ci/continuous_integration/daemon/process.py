@@ -1,11 +1,15 @@
 """The module handles running a command line."""
 
+import functools
 import os
 import signal
 import subprocess
 
 
 LAST_PID_FILE = '/python-daemon-data/last_pid'
+MOUNTS_PATH = '/proc/mounts'
+SELF_CGROUP_PATH = '/proc/self/cgroup'
+CGROUP_NAME = 'python-daemon-command'
 
 
 def call(cmd, cwd='.', env=None, capture=False):
@@ -31,22 +35,90 @@ def call(cmd, cwd='.', env=None, capture=False):
 
 
 class Popen(object):
-  """A scope that initializes Popen and kill the last pid."""
+  """A scope that initializes Popen and kills the command with all of its
+    descendants, including the ones left by a daemon that was killed."""
 
   def __init__(self, *args, **kwargs):
-    kill_last_pid()
+    self.cgroup_path = get_cgroup_path()
+    kill_leftovers(self.cgroup_path)
+    if self.cgroup_path:
+      kwargs['preexec_fn'] = functools.partial(
+          join_cgroup, self.cgroup_path, kwargs.get('preexec_fn'))
     self.popen = subprocess.Popen(*args, **kwargs)
-    store_last_pid(self.popen.pid)
+    if not self.cgroup_path:
+      store_last_pid(self.popen.pid)
 
   def __enter__(self):
     return self.popen
 
   def __exit__(self, exc_type, exc_val, exc_tb):
+    kill_leftovers(self.cgroup_path)
+
+
+def get_cgroup_path():
+  """Return the cgroup that the commands run in, or None when cgroup v2 isn't
+    delegated to the daemon."""
+  try:
+    with open(MOUNTS_PATH) as f:
+      mount_points = [
+          line.split()[1] for line in f if line.split()[2:3] == ['cgroup2']]
+    with open(SELF_CGROUP_PATH) as f:
+      paths = [line[3:].strip() for line in f if line.startswith('0::')]
+  except IOError:
+    return None
+
+  if not mount_points or not paths:
+    return None
+  root = os.path.join(mount_points[0], paths[0].lstrip('/'))
+  if not os.access(root, os.W_OK):
+    return None
+  return os.path.join(root, CGROUP_NAME)
+
+
+def join_cgroup(cgroup_path, preexec_fn):
+  """Move the command into the cgroup, which its descendants can't leave by
+    calling setsid."""
+  with open(os.path.join(cgroup_path, 'cgroup.procs'), 'w') as f:
+    f.write('%s' % os.getpid())
+  if preexec_fn:
+    preexec_fn()
+
+
+def kill_leftovers(cgroup_path):
+  """Kill the processes left by the last command."""
+  if cgroup_path:
+    kill_cgroup(cgroup_path)
+  else:
     kill_last_pid()
 
 
+def kill_cgroup(cgroup_path):
+  """Kill every process in the cgroup, and create it if it doesn't exist.
+    The cgroup outlives the daemon, so the processes left by a daemon that was
+    killed are killed too."""
+  if not os.path.exists(cgroup_path):
+    os.mkdir(cgroup_path)
+    return
+
+  kill_path = os.path.join(cgroup_path, 'cgroup.kill')
+  if os.path.exists(kill_path):
+    # cgroup.kill is new in Linux 5.14.
+    with open(kill_path, 'w') as f:
+      f.write('1')
+    return
+
+  with open(os.path.join(cgroup_path, 'cgroup.procs')) as f:
+    pids = [int(pid) for pid in f.read().split()]
+  for pid in pids:
+    try:
+      os.kill(pid, signal.SIGKILL)
+    except OSError:
+      pass
+
+
 def store_last_pid(pid):
-  """Store the last pid, so that we can kill it later in time."""
+  """Store the last pid, so that we can kill it later in time. It's only
+    needed without cgroup v2."""
   with open(LAST_PID_FILE, 'w') as f:
     f.write('%s' % pid)
 
@@ -32,6 +32,7 @@ class MainTest(helpers.ExtendedTestCase):
                          'daemon.main.reset_and_run_testcase',
                          'daemon.main.update_auth_header',
                          'daemon.main.load_new_testcases',
+                         'daemon.main.prefetch_testcases',
                          'time.sleep'])
     self.setup_fake_filesystem()
     self.mock.load_sanity_check_testcase_ids.return_value = [1, 2]
@@ -59,6 +60,42 @@ class MainTest(helpers.ExtendedTestCase):
         mock.call(4, 'job', sys.argv[1]),
         mock.call(5, 'job', sys.argv[1])])
     self.assertEqual(2, self.mock.update_auth_header.call_count)
+    self.assert_exact_calls(self.mock.prefetch_testcases, [
+        mock.call([3, 4]), mock.call([5])])
+
+
+class PrefetchTestcasesTest(helpers.ExtendedTestCase):
+  """Test the prefetch_testcases method."""
+
+  def setUp(self):
+    helpers.patch(self, ['daemon.process.call'])
+    self.mock_os_environment({'PATH': 'test'})
+
+  def test_prefetch(self):
+    """Ensures all testcases are prefetched with one command."""
+    main.prefetch_testcases([1234, 5678])
+
+    self.assert_exact_calls(self.mock.call, [
+        mock.call(
+            '/python-daemon-data/clusterfuzz prefetch 1234 5678',
+            cwd=main.HOME,
+            env={
+                'CF_QUIET': '1',
+                'USER': 'CI',
+                'CHROMIUM_SRC': main.CHROMIUM_SRC,
+                'PATH': 'test:%s' % main.DEPOT_TOOLS,
+                'GOMA_GCE_SERVICE_ACCOUNT': 'default'})
+    ])
+
+  def test_empty(self):
+    """Ensures nothing runs without testcases."""
+    main.prefetch_testcases([])
+    self.assertEqual(0, self.mock.call.call_count)
+
+  def test_fail(self):
+    """Ensures a failed prefetch is ignored."""
+    self.mock.call.side_effect = subprocess.CalledProcessError(1, None)
+    main.prefetch_testcases([1234])
 
 
 class RunTestcaseTest(helpers.ExtendedTestCase):
@@ -271,8 +308,6 @@ class BuildMasterAndGetVersionTest(helpers.ExtendedTestCase):
 
   def setUp(self):
     helpers.patch(self, ['daemon.process.call',
-                         'daemon.main.delete_if_exists',
-                         'shutil.copy',
                          'os.path.exists'])
     self.mock.exists.return_value = False
 
@@ -288,14 +323,11 @@ class BuildMasterAndGetVersionTest(helpers.ExtendedTestCase):
         mock.call('git checkout origin/master -f', cwd=main.TOOL_SOURCE),
         mock.call('./pants binary tool:clusterfuzz-ci', cwd=main.TOOL_SOURCE,
                   env={'HOME': main.HOME}),
+        mock.call(
+            'python2.7 tool/pex_launcher.py dist/clusterfuzz-ci.pex --link %s' %
+            main.BINARY_LOCATION, cwd=main.TOOL_SOURCE),
         mock.call('git rev-parse HEAD', capture=True, cwd=main.TOOL_SOURCE)
     ])
-    self.assert_exact_calls(
-        self.mock.delete_if_exists, [mock.call(main.BINARY_LOCATION)])
-    self.assert_exact_calls(self.mock.copy, [
-        mock.call(os.path.join(main.TOOL_SOURCE, 'dist', 'clusterfuzz-ci.pex'),
-                  main.BINARY_LOCATION)
-    ])
 
 
 class DeleteIfExistsTest(helpers.ExtendedTestCase):
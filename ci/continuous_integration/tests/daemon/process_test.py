@@ -30,11 +30,14 @@ class CallTest(helpers.ExtendedTestCase):
     self.mock_os_environment({'TEST': '1'})
     self.popen = mock.Mock(spec=subprocess.Popen)
     helpers.patch(self, [
+        'daemon.process.get_cgroup_path',
+        'daemon.process.kill_cgroup',
         'daemon.process.kill_last_pid',
         'daemon.process.store_last_pid',
         'os.setsid',
         'subprocess.Popen',
     ])
+    self.mock.get_cgroup_path.return_value = None
 
     self.mock.Popen.return_value = self.popen
     self.popen.pid = 123
@@ -88,6 +91,108 @@ class CallTest(helpers.ExtendedTestCase):
     self.assertEqual('Test', cm.exception.output)
     self.assertEqual('test', cm.exception.cmd)
 
+  def test_cgroup(self):
+    """Test running the command in a cgroup."""
+    self.mock.get_cgroup_path.return_value = '/cgroup/command'
+    self.popen.returncode = 0
+    self.popen.communicate.return_value = (None, None)
+    self.assertEqual((0, None), process.call('test', cwd='path'))
+
+    preexec_fn = self.mock.Popen.call_args[1]['preexec_fn']
+    self.assertEqual(process.join_cgroup, preexec_fn.func)
+    self.assertEqual(('/cgroup/command', os.setsid), preexec_fn.args)
+    self.assert_exact_calls(
+        self.mock.kill_cgroup, [mock.call('/cgroup/command')] * 2)
+    self.assertEqual(0, self.mock.store_last_pid.call_count)
+    self.assertEqual(0, self.mock.kill_last_pid.call_count)
+
+
+class GetCgroupPathTest(helpers.ExtendedTestCase):
+  """Tests get_cgroup_path."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['daemon.process.os.access'])
+    self.mock.access.return_value = True
+    self.fs.CreateFile(process.MOUNTS_PATH, contents=(
+        'proc /proc proc rw 0 0\n'
+        'cgroup2 /sys/fs/cgroup cgroup2 rw 0 0\n'))
+    self.fs.CreateFile(
+        process.SELF_CGROUP_PATH, contents='0::/system.slice/daemon\n')
+
+  def test_delegated(self):
+    """Test getting the cgroup under the cgroup of the daemon."""
+    self.assertEqual(
+        '/sys/fs/cgroup/system.slice/daemon/python-daemon-command',
+        process.get_cgroup_path())
+    self.mock.access.assert_called_once_with(
+        '/sys/fs/cgroup/system.slice/daemon', os.W_OK)
+
+  def test_not_writable(self):
+    """Test not using a cgroup that isn't delegated."""
+    self.mock.access.return_value = False
+    self.assertIsNone(process.get_cgroup_path())
+
+  def test_no_cgroup2(self):
+    """Test not using a cgroup without cgroup v2."""
+    self.fs.RemoveObject(process.MOUNTS_PATH)
+    self.fs.CreateFile(process.MOUNTS_PATH, contents=(
+        'cgroup /sys/fs/cgroup/memory cgroup rw,memory 0 0\n'))
+    self.assertIsNone(process.get_cgroup_path())
+
+
+class JoinCgroupTest(helpers.ExtendedTestCase):
+  """Tests join_cgroup."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['os.getpid'])
+    self.mock.getpid.return_value = 1234
+    self.fs.CreateFile('/cgroup/cgroup.procs')
+
+  def test_join(self):
+    """Test moving the process into the cgroup."""
+    preexec_fn = mock.Mock()
+    process.join_cgroup('/cgroup', preexec_fn)
+
+    with open('/cgroup/cgroup.procs') as f:
+      self.assertEqual('1234', f.read())
+    preexec_fn.assert_called_once_with()
+
+
+class KillCgroupTest(helpers.ExtendedTestCase):
+  """Tests kill_cgroup."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['os.kill'])
+
+  def test_create(self):
+    """Test creating the cgroup."""
+    self.fs.CreateDirectory('/cgroup')
+    process.kill_cgroup('/cgroup/command')
+
+    self.assertTrue(os.path.isdir('/cgroup/command'))
+    self.assertEqual(0, self.mock.kill.call_count)
+
+  def test_cgroup_kill(self):
+    """Test killing with cgroup.kill."""
+    self.fs.CreateFile('/cgroup/command/cgroup.kill')
+    process.kill_cgroup('/cgroup/command')
+
+    with open('/cgroup/command/cgroup.kill') as f:
+      self.assertEqual('1', f.read())
+    self.assertEqual(0, self.mock.kill.call_count)
+
+  def test_kill_pids(self):
+    """Test killing every process without cgroup.kill."""
+    self.fs.CreateFile('/cgroup/command/cgroup.procs', contents='12\n34\n')
+    self.mock.kill.side_effect = [None, OSError()]
+    process.kill_cgroup('/cgroup/command')
+
+    self.assert_exact_calls(self.mock.kill, [
+        mock.call(12, signal.SIGKILL), mock.call(34, signal.SIGKILL)])
+
 
 class StoreLastPidTest(helpers.ExtendedTestCase):
   """Tests store_last_pid."""
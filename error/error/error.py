@@ -169,10 +169,12 @@ class UnreproducibleError(ExpectedException):
       'which is especially good for gesture-related testcases.')
   EXIT_CODE = 51
 
-  def __init__(self, count, crash_signatures):
+  def __init__(self, count, crash_signatures, outputs=None):
+    """outputs maps the output digests of the signatures to their outputs."""
+    outputs = outputs or {}
     crash_signatures = [
         {'type': s.crash_type, 'state': s.crash_state_lines,
-         'output': s.output[:100000]}
+         'output': outputs.get(s.output_digest, '')}
         for s in list(crash_signatures)[:10]
     ]
     super(UnreproducibleError, self).__init__(
@@ -230,3 +232,40 @@ class UserRespondingNoError(ExpectedException):
     super(UserRespondingNoError, self).__init__(
         self.MESSAGE.format(question=question),
         self.EXIT_CODE)
+
+
+class BadBundleError(ExpectedException):
+  """An exception raised when a testcase bundle cannot be read."""
+
+  MESSAGE = '{path} is not a valid testcase bundle: {reason}.'
+  EXIT_CODE = 56
+
+  def __init__(self, path, reason):
+    super(BadBundleError, self).__init__(
+        self.MESSAGE.format(path=path, reason=reason),
+        self.EXIT_CODE)
+
+
+class DaemonRunningError(ExpectedException):
+  """An exception raised when `clusterfuzz serve` is already running."""
+
+  MESSAGE = 'Another `clusterfuzz serve` is already listening on {path}.'
+  EXIT_CODE = 57
+
+  def __init__(self, path):
+    super(DaemonRunningError, self).__init__(
+        self.MESSAGE.format(path=path), self.EXIT_CODE)
+
+
+class DaemonNotRunningError(ExpectedException):
+  """An exception raised when a request can't be forwarded to
+    `clusterfuzz serve`."""
+
+  MESSAGE = (
+      'No `clusterfuzz serve` is listening on {path}. Please start it, or '
+      're-run without --daemon.')
+  EXIT_CODE = 58
+
+  def __init__(self, path):
+    super(DaemonNotRunningError, self).__init__(
+        self.MESSAGE.format(path=path), self.EXIT_CODE)
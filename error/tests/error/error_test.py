@@ -51,7 +51,7 @@ class GetClassNameTest(helpers.ExtendedTestCase):
 
 
 Signature = collections.namedtuple(
-    'Signature', ['crash_type', 'crash_state_lines', 'output'])
+    'Signature', ['crash_type', 'crash_state_lines', 'output_digest'])
 
 
 class InitTest(helpers.ExtendedTestCase):
@@ -68,8 +68,23 @@ class InitTest(helpers.ExtendedTestCase):
     error.NotInstalledError('bin')
     error.GsutilNotInstalledError()
     error.BadJobTypeDefinitionError('job')
-    error.UnreproducibleError(10, [Signature('type', ['a', 'b'], 'output')])
+    error.UnreproducibleError(10, [Signature('type', ['a', 'b'], 'digest')])
     error.DirtyRepoError('source')
     error.CommandFailedError('cmd', 12, 'err')
     error.KillProcessFailedError('cmd', 123)
     error.UserRespondingNoError('question')
+
+
+class UnreproducibleErrorTest(helpers.ExtendedTestCase):
+  """Test UnreproducibleError."""
+
+  def test_outputs(self):
+    """Test adding the output of every signature to the extras."""
+    exception = error.UnreproducibleError(
+        10, [Signature('type', ('a', 'b'), 'digest'),
+             Signature('other', ('c',), 'unknown')],
+        {'digest': 'output'})
+    self.assertEqual(
+        [{'type': 'type', 'state': ('a', 'b'), 'output': 'output'},
+         {'type': 'other', 'state': ('c',), 'output': ''}],
+        exception.extras['signatures'])
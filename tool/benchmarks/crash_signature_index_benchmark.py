@@ -0,0 +1,80 @@
+"""Measure matching crashes against an index of known crash signatures.
+
+Run from tool/ with:
+  PYTHONPATH=.:../shared:../error:../cmd-editor \
+      python benchmarks/crash_signature_index_benchmark.py
+"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import random
+import time
+
+from clusterfuzz import common
+
+
+CRASH_TYPES = ['Heap-use-after-free\nREAD 8', 'Heap-buffer-overflow\nREAD 4',
+               'Null-dereference READ', 'Stack-overflow', 'CHECK failure',
+               'Use-of-uninitialized-value']
+
+
+def make_signature(rand, function_count):
+  """Return a signature with 3 frames out of function_count functions."""
+  return common.CrashSignature(
+      rand.choice(CRASH_TYPES),
+      ['blink::Class%d::method%d(int)' % (f / 10, f % 10)
+       for f in rand.sample(xrange(function_count), 3)])
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--known', type=int, default=10000,
+                      help='The number of known signatures.')
+  parser.add_argument('--queries', type=int, default=10000,
+                      help='The number of crashes to match.')
+  args = parser.parse_args()
+
+  rand = random.Random(0)
+  # Enough functions that a frame is shared by about 30 known signatures.
+  function_count = args.known / 10
+  known = [make_signature(rand, function_count) for _ in xrange(args.known)]
+  queries = [make_signature(rand, function_count)
+             for _ in xrange(args.queries / 2)]
+  queries += rand.sample(known, args.queries - len(queries))
+
+  start = time.time()
+  index = common.CrashSignatureIndex()
+  for testcase_id, signature in enumerate(known):
+    index.add(signature, testcase_id)
+  print 'Indexed %d signatures in %.0fms.' % (
+      len(index), (time.time() - start) * 1000)
+
+  for name, find in [('find_exact', index.find_exact), ('match', index.match)]:
+    start = time.time()
+    found = sum(1 for signature in queries if find(signature))
+    elapsed = time.time() - start
+    print '%-10s %8.1fus per crash, %d of %d matched' % (
+        name, elapsed / len(queries) * 1e6, found, len(queries))
+
+  # The linear scan that the index replaces.
+  start = time.time()
+  for signature in queries[:100]:
+    max(signature.get_similarity(k) for k in known)
+  print '%-10s %8.1fus per crash' % (
+      'scan', (time.time() - start) / 100 * 1e6)
+
+
+if __name__ == '__main__':
+  main()
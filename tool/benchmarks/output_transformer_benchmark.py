@@ -0,0 +1,105 @@
+"""Measure the output throughput of the output transformers.
+
+Run from tool/ with:
+  PYTHONPATH=.:../shared:../error:../cmd-editor \
+      python benchmarks/output_transformer_benchmark.py
+"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import time
+
+from clusterfuzz import output_transformer
+
+
+class CountingOutput(object):
+  """Write to a file and count the writes and flushes."""
+
+  def __init__(self, f):
+    self.f = f
+    self.writes = 0
+    self.flushes = 0
+
+  def write(self, s):
+    self.writes += 1
+    self.f.write(s)
+
+  def flush(self):
+    self.flushes += 1
+    self.f.flush()
+
+
+def make_compile_log(size):
+  """Return a typical compile log, e.g. the output of a verbose build."""
+  line = 'clang++ -MMD -MF obj/foo/bar.o.d -DNDEBUG -O2 -c ../../foo/bar.cc\n'
+  return (line * (size / len(line) + 1))[:size]
+
+
+def make_ninja_log(size):
+  """Return ninja's output of a build with progress lines."""
+  lines = []
+  total = 0
+  step = 0
+  while total < size:
+    step += 1
+    line = '[%d/50000] CXX obj/foo/bar_%d.o\n' % (step, step)
+    lines.append(line)
+    total += len(line)
+  return ''.join(lines)[:size]
+
+
+def run(transformer, data, chunk_size, f):
+  """Feed data to transformer in chunks and return (seconds, output)."""
+  output = CountingOutput(f)
+  transformer.set_output(output)
+  start = time.time()
+  for i in xrange(0, len(data), chunk_size):
+    transformer.process(data[i:i + chunk_size])
+  transformer.flush()
+  return time.time() - start, output
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--size', type=int, default=10 * 1024 * 1024,
+                      help='The bytes of output to transform.')
+  parser.add_argument('--chunk-size', type=int, default=10,
+                      help='The bytes read from the process at a time.')
+  parser.add_argument('--unbuffered', action='store_true',
+                      help='Flush on every write, for comparison.')
+  args = parser.parse_args()
+
+  if args.unbuffered:
+    output_transformer.FLUSH_SIZE = 0
+
+  cases = [
+      ('Hidden', output_transformer.Hidden, make_compile_log(args.size)),
+      ('Identity', output_transformer.Identity, make_compile_log(args.size)),
+      ('Ninja', lambda: output_transformer.Ninja(width=80),
+       make_ninja_log(args.size)),
+  ]
+
+  print '%-10s %10s %10s %10s' % ('', 'MB/s', 'writes', 'flushes')
+  with open(os.devnull, 'w') as f:
+    for name, make_transformer, data in cases:
+      seconds, output = run(make_transformer(), data, args.chunk_size, f)
+      print '%-10s %10.1f %10d %10d' % (
+          name, len(data) / 1024.0 / 1024.0 / max(seconds, 1e-6),
+          output.writes, output.flushes)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,131 @@
+"""Measure preprocessing the stacktrace of a testcase.
+
+Run from tool/ with:
+  PYTHONPATH=.:../shared:../error:../cmd-editor \
+      python benchmarks/stacktrace_benchmark.py [--lines 100000]
+
+The multi-pass preprocessing is copied here from before testcase.Stacktrace
+replaced it.
+"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import HTMLParser
+import os
+import re
+import time
+
+from clusterfuzz import testcase
+
+
+LINE_TEMPLATES = [
+    '    #%(i)d 0x%(i)x in blink::Node::method%(i)d(int) '
+    '<a href="https://cs.chromium.org/src/node.cc">node.cc:%(i)d</a>',
+    '[Environment] ASAN_OPTIONS = alloc_dealloc_mismatch=0:symbolize=0',
+    'Running command: /mnt/build/d8 --random-seed=&quot;%(i)d&quot; '
+    '--turbo &lt; /mnt/fuzz/testcase-%(i)d.js',
+    '==1==ERROR: AddressSanitizer: heap-use-after-free on address 0x%(i)x',
+    '',
+    '+------Release Build Unsymbolized Stacktrace (diff)------+',
+]
+
+
+def make_lines(count):
+  """Return count stacktrace lines in the JSON format of a testcase."""
+  return [{'content': LINE_TEMPLATES[i % len(LINE_TEMPLATES)] % {'i': i}}
+          for i in xrange(count)]
+
+
+def unescape(string):
+  """The unescaping that Testcase.get_environment_and_args did."""
+  return (string.replace('&lt;', '<').replace('&gt;', '>')
+          .replace('&amp;', '&').replace('&quot;', '"')
+          .replace('&#39;', "'"))
+
+
+def preprocess_multi_pass(lines):
+  """Preprocess the lines the way it was done before, one pass per result."""
+  environment = {}
+  args = ''
+  for line in lines:
+    line = unescape(line['content'])
+    if '[Environment] ' in line:
+      tokens = line.replace('[Environment] ', '').split(' = ')
+      if len(tokens) != 2:
+        continue
+      name, value = tokens
+      if '_OPTIONS' in name:
+        value = value.replace('symbolize=0', 'symbolize=1')
+        if 'symbolize=1' not in value:
+          value += ':symbolize=1'
+      environment[name] = value
+    elif 'Running command: ' in line:
+      tokens = line.replace('Running command: ', '').split(' ')
+      args = ' '.join(tokens[1:len(tokens)-1])
+
+  binary_name = None
+  for line in lines:
+    if 'Running command: ' in line['content']:
+      binary_name = os.path.basename(
+          line['content'].split('Running command: ')[1].split(' ')[0])
+      break
+
+  stripped = [HTMLParser.HTMLParser().unescape(
+      re.sub('<[/a][^<]+?>', '', line['content'])) for line in lines]
+  first_stacktrace = []
+  for line in stripped:
+    line = line.rstrip()
+    if line.startswith('+----') and first_stacktrace:
+      break
+    if first_stacktrace or line:
+      first_stacktrace.append(line)
+
+  return environment, args, binary_name, first_stacktrace
+
+
+def preprocess_single_pass(lines):
+  """Preprocess the lines with testcase.Stacktrace."""
+  stacktrace = testcase.Stacktrace(lines)
+  return (stacktrace.environment, stacktrace.args, stacktrace.binary_name,
+          stacktrace.first_stacktrace)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--lines', type=int, default=100000,
+                      help='The number of lines in the stacktrace.')
+  parser.add_argument('--runs', type=int, default=5,
+                      help='The number of times to preprocess it.')
+  args = parser.parse_args()
+
+  lines = make_lines(args.lines)
+  results = []
+  for name, preprocess in [('multi-pass', preprocess_multi_pass),
+                           ('single-pass', preprocess_single_pass)]:
+    times = []
+    for _ in xrange(args.runs):
+      start = time.time()
+      result = preprocess(lines)
+      times.append(time.time() - start)
+    results.append(result)
+    print '%-12s %8.0fms (best of %d, %d lines)' % (
+        name, min(times) * 1000, args.runs, args.lines)
+
+  if results[0][:3] != results[1][:3]:
+    print 'The environment, args or binary name differ.'
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,188 @@
+"""Measure the startup time of the clusterfuzz command.
+
+Run from tool/ with:
+  PYTHONPATH=.:../shared:../error:../cmd-editor \
+      python benchmarks/startup_benchmark.py [--pex dist/clusterfuzz-x.pex]
+
+With --pex, the pex is also installed with pex_launcher.py, and its cold and
+warm startup are compared with the launcher's.
+"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import pex_launcher  # pylint: disable=wrong-import-position
+
+
+# Runs the command like the entry point of the pex does.
+MAIN_CODE = 'from clusterfuzz import main; main.execute()'
+
+# Python 2 has no `-X importtime`. This wraps __import__ instead and prints
+# the self and cumulative time of every module imported for the first time,
+# in the same format.
+IMPORT_TIME_CODE = r"""
+import __builtin__
+import sys
+import time
+
+original_import = __builtin__.__import__
+children_times = [0]
+
+
+def timed_import(name, globals=None, locals=None, fromlist=None, level=-1):
+  loaded = len(sys.modules)
+  children_times.append(0)
+  start = time.time()
+  try:
+    return original_import(name, globals, locals, fromlist, level)
+  finally:
+    cumulative = time.time() - start
+    children = children_times.pop()
+    children_times[-1] += cumulative
+    if len(sys.modules) > loaded:
+      if fromlist and fromlist[0] != '*':
+        name = '%s (%s)' % (name, ', '.join(fromlist))
+      sys.stderr.write('import time: %9d | %10d | %s%s\n' % (
+          (cumulative - children) * 1e6, cumulative * 1e6,
+          '  ' * (len(children_times) - 1), name))
+
+
+__builtin__.__import__ = timed_import
+""" + MAIN_CODE
+
+
+def get_command(pex_path, code):
+  """Return the command that runs code from the pex or from the source
+    tree."""
+  if pex_path:
+    # The interpreter mode of older pex versions has no `-c`.
+    with tempfile.NamedTemporaryFile(suffix='.py', delete=False) as f:
+      f.write(code)
+    return [pex_path, f.name]
+  return [sys.executable, '-c', code]
+
+
+def get_env(pex_path, home):
+  """Return the environment of the command. It logs to a temporary home so
+    that the benchmark doesn't rotate the real logs."""
+  env = os.environ.copy()
+  env['HOME'] = home
+  if pex_path:
+    # Makes the pex run a script like an interpreter instead of its entry
+    # point.
+    env['PEX_INTERPRETER'] = '1'
+  return env
+
+
+def measure(command, env, runs, setup=None):
+  """Run command and return the sorted wall times in seconds. setup runs
+    before every run and is timed with it."""
+  times = []
+  with open(os.devnull, 'w') as devnull:
+    for _ in xrange(runs):
+      start = time.time()
+      if setup:
+        command = setup()
+      subprocess.check_call(command, env=env, stdout=devnull, stderr=devnull)
+      times.append(time.time() - start)
+  return sorted(times)
+
+
+def print_times(name, times):
+  """Print the min, median and max of times."""
+  print '%-30s %10.0f %10.0f %10.0f' % (
+      name, times[0] * 1000, times[len(times) / 2] * 1000, times[-1] * 1000)
+
+
+def compare_launcher(pex_path, env, runs, home):
+  """Print the cold and warm startup of the pex and of its launcher. A cold
+    run starts with an empty ~/.pex, or a launcher that isn't installed
+    yet."""
+  argv = ['supported_job_types']
+  env = env.copy()
+  del env['PEX_INTERPRETER']
+
+  def clear_pex_root():
+    shutil.rmtree(os.path.join(home, '.pex'), ignore_errors=True)
+    return [pex_path] + argv
+
+  def install_launcher():
+    shutil.rmtree(root, ignore_errors=True)
+    return [pex_launcher.install(pex_path, root)] + argv
+
+  root = tempfile.mkdtemp()
+  try:
+    print_times('pex (cold)', measure(
+        [pex_path] + argv, env, runs, clear_pex_root))
+    print_times('pex (warm)', measure([pex_path] + argv, env, runs))
+    print_times('launcher (cold, installing)', measure(
+        None, env, runs, install_launcher))
+    print_times('launcher (warm)', measure(
+        [pex_launcher.install(pex_path, root)] + argv, env, runs))
+  finally:
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def report_import_times(command, env, count):
+  """Print the imports with the highest cumulative time."""
+  proc = subprocess.Popen(
+      command, env=env, stdout=open(os.devnull, 'w'), stderr=subprocess.PIPE)
+  _, err = proc.communicate()
+
+  lines = [line for line in err.splitlines()
+           if line.startswith('import time:')]
+  lines.sort(key=lambda line: int(line.split('|')[1]), reverse=True)
+  print 'import time: self [us] | cumulative | imported package'
+  for line in lines[:count]:
+    print line
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('--pex', default=None,
+                      help='The pex to measure instead of the source tree.')
+  parser.add_argument('--runs', type=int, default=10,
+                      help='The number of times to run each command.')
+  parser.add_argument('--imports', type=int, default=20,
+                      help='The number of slowest imports to list.')
+  args = parser.parse_args()
+
+  home = os.path.join('/tmp', 'clusterfuzz_startup_benchmark')
+  env = get_env(args.pex, home)
+  commands = [['supported_job_types'], ['reproduce', '--help']]
+
+  print '%-30s %10s %10s %10s' % ('', 'min (ms)', 'median', 'max')
+  for argv in commands:
+    code = 'import sys; sys.argv[1:] = %r; %s' % (argv, MAIN_CODE)
+    print_times(' '.join(argv), measure(
+        get_command(args.pex, code), env, args.runs))
+  if args.pex:
+    compare_launcher(args.pex, env, args.runs, home)
+
+  print
+  code = 'import sys; sys.argv[1:] = %r\n%s' % (
+      commands[0], IMPORT_TIME_CODE)
+  report_import_times(get_command(args.pex, code), env, args.imports)
+
+
+if __name__ == '__main__':
+  main()
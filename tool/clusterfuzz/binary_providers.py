@@ -13,19 +13,26 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import atexit
 import base64
+import fcntl
+import hashlib
 import json
 import logging
-import multiprocessing
 import os
+import re
+import shutil
 import stat
 import string
+import time
 import urllib
 
 import urlfetch
 
+from clusterfuzz import build_tuner
 from clusterfuzz import common
 from clusterfuzz import output_transformer
+from clusterfuzz import task_graph
 from error import error
 
 
@@ -35,11 +42,34 @@ CHECKOUT_MESSAGE = (
     'please re-run with --current.\n'
     'Shall we proceed with the following command:\n'
     '{cmd} in {source_dir}?')
+WORKTREE_POOL_SIZE = 3
+# A worktree whose revision is within this many commits of the wanted revision
+# is checked out to the wanted revision instead of using another worktree.
+WORKTREE_NEAREST_DISTANCE = 1000
+NINJA_PROGRESS_REGEX = re.compile(r'\[(\d+)/(\d+)\]')
+# gn and ninja queries print a lot of output that is only captured.
+QUERY_READ_BUFFER_LENGTH = 65536
+# The targets are passed to ninja in a single `sh -c` argument, which Linux
+# limits to 128KB.
+MAX_TARGETS_LENGTH = 100000
+# The out directories are named after a hash of their args.gn, and listed in
+# this manifest, so that `clusterfuzz out-dirs` can list and prune them.
+OUT_DIRS_MANIFEST_PATH = os.path.join(
+    common.CLUSTERFUZZ_CACHE_DIR, 'out_dirs.json')
+OUT_DIR_HASH_LENGTH = 12
+SOURCE_LOCKS_DIR = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'locks')
 
 
 logger = logging.getLogger('clusterfuzz')
 
 
+# The shas resolved from revisions. A bundle prefills it, so reproducing from
+# a bundle doesn't need to resolve them again.
+resolved_shas = {}
+# The lock files of the source directories that this process has locked.
+source_locks = {}
+
+
 def build_revision_to_sha_url(revision, repo):
   return ('https://cr-rev.appspot.com/_ah/api/crrev/v1/get_numbering?%s' %
           urllib.urlencode({
@@ -52,13 +82,23 @@ def build_revision_to_sha_url(revision, repo):
 
 def sha_from_revision(revision, repo):
   """Converts a chrome revision number to it corresponding git sha."""
-
-  response = urlfetch.fetch(build_revision_to_sha_url(revision, repo))
-  return json.loads(response.body)['git_sha']
+  key = '%s@%s' % (repo, revision)
+  if key not in resolved_shas:
+    response = urlfetch.fetch(build_revision_to_sha_url(revision, repo))
+    resolved_shas[key] = json.loads(response.body)['git_sha']
+  return resolved_shas[key]
 
 
 def get_pdfium_sha(chromium_sha):
   """Gets the correct Pdfium sha using the Chromium sha."""
+  key = 'pdfium@%s' % chromium_sha
+  if key not in resolved_shas:
+    resolved_shas[key] = fetch_pdfium_sha(chromium_sha)
+  return resolved_shas[key]
+
+
+def fetch_pdfium_sha(chromium_sha):
+  """Reads the Pdfium sha from the DEPS file of Chromium."""
   response = urlfetch.fetch(
       ('https://chromium.googlesource.com/chromium/src.git/+/%s/DEPS?'
        'format=TEXT' % chromium_sha))
@@ -69,27 +109,107 @@ def get_pdfium_sha(chromium_sha):
   return sha_line.strip()
 
 
+class GitStatus(object):
+  """Answers queries about a git repository. Object lookups go through a
+    single long-running `git cat-file --batch-check` process instead of
+    spawning git for every query."""
+
+  def __init__(self, source_dir):
+    self.source_dir = source_dir
+    self.cat_file = None
+
+  def get_cat_file(self):
+    """Return the cat-file process, starting it if needed."""
+    if self.cat_file is None or self.cat_file.poll() is not None:
+      self.cat_file = common.start_execute(
+          'git', 'cat-file --batch-check', self.source_dir,
+          print_command=False, stdin=common.BlockStdin())
+    return self.cat_file
+
+  def resolve(self, rev):
+    """Return the sha that rev points to, or None if it doesn't exist."""
+    proc = self.get_cat_file()
+    proc.stdin.write('%s\n' % rev)
+    proc.stdin.flush()
+
+    # The output is `<sha> <type> <size>`, `<rev> missing`, or
+    # `<rev> ambiguous`.
+    tokens = proc.stdout.readline().split()
+    if len(tokens) != 3:
+      return None
+    return tokens[0]
+
+  def sha_exists(self, sha):
+    """Check if sha exists."""
+    return self.resolve(sha) is not None
+
+  def is_dirty(self):
+    """Return true if the tree has uncommitted changes, staged or not.
+      `git diff --quiet` stops at the first difference and reports it through
+      its exit code, so no diff is generated or read. Any other exit code
+      than 0 or 1 is an error, e.g. when the directory isn't a repository."""
+    returncode, _ = common.execute(
+        'git', 'diff --quiet HEAD --', self.source_dir, print_command=False,
+        print_output=False, capture_output=False, exit_on_error=False)
+    if returncode not in (0, 1):
+      raise error.CommandFailedError('git diff --quiet HEAD --', returncode, '')
+    return returncode == 1
+
+  def close(self):
+    """Stop the cat-file process."""
+    if self.cat_file is None:
+      return
+    self.cat_file.stdin.close()
+    self.cat_file.wait()
+    self.cat_file = None
+
+
+git_statuses = {}
+
+
+def git_status(source_dir):
+  """Return the GitStatus of source_dir, which is shared by all callers."""
+  source_dir = os.path.abspath(source_dir)
+  if source_dir not in git_statuses:
+    git_statuses[source_dir] = GitStatus(source_dir)
+  return git_statuses[source_dir]
+
+
+def close_git_statuses():
+  """Stop the cat-file processes of all the GitStatus objects."""
+  for status in git_statuses.itervalues():
+    status.close()
+
+
+atexit.register(close_git_statuses)
+
+
 def sha_exists(sha, source_dir):
   """Check if sha exists."""
-  returncode, _ = common.execute(
-      'git', 'cat-file -e %s' % sha, cwd=source_dir, exit_on_error=False)
-  return returncode == 0
+  return git_status(source_dir).sha_exists(sha)
 
 
 def ensure_sha(sha, source_dir):
   """Ensure the sha exists."""
-  if sha_exists(sha, source_dir):
+  ensure_shas([sha], source_dir)
+
+
+def ensure_shas(shas, source_dir):
+  """Ensure all the shas exist. The existence is checked through the shared
+    cat-file process, and the missing shas are fetched with a single
+    `git fetch`."""
+  missing_shas = [
+      sha for sha in sorted(set(shas)) if not sha_exists(sha, source_dir)]
+  if not missing_shas:
     return
 
-  common.execute('git', 'fetch origin %s' % sha, source_dir)
+  common.execute(
+      'git', 'fetch origin %s' % ' '.join(missing_shas), source_dir)
 
 
 def is_repo_dirty(path):
   """Returns true if the source dir has uncommitted changes."""
-  # `git diff` always return 0 (even when there's change).
-  _, diff_result = common.execute(
-      'git', 'diff', path, print_command=False, print_output=False)
-  return bool(diff_result)
+  return git_status(path).is_dirty()
 
 
 def get_current_sha(source_dir):
@@ -113,6 +233,171 @@ def setup_debug_symbol_if_needed(gn_args, sanitizer, enable_debug):
   return gn_args
 
 
+def read_file_if_exists(path):
+  """Return the content of path, or None if the file doesn't exist."""
+  if not os.path.isfile(path):
+    return None
+
+  with open(path, 'r') as f:
+    return f.read()
+
+
+def is_build_ninja_up_to_date(build_dir):
+  """Return true if build.ninja is newer than all the gn files it was
+    generated from. The inputs are listed in build.ninja.d."""
+  build_ninja_path = os.path.join(build_dir, 'build.ninja')
+  deps = read_file_if_exists('%s.d' % build_ninja_path)
+  if not os.path.isfile(build_ninja_path) or deps is None:
+    return False
+
+  build_ninja_mtime = os.path.getmtime(build_ninja_path)
+  # build.ninja.d contains a single rule: `build.ninja: <input> <input> ...`.
+  for path in deps.partition(':')[2].split():
+    path = os.path.join(build_dir, path)
+    if not os.path.exists(path) or os.path.getmtime(path) > build_ninja_mtime:
+      return False
+  return True
+
+
+def query(binary, args, source_dir):
+  """Run a gn or ninja query quietly and return (returncode, output)."""
+  return common.execute(
+      binary, args, source_dir, print_command=False, print_output=False,
+      exit_on_error=False, read_buffer_length=QUERY_READ_BUFFER_LENGTH)
+
+
+def get_executable_label(source_dir, build_dir, binary_name):
+  """Return the gn label of the executable named binary_name, or None if
+    there isn't exactly one."""
+  returncode, output = query(
+      'gn', 'ls %s --type=executable' % build_dir, source_dir)
+  if returncode != 0:
+    return None
+
+  labels = []
+  for label in output.split():
+    # //chrome is short for //chrome:chrome.
+    name = label.split(':')[1] if ':' in label else label.split('/')[-1]
+    if name == binary_name:
+      labels.append(label)
+  return labels[0] if len(labels) == 1 else None
+
+
+def get_runtime_deps(source_dir, build_dir, label):
+  """Return the runtime deps of label relative to build_dir, or None if gn
+    fails."""
+  returncode, output = query(
+      'gn', 'desc %s %s runtime_deps' % (build_dir, label), source_dir)
+  if returncode != 0:
+    return None
+  return output.split()
+
+
+def get_ninja_outputs(source_dir, build_dir):
+  """Return all the outputs that ninja knows how to build."""
+  returncode, output = query(
+      'ninja', '-C %s -t targets all' % build_dir, source_dir)
+  if returncode != 0:
+    return None
+  # Each line is `<output>: <rule>`.
+  return [line.rpartition(': ')[0] for line in output.splitlines()
+          if ': ' in line]
+
+
+def get_minimal_targets(binary_name, runtime_deps, ninja_outputs):
+  """Return the ninja targets that produce binary_name and its runtime deps,
+    or None if some runtime deps in the build dir cannot be built by ninja.
+    The deps outside the build dir are source files."""
+  ninja_outputs = set(ninja_outputs)
+  targets = [binary_name]
+  for dep in runtime_deps:
+    if dep.startswith('../'):
+      continue
+
+    dep = os.path.normpath(dep)
+    if dep == '.' or dep == binary_name:
+      continue
+    if dep in ninja_outputs:
+      targets.append(dep)
+      continue
+
+    # A directory dep needs all the outputs inside it.
+    prefix = dep + '/'
+    dir_outputs = sorted(o for o in ninja_outputs if o.startswith(prefix))
+    if not dir_outputs:
+      return None
+    targets.extend(dir_outputs)
+
+  return sorted(set(targets), key=targets.index)
+
+
+def count_ninja_steps(source_dir, build_dir, targets):
+  """Return the number of steps ninja needs to build targets, or None if
+    ninja fails."""
+  returncode, output = query(
+      'ninja', '-C %s -n %s' % (build_dir, ' '.join(targets)), source_dir)
+  if returncode != 0:
+    return None
+  matches = NINJA_PROGRESS_REGEX.findall(output)
+  return int(matches[-1][1]) if matches else 0
+
+
+def get_out_dir(source_directory, gn_args):
+  """Return the out directory of the build configuration gn_args. Testcases
+    whose args.gn are the same share it, and are built incrementally."""
+  return os.path.join(
+      source_directory, 'out', 'clusterfuzz_%s' %
+      hashlib.sha1(gn_args).hexdigest()[:OUT_DIR_HASH_LENGTH])
+
+
+def load_out_dirs():
+  """Read the manifest and drop the out directories that don't exist
+    anymore."""
+  out_dirs = common.read_json(OUT_DIRS_MANIFEST_PATH) or []
+  return [d for d in out_dirs if os.path.isdir(d['path'])]
+
+
+def save_out_dirs(out_dirs):
+  """Write the manifest."""
+  try:
+    common.write_json(OUT_DIRS_MANIFEST_PATH, out_dirs)
+  except (IOError, OSError) as e:
+    logger.debug('Unable to write the out directory manifest: %s', e)
+
+
+def record_out_dir(path, job_type, testcase_id):
+  """Record that path was last used to build testcase_id."""
+  out_dirs = [d for d in load_out_dirs() if d['path'] != path]
+  out_dirs.append({'path': path, 'job_type': job_type,
+                   'testcase_id': str(testcase_id), 'last_used': time.time()})
+  save_out_dirs(out_dirs)
+
+
+def lock_source_directory(source_directory):
+  """Wait until no other process builds or reproduces in the source
+    directory, and keep it locked until this process exits. The requests to
+    `clusterfuzz serve` run in processes of their own, and are queued here."""
+  if source_directory in source_locks:
+    return
+
+  if not os.path.exists(SOURCE_LOCKS_DIR):
+    os.makedirs(SOURCE_LOCKS_DIR)
+  lock_file = open(os.path.join(
+      SOURCE_LOCKS_DIR,
+      '%s.lock' % hashlib.sha1(source_directory).hexdigest()[:8]), 'w')
+  # The processes that this process starts, e.g. goma or Xvfb, might outlive
+  # it. They must not inherit the lock, which they would hold.
+  fcntl.fcntl(lock_file, fcntl.F_SETFD,
+              fcntl.fcntl(lock_file, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+  try:
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+  except IOError:
+    logger.info('Waiting for another reproduction in %s to finish...',
+                source_directory)
+    fcntl.flock(lock_file, fcntl.LOCK_EX)
+  source_locks[source_directory] = lock_file
+
+
 def install_build_deps_32bit(source_dir):
   """Run install-build-deps.sh."""
   # preexec_fn is required to be None. Otherwise, it'd fail with:
@@ -123,6 +408,98 @@ def install_build_deps_32bit(source_dir):
       preexec_fn=None, redirect_stderr_to_stdout=True)
 
 
+class WorktreePool(object):
+  """Keeps a small pool of `git worktree` checkouts of a source directory.
+
+    The worktrees are keyed by revision and each has its own out directory.
+    Reproducing testcases at different revisions, therefore, doesn't thrash
+    the user's tree or its build state."""
+
+  def __init__(self, source_directory, size=WORKTREE_POOL_SIZE):
+    self.source_directory = source_directory
+    self.size = size
+    self.pool_directory = os.path.join(
+        common.CLUSTERFUZZ_WORKTREES_DIR,
+        '%s_%s' % (os.path.basename(source_directory),
+                   hashlib.sha1(source_directory).hexdigest()[:8]))
+    self.manifest_path = os.path.join(self.pool_directory, 'manifest.json')
+
+  def load(self):
+    """Read the manifest and drop the worktrees that don't exist anymore."""
+    content = read_file_if_exists(self.manifest_path)
+    if not content:
+      return []
+    return [w for w in json.loads(content) if os.path.isdir(w['path'])]
+
+  def save(self, worktrees):
+    """Write the manifest."""
+    with open(self.manifest_path, 'w') as f:
+      json.dump(worktrees, f, indent=2, sort_keys=True)
+
+  def add_worktree(self, worktrees, sha):
+    """Create a new worktree on sha and return its path."""
+    used_slots = set(
+        os.path.basename(os.path.dirname(w['path'])) for w in worktrees)
+    slot = next(str(i) for i in xrange(len(worktrees) + 1)
+                if str(i) not in used_slots)
+    slot_directory = os.path.join(self.pool_directory, slot)
+    path = os.path.join(
+        slot_directory, os.path.basename(self.source_directory))
+
+    common.delete_if_exists(slot_directory)
+    os.makedirs(slot_directory)
+    common.execute('git', 'worktree prune', self.source_directory)
+    common.execute(
+        'git', 'worktree add --detach %s %s' % (path, sha),
+        self.source_directory)
+
+    # gclient needs .gclient in the parent directory to sync the dependencies
+    # of the new worktree.
+    gclient_path = os.path.join(
+        os.path.dirname(self.source_directory), '.gclient')
+    if os.path.isfile(gclient_path):
+      shutil.copy(gclient_path, slot_directory)
+    return path
+
+  def get_nearest(self, worktrees, revision):
+    """Return the worktree nearest to revision, or None if no worktree is
+      within WORKTREE_NEAREST_DISTANCE."""
+    candidates = [
+        w for w in worktrees
+        if abs(int(w['revision']) - int(revision)) <= WORKTREE_NEAREST_DISTANCE]
+    if not candidates:
+      return None
+    return min(candidates,
+               key=lambda w: abs(int(w['revision']) - int(revision)))
+
+  def acquire(self, revision, sha):
+    """Return the path of a worktree checked out at sha. The worktree on sha
+      is reused if it exists. Otherwise, the nearest worktree is checked out,
+      a new worktree is created, or the least recently used one is checked
+      out, in that order."""
+    if not os.path.exists(self.pool_directory):
+      os.makedirs(self.pool_directory)
+
+    worktrees = self.load()
+    worktree = next((w for w in worktrees if w['sha'] == sha), None)
+    if not worktree:
+      worktree = self.get_nearest(worktrees, revision)
+      if not worktree and len(worktrees) < self.size:
+        worktree = {'path': self.add_worktree(worktrees, sha)}
+        worktrees.append(worktree)
+      else:
+        worktree = worktree or min(worktrees, key=lambda w: w['last_used'])
+        if is_repo_dirty(worktree['path']):
+          raise error.DirtyRepoError(worktree['path'])
+        common.execute('git', 'checkout %s' % sha, worktree['path'])
+
+    logger.info('Using the worktree %s for the revision %s (commit=%s).',
+                worktree['path'], revision, sha)
+    worktree.update(revision=revision, sha=sha, last_used=time.time())
+    self.save(worktrees)
+    return worktree['path']
+
+
 class BinaryProvider(object):
   """Downloads/builds and then provides the location of a binary."""
 
@@ -208,17 +585,16 @@ class GenericBuilder(BinaryProvider):
     self.source_directory = os.environ.get(definition.source_var)
     self.gn_args = None
     self.gn_args_options = None
-    self.gn_flags = '--check'
+    self.effective_gn_args = None
+    self.gn_flags = '--check' if options.gn_check else ''
     self.definition = definition
+    self.tuner = None
+    self.source_synced = False
 
   def out_dir_name(self):
     """Returns the correct out dir in which to build the revision.
-      Directory name is of the format clusterfuzz_<testcase_id>_<git_sha>."""
-
-    dir_name = os.path.join(
-        self.source_directory, 'out',
-        'clusterfuzz_%s' % self.options.testcase_id)
-    return dir_name
+      Directory name is of the format clusterfuzz_<hash of args.gn>."""
+    return get_out_dir(self.source_directory, self.get_gn_args())
 
   def checkout_source_by_sha(self):
     """Checks out the correct revision."""
@@ -242,6 +618,12 @@ class GenericBuilder(BinaryProvider):
     ensure_sha(self.git_sha, self.source_directory)
     common.execute(binary, args, self.source_directory)
 
+  def checkout_worktree(self):
+    """Switches the source directory to a pooled worktree on the revision."""
+    ensure_sha(self.git_sha, self.source_directory)
+    self.source_directory = WorktreePool(self.source_directory).acquire(
+        self.testcase.revision, self.git_sha)
+
   def deserialize_gn_args(self, args):
     """Convert gn args into a dict."""
 
@@ -268,18 +650,12 @@ class GenericBuilder(BinaryProvider):
       gn_args['goma_dir'] = '"%s"' % self.options.goma_dir
     return gn_args
 
-  def setup_gn_args(self):
-    """Ensures that args.gn is set up properly."""
-    # Remove existing gn file from build directory.
-    # TODO(tanin): Refactor the condition to a module function.
-    args_gn_path = os.path.join(self.build_directory, 'args.gn')
-    if os.path.isfile(args_gn_path):
-      os.remove(args_gn_path)
-
-    # Create build directory if it does not already exist.
-    # TODO(tanin): Refactor the condition to a module function.
-    if not os.path.exists(self.build_directory):
-      os.makedirs(self.build_directory)
+  def get_gn_args(self):
+    """Return the args.gn to build with: the args of the testcase or of the
+      downloaded build, with the goma and debug options, as edited by the
+      user. They're computed once, because the user edits them once."""
+    if self.effective_gn_args is not None:
+      return self.effective_gn_args
 
     # If no args.gn file is found, get it from downloaded build.
     # TODO(tanin): Refactor the condition to a module function.
@@ -302,15 +678,36 @@ class GenericBuilder(BinaryProvider):
 
     # Let users edit the current args.
     content = self.serialize_gn_args(args_hash)
-    content = common.edit_if_needed(
+    self.effective_gn_args = common.edit_if_needed(
         content, prefix='edit-args-gn-',
         comment='Edit args.gn before building.',
         should_edit=self.options.edit_mode)
+    return self.effective_gn_args
+
+  def setup_gn_args(self):
+    """Ensures that args.gn is set up properly."""
+    args_gn_path = os.path.join(self.build_directory, 'args.gn')
+
+    # Create build directory if it does not already exist.
+    # TODO(tanin): Refactor the condition to a module function.
+    if not os.path.exists(self.build_directory):
+      os.makedirs(self.build_directory)
+
+    content = self.get_gn_args()
+
+    # Rewriting args.gn and running `gn gen` invalidate build.ninja, which
+    # costs a lot of time on a large tree. Skip both if nothing has changed.
+    self.gn_args = content
+    if (read_file_if_exists(args_gn_path) == content and
+        is_build_ninja_up_to_date(self.build_directory)):
+      logger.info(
+          '%s is unchanged and build.ninja is up-to-date. Skip `gn gen`.',
+          args_gn_path)
+      return
 
     # Write args to file and store.
     with open(args_gn_path, 'w') as f:
       f.write(content)
-    self.gn_args = content
 
     logger.info(
         common.colorize('\nGenerating %s:\n%s\n', common.BASH_GREEN_MARKER),
@@ -323,36 +720,51 @@ class GenericBuilder(BinaryProvider):
     """Steps to be run before the target is built."""
     pass
 
+  def get_tuner(self):
+    """Return the tuner for the parallelism of ninja."""
+    if not self.tuner:
+      self.tuner = build_tuner.NinjaTuner(use_goma=bool(self.options.goma_dir))
+    return self.tuner
+
+  def get_targets(self):
+    """Return the ninja targets to build."""
+    return [self.target]
+
   def get_goma_cores(self):
     """Choose the correct amount of GOMA cores for a build."""
     if self.options.goma_threads:
       return self.options.goma_threads
-    else:
-      cpu_count = multiprocessing.cpu_count()
-      return 50 * cpu_count if self.options.goma_dir else (3 * cpu_count) / 4
+    return self.get_tuner().get_jobs()
 
   def get_goma_load(self):
     """Choose the correct amount of GOMA load for a build."""
     if self.options.goma_load:
       return self.options.goma_load
-    return multiprocessing.cpu_count() * 2
+    return self.get_tuner().get_load()
+
+  def sync_source(self):
+    """Run `gclient sync` once, unless it's disabled."""
+    if self.options.disable_gclient or self.source_synced:
+      return
+    common.execute('gclient', 'sync', self.source_directory)
+    self.source_synced = True
 
   def build_target(self):
     """Build the correct revision in the source directory."""
-    if not self.options.disable_gclient:
-      common.execute('gclient', 'sync', self.source_directory)
-
+    self.sync_source()
     self.pre_build_steps()
     self.setup_gn_args()
     goma_cores = self.get_goma_cores()
     goma_load = self.get_goma_load()
 
-    common.execute(
-        'ninja',
-        "-w 'dupbuild=err' -C %s -j %i -l %i %s" % (
-            self.build_directory, goma_cores, goma_load, self.target),
-        self.source_directory, capture_output=False,
-        stdout_transformer=output_transformer.Ninja())
+    with self.get_tuner().monitor(self.build_directory):
+      common.execute(
+          'ninja',
+          "-w 'dupbuild=err' -C %s -j %i -l %i %s" % (
+              self.build_directory, goma_cores, goma_load,
+              ' '.join(self.get_targets())),
+          self.source_directory, capture_output=False,
+          stdout_transformer=output_transformer.Ninja())
 
   def get_build_directory(self):
     """Returns the location of the correct build to use for reproduction."""
@@ -360,19 +772,29 @@ class GenericBuilder(BinaryProvider):
     if self.build_directory:
       return self.build_directory
 
-    if not self.gn_args:
-      self.download_build_data()
-
-    self.build_directory = self.build_dir_name()
-
     if not self.source_directory:
       self.source_directory = common.get_source_directory(self.name)
+    lock_source_directory(self.source_directory)
 
+    # The checkout may ask the user; therefore, it runs alone.
     if not self.options.current:
-      self.checkout_source_by_sha()
+      if self.options.worktree:
+        self.checkout_worktree()
+      else:
+        self.checkout_source_by_sha()
+
+    # The args.gn of the downloaded build is only needed after `gclient sync`.
+    graph = task_graph.TaskGraph('source and build download')
+    graph.add('gclient sync', self.sync_source)
+    if not self.gn_args:
+      graph.add('build download', self.download_build_data)
+    graph.run()
+    graph.log_critical_path(logging.DEBUG)
 
     self.build_directory = self.out_dir_name()
     self.build_target()
+    record_out_dir(
+        self.build_directory, self.testcase.job_type, self.testcase_id)
 
     return self.build_directory
 
@@ -425,7 +847,7 @@ class ChromiumBuilder(GenericBuilder):
     if definition.target:
       target_name = definition.target
     if not binary_name:
-      binary_name = common.get_binary_name(testcase.stacktrace_lines)
+      binary_name = testcase.get_binary_name()
 
     super(ChromiumBuilder, self).__init__(
         testcase=testcase,
@@ -445,6 +867,47 @@ class ChromiumBuilder(GenericBuilder):
                      self.source_directory)
 
 
+  def get_targets(self):
+    """Return the binary and its runtime deps instead of the meta-target
+      (e.g. chromium_builder_asan), which is much bigger. Fall back to the
+      meta-target when the runtime deps are incomplete."""
+    if self.target == self.binary_name:
+      return [self.target]
+
+    label = get_executable_label(
+        self.source_directory, self.build_directory, self.binary_name)
+    runtime_deps = label and get_runtime_deps(
+        self.source_directory, self.build_directory, label)
+    ninja_outputs = runtime_deps and get_ninja_outputs(
+        self.source_directory, self.build_directory)
+    targets = ninja_outputs and get_minimal_targets(
+        self.binary_name, runtime_deps, ninja_outputs)
+    if not targets:
+      logger.info(
+          'Cannot get the complete runtime deps of %s. Building %s instead.',
+          self.binary_name, self.target)
+      return [self.target]
+
+    if len(' '.join(targets)) > MAX_TARGETS_LENGTH:
+      logger.info('%s has too many runtime deps. Building %s instead.',
+                  self.binary_name, self.target)
+      return [self.target]
+
+    steps = count_ninja_steps(
+        self.source_directory, self.build_directory, targets)
+    if steps is None:
+      logger.info('Cannot build the runtime deps of %s. Building %s instead.',
+                  self.binary_name, self.target)
+      return [self.target]
+
+    logger.info(
+        common.colorize(
+            'Building %s and its %d runtime deps instead of %s: %d steps.',
+            common.BASH_GREEN_MARKER),
+        self.binary_name, len(targets) - 1, self.target, steps)
+    return targets
+
+
 class CfiChromiumBuilder(ChromiumBuilder):
   """Build a CFI chromium build."""
 
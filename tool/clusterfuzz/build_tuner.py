@@ -0,0 +1,241 @@
+"""Tunes the parallelism of ninja builds from the load of the machine."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import contextlib
+import logging
+import multiprocessing
+import os
+import threading
+
+import psutil
+
+from clusterfuzz import common
+
+
+GIB = 1024 ** 3
+MIB = 1024 ** 2
+STATS_FILE_PATH = os.path.join(
+    common.CLUSTERFUZZ_CACHE_DIR, 'ninja_stats.json')
+
+# Links always run locally, so the memory of one link job is reserved.
+LINK_JOB_MEMORY = 8 * GIB
+# The local memory used by a compile job with and without goma.
+GOMA_JOB_MEMORY = 50 * MIB
+LOCAL_JOB_MEMORY = 1 * GIB
+# A build is under memory pressure when the available memory drops below this.
+LOW_MEMORY = 1 * GIB
+MEMORY_SAMPLING_INTERVAL = 1
+
+# With goma, a job mostly waits for the backend. We keep enough jobs in flight
+# for GOMA_COMPILES_PER_CPU_SECOND compiles to return per cpu every second.
+# With DEFAULT_GOMA_LATENCY, it's 50 jobs per cpu.
+GOMA_COMPILES_PER_CPU_SECOND = 10
+DEFAULT_GOMA_LATENCY = 5
+MAX_GOMA_JOBS_PER_CPU = 200
+
+# After a build under memory pressure, the parallelism is halved. After a build
+# without pressure, it grows back by 25% until it reaches the full parallelism.
+MEMORY_PRESSURE_SCALE = 0.5
+RECOVERY_SCALE = 1.25
+
+# The number of slowest compile and link steps listed after a build.
+SLOWEST_STEPS_COUNT = 5
+COMPILE_EXTENSIONS = ('.o', '.obj')
+LINK_EXTENSIONS = ('', '.so', '.dylib', '.exe', '.dll')
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_available_memory():
+  """Return the available memory in bytes."""
+  return psutil.virtual_memory().available
+
+
+def read_ninja_log(path, offset=0):
+  """Read the edges as (start_ms, end_ms, output) from .ninja_log, starting
+    from the byte offset."""
+  if not os.path.isfile(path):
+    return []
+
+  # ninja might have recompacted the log, which makes the offset invalid.
+  if os.path.getsize(path) < offset:
+    offset = 0
+
+  edges = []
+  with open(path, 'r') as f:
+    f.seek(offset)
+    for line in f:
+      if line.startswith('#'):
+        continue
+      tokens = line.rstrip('\n').split('\t')
+      if len(tokens) < 4:
+        continue
+      edges.append((int(tokens[0]), int(tokens[1]), tokens[3]))
+  return edges
+
+
+def get_step_kind(output):
+  """Return whether the output is produced by a compile or a link step."""
+  extension = os.path.splitext(output)[1]
+  if extension in COMPILE_EXTENSIONS:
+    return 'compile'
+  if extension in LINK_EXTENSIONS:
+    return 'link'
+  return None
+
+
+def summarize_edges(edges):
+  """Return a summary of the build time of the edges: the overall rate and
+    the slowest compile and link steps."""
+  if not edges:
+    return None
+
+  elapsed = (max(end for _, end, _ in edges) -
+             min(start for start, _, _ in edges)) / 1000.0
+  lines = ['Built %d steps in %.1fs (%.1f steps/s).' % (
+      len(edges), elapsed, len(edges) / max(elapsed, 0.001))]
+
+  for kind in ['compile', 'link']:
+    steps = sorted(
+        ((end - start, output) for start, end, output in edges
+         if get_step_kind(output) == kind), reverse=True)
+    if not steps:
+      continue
+    lines.append('Slowest %s steps:' % kind)
+    for duration, output in steps[:SLOWEST_STEPS_COUNT]:
+      lines.append('  %7.1fs %s' % (duration / 1000.0, output))
+  return '\n'.join(lines)
+
+
+class MemoryMonitor(object):
+  """Samples the available memory in a background thread and keeps the
+    minimum."""
+
+  def __init__(self, interval=MEMORY_SAMPLING_INTERVAL):
+    self.interval = interval
+    self.min_available = None
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.run)
+    self.thread.daemon = True
+
+  def run(self):
+    """Sample until stopped."""
+    while True:
+      available = get_available_memory()
+      if self.min_available is None or available < self.min_available:
+        self.min_available = available
+      if self.stopped.wait(self.interval):
+        return
+
+  def __enter__(self):
+    self.thread.start()
+    return self
+
+  def __exit__(self, unused_type, unused_value, unused_traceback):
+    self.stopped.set()
+    self.thread.join()
+
+
+class NinjaTuner(object):
+  """Picks -j and -l for ninja from the available memory, the memory of link
+    jobs, and the goma latency. The parallelism is adjusted between builds
+    using the stats recorded from the previous build."""
+
+  def __init__(self, use_goma, stats_path=STATS_FILE_PATH):
+    self.use_goma = use_goma
+    self.key = 'goma' if use_goma else 'local'
+    self.stats_path = stats_path
+    self.stats = self.load_all_stats().get(self.key, {})
+
+  def load_all_stats(self):
+    """Read the stats of all kinds of builds."""
+    return common.read_json(self.stats_path) or {}
+
+  def save_stats(self):
+    """Store the stats of this kind of build."""
+    all_stats = self.load_all_stats()
+    all_stats[self.key] = self.stats
+    common.write_json(self.stats_path, all_stats)
+
+  def get_scale(self):
+    """Return the scale learned from the previous builds."""
+    return self.stats.get('scale', 1.0)
+
+  def get_jobs(self):
+    """Return the number of concurrent jobs."""
+    cpu_count = multiprocessing.cpu_count()
+    # The available memory doesn't lower the parallelism below one job per
+    # cpu with goma, or below the usual local parallelism. Only the memory
+    # pressure seen in a previous build does, through the scale.
+    if self.use_goma:
+      latency = self.stats.get('compile_latency', DEFAULT_GOMA_LATENCY)
+      jobs = cpu_count * min(GOMA_COMPILES_PER_CPU_SECOND * latency,
+                             MAX_GOMA_JOBS_PER_CPU)
+      min_jobs = cpu_count
+      job_memory = GOMA_JOB_MEMORY
+    else:
+      jobs = (3 * cpu_count) / 4
+      min_jobs = jobs
+      job_memory = LOCAL_JOB_MEMORY
+
+    available = get_available_memory()
+    if available > LINK_JOB_MEMORY:
+      available -= LINK_JOB_MEMORY
+    memory_jobs = max(min_jobs, available / job_memory)
+    return max(1, int(min(jobs, memory_jobs) * self.get_scale()))
+
+  def get_load(self):
+    """Return the maximum load average."""
+    return max(1, int(multiprocessing.cpu_count() * 2 * self.get_scale()))
+
+  def record(self, edges, min_available_memory):
+    """Update the stats with the edges built and the minimum available memory
+      seen during the build."""
+    if (min_available_memory is not None and
+        min_available_memory < LOW_MEMORY):
+      self.stats['scale'] = self.get_scale() * MEMORY_PRESSURE_SCALE
+      logger.info(
+          'The build ran low on memory (%d MiB available). The next build will '
+          'use fewer jobs.', min_available_memory / MIB)
+    else:
+      self.stats['scale'] = min(1.0, self.get_scale() * RECOVERY_SCALE)
+
+    compile_durations = [
+        end - start for start, end, output in edges
+        if output.endswith(COMPILE_EXTENSIONS)]
+    if compile_durations:
+      self.stats['compile_latency'] = (
+          sum(compile_durations) / 1000.0 / len(compile_durations))
+    self.stats['min_available_memory'] = min_available_memory
+    self.save_stats()
+
+  @contextlib.contextmanager
+  def monitor(self, build_directory):
+    """Record the stats of the build that runs inside this context."""
+    log_path = os.path.join(build_directory, '.ninja_log')
+    offset = os.path.getsize(log_path) if os.path.isfile(log_path) else 0
+
+    # The stats are recorded even when the build fails because a failure
+    # might be caused by running out of memory.
+    memory = MemoryMonitor()
+    try:
+      with memory:
+        yield
+    finally:
+      edges = read_ninja_log(log_path, offset)
+      self.record(edges, memory.min_available)
+      summary = summarize_edges(edges)
+      if summary:
+        logger.info(summary)
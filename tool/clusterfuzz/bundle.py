@@ -0,0 +1,104 @@
+"""Offline testcase bundles that hold everything needed to reproduce a
+  testcase without talking to ClusterFuzz."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import zipfile
+
+from clusterfuzz import common
+from error import error
+
+
+BUNDLE_VERSION = 1
+MANIFEST_NAME = 'bundle.json'
+TESTCASE_FILES_DIR = 'testcase'
+
+
+def write(path, testcase_json, testcase_files, shas, gn_args,
+          crash_signature):
+  """Write a bundle with the testcase JSON, the downloaded testcase files, the
+    resolved shas, args.gn and the original crash signature. A testcase
+    without args.gn is built with the args.gn of its downloaded build; the
+    field is left out then."""
+  manifest = {
+      'version': BUNDLE_VERSION,
+      'testcase': testcase_json,
+      'testcase_files': [os.path.basename(f) for f in testcase_files],
+      'shas': shas,
+      'crash_signature': {
+          'crash_type': crash_signature.crash_type,
+          'crash_state_lines': list(crash_signature.crash_state_lines)}}
+  if gn_args is not None:
+    manifest['gn_args'] = gn_args
+
+  with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as bundle_zip:
+    bundle_zip.writestr(
+        MANIFEST_NAME, json.dumps(manifest, indent=2, sort_keys=True))
+    for testcase_file in testcase_files:
+      bundle_zip.write(
+          testcase_file,
+          os.path.join(TESTCASE_FILES_DIR, os.path.basename(testcase_file)))
+
+
+class Bundle(object):
+  """A testcase bundle written by `clusterfuzz export`."""
+
+  def __init__(self, path):
+    self.path = path
+    try:
+      with zipfile.ZipFile(path, 'r') as bundle_zip:
+        manifest = json.loads(bundle_zip.read(MANIFEST_NAME))
+    except (IOError, KeyError, ValueError, zipfile.BadZipfile) as e:
+      raise error.BadBundleError(path, str(e))
+
+    if not isinstance(manifest, dict):
+      raise error.BadBundleError(path, 'its manifest is not an object')
+    if manifest.get('version') != BUNDLE_VERSION:
+      raise error.BadBundleError(
+          path, 'version %s is not supported' % manifest.get('version'))
+
+    try:
+      self.testcase_json = manifest['testcase']
+      self.testcase_id = self.testcase_json['id']
+      self.testcase_files = manifest['testcase_files']
+      self.shas = manifest['shas']
+      self.gn_args = manifest.get('gn_args')
+      self.crash_signature = common.CrashSignature(
+          manifest['crash_signature']['crash_type'],
+          manifest['crash_signature']['crash_state_lines'])
+    except KeyError as e:
+      raise error.BadBundleError(path, 'its manifest has no %s' % e)
+    except TypeError as e:
+      raise error.BadBundleError(path, 'its manifest is malformed (%s)' % e)
+
+    # The names are joined onto the destination directory, so they must not
+    # point outside of it.
+    for name in self.testcase_files:
+      if os.path.basename(name) != name or name in ['', '.', '..']:
+        raise error.BadBundleError(
+            path, '%r is not a valid testcase file name' % name)
+
+  def extract_testcase_files(self, dest_dir):
+    """Extract the testcase files to dest_dir and return their names."""
+    with zipfile.ZipFile(self.path, 'r') as bundle_zip:
+      for name in self.testcase_files:
+        try:
+          data = bundle_zip.read(os.path.join(TESTCASE_FILES_DIR, name))
+        except KeyError:
+          raise error.BadBundleError(self.path, '%s is missing' % name)
+        with open(os.path.join(dest_dir, name), 'wb') as f:
+          f.write(data)
+    return self.testcase_files
@@ -0,0 +1,63 @@
+"""Module for the 'export' command.
+
+Writes an offline bundle of a testcase for `reproduce --bundle`."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import shutil
+import tempfile
+
+from clusterfuzz import binary_providers
+from clusterfuzz import bundle
+from clusterfuzz import reproducers
+from clusterfuzz import testcase
+from clusterfuzz.commands import reproduce
+
+DEFAULT_OUTPUT = 'clusterfuzz_testcase_%s.zip'
+logger = logging.getLogger('clusterfuzz')
+
+
+def execute(testcase_id, output=None):
+  """Write the testcase JSON, the testcase file, the resolved shas, args.gn
+    and the original crash signature to a bundle."""
+  output = output or DEFAULT_OUTPUT % testcase_id
+  testcase_json = reproduce.get_testcase_info(testcase_id)
+  current_testcase = testcase.Testcase(testcase_json)
+
+  # Creating the builder resolves the shas of the testcase's revision, which
+  # are recorded in binary_providers.resolved_shas.
+  definition = reproduce.get_definition(current_testcase.job_type, 'chromium')
+  definition.builder(
+      testcase=current_testcase, definition=definition,
+      options=reproduce.get_query_options(testcase_id))
+  crash_signature = reproducers.get_original_crash_signature(current_testcase)
+  if current_testcase.gn_args is None:
+    logger.info(
+        'Testcase %s has no args.gn. Reproducing the bundle will use the '
+        'args.gn of the downloaded build, which needs network access.',
+        testcase_id)
+
+  testcase_dir = tempfile.mkdtemp(prefix='clusterfuzz-export-')
+  try:
+    filename = current_testcase.download_testcase(testcase_dir)
+    bundle.write(
+        output, testcase_json, [os.path.join(testcase_dir, filename)],
+        dict(binary_providers.resolved_shas), current_testcase.gn_args,
+        crash_signature)
+  finally:
+    shutil.rmtree(testcase_dir)
+
+  logger.info('Exported testcase %s to %s', testcase_id, output)
@@ -0,0 +1,216 @@
+"""Module for the 'job-server' command.
+
+Hands the testcases listed in a file out to `clusterfuzz worker` processes,
+which may run on other machines, and writes the results that they send back.
+A worker gets the testcases that need a build it already has, so that every
+build is made or downloaded by as few workers as possible."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import logging
+import sys
+import time
+from SimpleXMLRPCServer import SimpleXMLRPCServer
+
+from clusterfuzz.commands import reproduce_batch
+
+# A job that isn't done this long after a worker took it is handed out again,
+# because the worker might be gone. It covers a full build without GOMA.
+LEASE_SECONDS = 12 * 60 * 60
+# The seconds that handling requests waits before checking whether all the
+# jobs are done.
+POLL_INTERVAL = 0.5
+
+logger = logging.getLogger('clusterfuzz')
+
+
+class Job(object):
+  """A testcase to reproduce, and the key of the build it needs."""
+
+  def __init__(self, job_id, testcase_id, key, group):
+    self.id = job_id
+    self.testcase_id = testcase_id
+    self.key = key
+    self.group = group
+    self.worker_id = None
+    self.lease_time = None
+
+  def to_dict(self):
+    return {'id': self.id, 'testcase_id': self.testcase_id, 'key': self.key,
+            'group': self.group}
+
+
+class JobQueue(object):
+  """Leases the jobs to the workers. It isn't thread-safe; the server handles
+    one request at a time."""
+
+  def __init__(self, jobs, lease_seconds=LEASE_SECONDS):
+    self.pending = collections.OrderedDict((job.id, job) for job in jobs)
+    self.leased = {}
+    self.lease_seconds = lease_seconds
+    # The build keys that each worker has, as it reported them last.
+    self.worker_keys = {}
+
+  def requeue_expired(self):
+    """Hand the jobs whose lease expired out again."""
+    now = time.time()
+    for job in self.leased.values():
+      if now - job.lease_time > self.lease_seconds:
+        logger.info('Worker %s did not finish testcase %s in time. Requeuing.',
+                    job.worker_id, job.testcase_id)
+        del self.leased[job.id]
+        self.pending[job.id] = job
+
+  def is_claimed(self, key, worker_id):
+    """Return whether another worker has the build of key, or is getting
+      it."""
+    for other_id, keys in self.worker_keys.iteritems():
+      if other_id != worker_id and key in keys:
+        return True
+    return any(job.key == key and job.worker_id != worker_id
+               for job in self.leased.itervalues())
+
+  def pick(self, worker_id, build_keys):
+    """Return the job that the worker should run next: the oldest one that
+      needs a build it has, else one whose build nobody has, else the oldest
+      one."""
+    jobs = self.pending.values()
+    for job in jobs:
+      if job.key in build_keys:
+        return job
+    for job in jobs:
+      if not self.is_claimed(job.key, worker_id):
+        return job
+    return jobs[0]
+
+  def get(self, worker_id, build_keys):
+    """Lease a job to the worker, and return it. Return None when there is
+      nothing to hand out."""
+    self.requeue_expired()
+    self.worker_keys[worker_id] = set(build_keys)
+    if not self.pending:
+      return None
+
+    job = self.pick(worker_id, build_keys)
+    del self.pending[job.id]
+    job.worker_id = worker_id
+    job.lease_time = time.time()
+    self.leased[job.id] = job
+    return job
+
+  def finish(self, job_id):
+    """Mark the job as done. Return False if it was done already, e.g. by
+      another worker after the lease expired."""
+    job = self.leased.pop(job_id, None) or self.pending.pop(job_id, None)
+    return job is not None
+
+  def is_done(self):
+    return not self.pending and not self.leased
+
+
+class JobServer(object):
+  """The functions that the workers call."""
+
+  def __init__(self, queue, writer, options):
+    self.queue = queue
+    self.writer = writer
+    self.options = options
+
+  def get_job(self, worker_id, build_keys):
+    """Return the next job of the worker, with the options to reproduce it
+      with. The status is 'wait' when the remaining jobs are all leased, and
+      'done' when all the jobs are done."""
+    job = self.queue.get(worker_id, build_keys)
+    if job:
+      logger.info('Worker %s takes testcase %s.', worker_id, job.testcase_id)
+      return {'status': 'job', 'job': job.to_dict(), 'options': self.options}
+    return {'status': 'done' if self.queue.is_done() else 'wait'}
+
+  def put_result(self, worker_id, job_id, result):
+    """Write the result of a job."""
+    if not self.queue.finish(job_id):
+      logger.info('Ignoring the late result of worker %s for job %s.',
+                  worker_id, job_id)
+      return False
+
+    result = dict(result)
+    self.writer.write(result.pop('testcase_id'), result.pop('status'),
+                      worker=worker_id, **result)
+    return True
+
+
+def create_server(host, port, job_server):
+  """Return the XML-RPC server of job_server. Port 0 picks a free port."""
+  server = SimpleXMLRPCServer(
+      (host, port), allow_none=True, logRequests=False)
+  server.timeout = POLL_INTERVAL
+  server.register_instance(job_server)
+  return server
+
+
+def get_jobs(groups):
+  """Return a job per testcase. The key of a job is the group key, as a
+    string that can be sent to the workers."""
+  jobs = []
+  for group, (key, members) in enumerate(groups.iteritems()):
+    key = json.dumps(list(key))
+    for current_testcase, _ in members:
+      jobs.append(Job(len(jobs), str(current_testcase.id), key, group))
+  return jobs
+
+
+def serve(server, queue):
+  """Handle the requests of the workers until all the jobs are done."""
+  try:
+    while not queue.is_done():
+      server.handle_request()
+  finally:
+    server.server_close()
+
+
+def execute(input_file, output, host, port, current, build, disable_goma,
+            goma_threads, goma_load, iterations, disable_xvfb, target_args,
+            disable_gclient, gn_check, worktree):
+  """Serve the testcases listed in input_file to the workers, and append
+    their results to output. Exit once every testcase has a result."""
+  if input_file == '-':
+    testcase_ids = reproduce_batch.read_testcase_ids(sys.stdin)
+  else:
+    with open(input_file, 'r') as f:
+      testcase_ids = reproduce_batch.read_testcase_ids(f)
+
+  output_file = open(output, 'a')
+  try:
+    writer = reproduce_batch.ResultWriter(output_file)
+    groups = reproduce_batch.group_testcases(testcase_ids, build, writer)
+    queue = JobQueue(get_jobs(groups))
+    # The workers fill in testcase_id and goma_dir.
+    options = {
+        'current': current, 'build': build, 'disable_goma': disable_goma,
+        'goma_threads': goma_threads, 'goma_load': goma_load,
+        'iterations': iterations, 'disable_xvfb': disable_xvfb,
+        'target_args': target_args, 'edit_mode': False,
+        'disable_gclient': disable_gclient, 'enable_debug': False,
+        'gn_check': gn_check, 'worktree': worktree}
+    server = create_server(host, port, JobServer(queue, writer, options))
+    logger.info(
+        'Serving %d testcases in %d groups on http://%s:%d. Start workers '
+        'with `clusterfuzz worker --server http://%s:%d`.',
+        len(queue.pending), len(groups), host, server.server_address[1],
+        host, server.server_address[1])
+    serve(server, queue)
+  finally:
+    output_file.close()
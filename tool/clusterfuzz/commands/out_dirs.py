@@ -0,0 +1,61 @@
+"""Module for the 'out-dirs' command.
+
+Lists the out directories that ClusterFuzz built in, and prunes the ones that
+haven't been used for a while."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import time
+
+from clusterfuzz import binary_providers
+from clusterfuzz import common
+
+logger = logging.getLogger('clusterfuzz')
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def format_out_dir(out_dir):
+  """Return a line that describes the out directory."""
+  return '%s (%s, last used %.1f days ago by testcase %s)' % (
+      out_dir['path'], out_dir['job_type'],
+      (time.time() - out_dir['last_used']) / SECONDS_PER_DAY,
+      out_dir['testcase_id'])
+
+
+def execute(prune):
+  """List the out directories, or delete the ones that haven't been used for
+    prune days."""
+  out_dirs = sorted(binary_providers.load_out_dirs(),
+                    key=lambda d: d['last_used'], reverse=True)
+  if prune is None:
+    if not out_dirs:
+      logger.info('There are no out directories.')
+    for out_dir in out_dirs:
+      logger.info(format_out_dir(out_dir))
+    return
+
+  deadline = time.time() - prune * SECONDS_PER_DAY
+  unused = [d for d in out_dirs if d['last_used'] < deadline]
+  if not unused:
+    logger.info('No out directory has been unused for %d days.', prune)
+    return
+
+  common.check_confirm('Delete these out directories?\n%s' % '\n'.join(
+      format_out_dir(out_dir) for out_dir in unused))
+  for out_dir in unused:
+    logger.info('Deleting %s', out_dir['path'])
+    common.delete_if_exists(out_dir['path'])
+  binary_providers.save_out_dirs([d for d in out_dirs if d not in unused])
@@ -0,0 +1,60 @@
+"""Module for the 'prefetch' command.
+
+Fetches the commits needed by testcases ahead of reproducing them."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+
+from clusterfuzz import binary_providers
+from clusterfuzz import testcase
+from clusterfuzz.commands import reproduce
+from error import error
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_source_and_sha(testcase_id):
+  """Return the source directory and the sha needed to build the testcase."""
+  options = reproduce.get_query_options(testcase_id)
+  current_testcase = testcase.Testcase(
+      reproduce.get_testcase_info(testcase_id))
+  definition = reproduce.get_definition(current_testcase.job_type, 'chromium')
+  builder = definition.builder(
+      testcase=current_testcase, definition=definition, options=options)
+  return builder.source_directory, builder.git_sha
+
+
+def execute(testcase_ids):
+  """Fetch the missing commits of all testcases with a single `git fetch` per
+    source directory."""
+  shas = collections.defaultdict(set)
+  for testcase_id in testcase_ids:
+    try:
+      source_dir, sha = get_source_and_sha(testcase_id)
+    except error.ExpectedException as e:
+      logger.info('Skip prefetching testcase %s: %s', testcase_id, e.message)
+      continue
+
+    if not source_dir:
+      logger.info(
+          'Skip prefetching testcase %s because its source directory is not '
+          'defined.', testcase_id)
+      continue
+    shas[source_dir].add(sha)
+
+  for source_dir, source_shas in shas.iteritems():
+    logger.info('Prefetching %d commits in %s', len(source_shas), source_dir)
+    binary_providers.ensure_shas(source_shas, source_dir)
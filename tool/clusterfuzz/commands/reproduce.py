@@ -17,13 +17,17 @@ Locally reproduces a testcase given a Clusterfuzz ID."""
 
 import os
 import json
+import threading
+import time
 import urllib
 import webbrowser
 import logging
-import yaml
 
+from clusterfuzz import bundle
 from clusterfuzz import common
+from clusterfuzz import job_types
 from clusterfuzz import stackdriver_logging
+from clusterfuzz import task_graph
 from clusterfuzz import testcase
 from clusterfuzz import binary_providers
 from clusterfuzz import reproducers
@@ -41,8 +45,16 @@ GOOGLE_OAUTH_URL = 'https://accounts.google.com/o/oauth2/v2/auth?%s' % (
                       'c7bn50f.apps.googleusercontent.com'),
         'response_type': 'code',
         'redirect_uri': 'urn:ietf:wg:oauth:2.0:oob'}))
+# The cached testcase information is used as is within TESTCASE_INFO_TTL. Up
+# to TESTCASE_INFO_MAX_AGE, it's used while a fresh copy is fetched in the
+# background for the next run.
+TESTCASE_INFO_TTL = 60 * 60
+TESTCASE_INFO_MAX_AGE = 24 * 60 * 60
 logger = logging.getLogger('clusterfuzz')
 
+# The binary definitions of the supported jobs by build type and job type.
+supported_jobs = {}
+
 
 class SuppressOutput(object):
   """Suppress stdout and stderr. We need this because there's no way to suppress
@@ -79,13 +91,19 @@ def get_verification_header():
   return 'VerificationCode %s' % verification
 
 
-def send_request(url, data):
+def send_request(url, data, interactive=True):
   """Get a clusterfuzz url that requires authentication.
 
   Attempts to authenticate and is guaranteed to either
-  return a valid, authorized response or throw an exception."""
+  return a valid, authorized response or throw an exception. Without
+  interactive, the user is never asked to authenticate."""
+
+  header = common.get_stored_auth_header()
+  if not header:
+    if not interactive:
+      raise error.ClusterfuzzAuthError('No stored authorization.')
+    header = get_verification_header()
 
-  header = common.get_stored_auth_header() or get_verification_header()
   response = None
   for _ in range(2):
     response = common.post(
@@ -94,7 +112,7 @@ def send_request(url, data):
             'User-Agent': 'clusterfuzz-tools'},
         allow_redirects=True, data=data)
 
-    if response.status_code == 401:  # The access token expired.
+    if response.status_code == 401 and interactive:  # The token expired.
       header = get_verification_header()
     else:  # Other errors or success
       break
@@ -105,7 +123,7 @@ def send_request(url, data):
   common.store_auth_header(response.headers[CLUSTERFUZZ_AUTH_HEADER])
   return response
 
-def get_testcase_info(testcase_id):
+def fetch_testcase_info(testcase_id, interactive=True):
   """Pulls testcase information from Clusterfuzz.
 
   Returns a dictionary with the JSON response if the
@@ -113,7 +131,56 @@ def get_testcase_info(testcase_id):
   """
 
   data = json.dumps({'testcaseId': testcase_id})
-  return json.loads(send_request(CLUSTERFUZZ_TESTCASE_INFO_URL, data).text)
+  return json.loads(
+      send_request(CLUSTERFUZZ_TESTCASE_INFO_URL, data, interactive).text)
+
+
+def get_testcase_info_path(testcase_id):
+  """Return the path of the cached testcase information."""
+  return os.path.join(testcase.get_cache_dir(testcase_id), 'info.json')
+
+
+def fetch_and_cache_testcase_info(testcase_id, interactive=True):
+  """Pull the testcase information from Clusterfuzz and cache it."""
+  response = fetch_testcase_info(testcase_id, interactive)
+  common.write_json(
+      get_testcase_info_path(testcase_id),
+      {'fetched_at': time.time(), 'response': response})
+  return response
+
+
+def refresh_testcase_info(testcase_id):
+  """Refresh the cached testcase information. This runs in the background;
+    therefore, it never prompts and a failure only keeps the old cache."""
+  try:
+    fetch_and_cache_testcase_info(testcase_id, interactive=False)
+  except Exception as e:  # pylint: disable=broad-except
+    logger.debug('Failed to refresh the testcase information: %s', e)
+
+
+def get_testcase_info(testcase_id):
+  """Return the testcase information from the local cache when it's recent
+    enough. Otherwise, pull it from Clusterfuzz."""
+  cached = common.read_json(get_testcase_info_path(testcase_id))
+  if cached:
+    age = time.time() - cached['fetched_at']
+    if age < TESTCASE_INFO_TTL:
+      logger.info('Using the testcase information cached %d minutes ago.',
+                  age / 60)
+      return cached['response']
+
+    if age < TESTCASE_INFO_MAX_AGE:
+      logger.info('Using the testcase information cached %d hours ago and '
+                  'refreshing it in the background.', age / 3600)
+      # The refresh doesn't hold up the exit. The cache is replaced
+      # atomically; therefore, an unfinished refresh leaves the old one.
+      thread = threading.Thread(
+          target=refresh_testcase_info, args=(testcase_id,))
+      thread.daemon = True
+      thread.start()
+      return cached['response']
+
+  return fetch_and_cache_testcase_info(testcase_id)
 
 def ensure_goma():
   """Ensures GOMA is installed and ready for use, and starts it."""
@@ -126,22 +193,9 @@ def ensure_goma():
   return goma_dir
 
 
-def parse_job_definition(job_definition, presets):
-  """Reads in a job definition hash and parses it."""
-
-  to_return = {}
-  if 'preset' in job_definition:
-    to_return = parse_job_definition(presets[job_definition['preset']], presets)
-  for key, val in job_definition.iteritems():
-    if key == 'preset':
-      continue
-    to_return[key] = val
-
-  return to_return
-
-
-def build_definition(job_definition, presets):
-  """Converts a job definition hash into a binary definition."""
+def build_definition(job_definition):
+  """Converts a job definition hash, with its preset resolved, into a binary
+    definition."""
 
   builders = {
       'CfiChromium': binary_providers.CfiChromiumBuilder,
@@ -157,39 +211,34 @@ def build_definition(job_definition, presets):
                     'LibfuzzerJob': reproducers.LibfuzzerJobReproducer,
                     'LinuxChromeJob': reproducers.LinuxChromeJobReproducer}
 
-  result = parse_job_definition(job_definition, presets)
-
   return common.Definition(
-      builder=builders[result['builder']],
-      source_var=result['source'],
-      reproducer=reproducer_map[result['reproducer']],
-      binary_name=result.get('binary'),
-      sanitizer=result.get('sanitizer'),
-      target=result.get('target'),
-      require_user_data_dir=result.get('require_user_data_dir', False))
+      builder=builders[job_definition['builder']],
+      source_var=job_definition['source'],
+      reproducer=reproducer_map[job_definition['reproducer']],
+      binary_name=job_definition.get('binary'),
+      sanitizer=job_definition.get('sanitizer'),
+      target=job_definition.get('target'),
+      require_user_data_dir=job_definition.get('require_user_data_dir', False))
 
 
 def get_supported_jobs():
-  """Reads in supported jobs from supported_jobs.yml."""
-
-  to_return = {
-      'standalone': {},
-      'chromium': {}}
+  """Reads in supported jobs from supported_jobs.yml. They are parsed once
+    per process."""
+  if supported_jobs:
+    return supported_jobs
 
-  with open(common.get_resource(
-      0640, 'resources', 'supported_job_types.yml')) as stream:
-    job_types_yaml = yaml.load(stream)
-
-  for build_type in ['standalone', 'chromium']:
-    for job_type, job_definition in job_types_yaml[build_type].iteritems():
+  to_return = {}
+  for build_type, job_definitions in job_types.get().iteritems():
+    to_return[build_type] = {}
+    for job_type, job_definition in job_definitions.iteritems():
       try:
-        to_return[build_type][job_type] = build_definition(
-            job_definition, job_types_yaml['presets'])
+        to_return[build_type][job_type] = build_definition(job_definition)
       except KeyError:
         raise error.BadJobTypeDefinitionError(
             '%s %s' % (build_type, job_type))
 
-  return to_return
+  supported_jobs.update(to_return)
+  return supported_jobs
 
 
 def get_definition(job_type, build_param):
@@ -219,10 +268,69 @@ def warn_unreproducible_if_needed(current_testcase):
         common.BASH_YELLOW_MARKER))
 
 
+def get_query_options(testcase_id):
+  """Return the options for commands that look up a testcase's build without
+    building it."""
+  return common.Options(
+      testcase_id=testcase_id,
+      current=False,
+      build='chromium',
+      disable_goma=True,
+      goma_threads=None,
+      goma_load=None,
+      iterations=0,
+      disable_xvfb=True,
+      target_args='',
+      edit_mode=False,
+      disable_gclient=True,
+      enable_debug=False,
+      gn_check=False,
+      worktree=False,
+      goma_dir=None)
+
+
+def load_bundle(bundle_path, testcase_id):
+  """Load the testcase from a bundle written by `clusterfuzz export`."""
+  testcase_bundle = bundle.Bundle(bundle_path)
+  if str(testcase_bundle.testcase_id) != str(testcase_id):
+    raise error.BadBundleError(
+        bundle_path, 'it holds testcase %s' % testcase_bundle.testcase_id)
+
+  binary_providers.resolved_shas.update(testcase_bundle.shas)
+  try:
+    return testcase.Testcase(
+        testcase_bundle.testcase_json, bundle=testcase_bundle)
+  except KeyError as e:
+    raise error.BadBundleError(bundle_path, 'its testcase has no %s' % e)
+  except TypeError as e:
+    raise error.BadBundleError(
+        bundle_path, 'its testcase is malformed (%s)' % e)
+
+
+def get_binary_provider(current_testcase, definition, options):
+  """Return the provider that downloads or builds the binary of the
+    testcase."""
+  if options.build == 'download':
+    if definition.binary_name:
+      binary_name = definition.binary_name
+    else:
+      binary_name = current_testcase.get_binary_name()
+    return binary_providers.DownloadedBinary(
+        testcase_id=current_testcase.id,
+        build_url=current_testcase.build_url,
+        binary_name=binary_name)
+
+  return definition.builder(
+      testcase=current_testcase,
+      definition=definition,
+      options=options)
+
+
 @stackdriver_logging.log
 def execute(testcase_id, current, build, disable_goma, goma_threads, goma_load,
             iterations, disable_xvfb, target_args, edit_mode, disable_gclient,
-            enable_debug, goma_dir=None):
+            enable_debug, gn_check=False, worktree=False, goma_dir=None,
+            bundle_path=None):
   """Execute the reproduce command."""
   options = common.Options(
       testcase_id=testcase_id,
@@ -237,34 +345,64 @@ def execute(testcase_id, current, build, disable_goma, goma_threads, goma_load,
       edit_mode=edit_mode,
       disable_gclient=disable_gclient,
       enable_debug=enable_debug,
+      gn_check=gn_check,
+      worktree=worktree,
       goma_dir=goma_dir)
 
   logger.info('Reproducing testcase %s', testcase_id)
   logger.debug('%s', str(options))
-  logger.info('Downloading testcase information...')
-
-  response = get_testcase_info(testcase_id)
-  current_testcase = testcase.Testcase(response)
-
-  definition = get_definition(current_testcase.job_type, build)
 
-  warn_unreproducible_if_needed(current_testcase)
-
-  if build == 'download':
-    if definition.binary_name:
-      binary_name = definition.binary_name
+  def load_testcase():
+    if bundle_path:
+      logger.info('Loading testcase information from %s...', bundle_path)
+      current_testcase = load_bundle(bundle_path, testcase_id)
     else:
-      binary_name = common.get_binary_name(current_testcase.stacktrace_lines)
-    binary_provider = binary_providers.DownloadedBinary(
-        testcase_id=current_testcase.id,
-        build_url=current_testcase.build_url,
-        binary_name=binary_name)
-  else:
-    options.goma_dir = None if options.disable_goma else ensure_goma()
-    binary_provider = definition.builder(
-        testcase=current_testcase,
-        definition=definition,
-        options=options)
+      logger.info('Downloading testcase information...')
+      current_testcase = testcase.Testcase(get_testcase_info(testcase_id))
+    warn_unreproducible_if_needed(current_testcase)
+    return current_testcase
+
+  def start_goma():
+    options.goma_dir = ensure_goma()
+
+  # Every step runs as soon as the steps it needs are done, e.g. goma starts
+  # while the testcase information is downloaded, and the testcase file is
+  # downloaded while the build is prepared.
+  graph = task_graph.TaskGraph('preparation')
+  graph.add('testcase information', load_testcase)
+  graph.add('definition',
+            lambda current_testcase: get_definition(
+                current_testcase.job_type, build),
+            deps=['testcase information'])
+  build_deps = ['binary provider']
+  if build != 'download':
+    if options.disable_goma:
+      options.goma_dir = None
+    else:
+      graph.add('goma', start_goma)
+      build_deps.append('goma')
+  # The builders resolve the sha of the revision.
+  graph.add('binary provider',
+            lambda current_testcase, definition: get_binary_provider(
+                current_testcase, definition, options),
+            deps=['testcase information', 'definition'])
+  if not bundle_path:
+    graph.add('testcase file',
+              lambda current_testcase: (
+                  current_testcase.get_downloaded_testcase_file()),
+              deps=['testcase information'])
+    # The editor of args.gn needs the terminal to itself.
+    if edit_mode:
+      build_deps.append('testcase file')
+  graph.add('build',
+            lambda binary_provider, *_: binary_provider.get_build_directory(),
+            deps=build_deps)
+  results = graph.run()
+  graph.log_critical_path()
+
+  current_testcase = results['testcase information']
+  definition = results['definition']
+  binary_provider = results['binary provider']
 
   reproducer = definition.reproducer(
       definition=definition,
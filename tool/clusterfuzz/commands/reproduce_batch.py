@@ -0,0 +1,187 @@
+"""Module for the 'reproduce-batch' command.
+
+Reproduces many testcases. Testcases with the same job type, revision and
+build share a single build, and the reproductions run in parallel."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import logging
+import sys
+import threading
+import time
+from multiprocessing import pool
+
+from clusterfuzz import common
+from clusterfuzz import testcase
+from clusterfuzz.commands import reproduce
+from error import error
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def read_testcase_ids(stream):
+  """Read one testcase ID per line, skipping empty lines and comments."""
+  testcase_ids = []
+  for line in stream:
+    line = line.split('#', 1)[0].strip()
+    if line:
+      testcase_ids.append(line)
+  return testcase_ids
+
+
+def get_group_key(current_testcase):
+  """Return the key of the testcases that can share a build."""
+  return (current_testcase.job_type, current_testcase.revision,
+          current_testcase.build_url)
+
+
+class ResultWriter(object):
+  """Writes a JSON line per testcase. It's shared by the reproducing
+    threads."""
+
+  def __init__(self, output):
+    self.output = output
+    self.lock = threading.Lock()
+
+  def write(self, testcase_id, status, **fields):
+    """Write the result of a testcase."""
+    result = {'testcase_id': testcase_id, 'status': status}
+    result.update(fields)
+    line = json.dumps(result, sort_keys=True)
+    with self.lock:
+      self.output.write(line + '\n')
+      self.output.flush()
+
+
+def reproduce_testcase(writer, group, current_testcase, definition,
+                       binary_provider, options):
+  """Reproduce a testcase with the shared binary provider and write its
+    result. This runs in a pool thread; therefore, no exception may escape."""
+  fields = {'group': group, 'job_type': current_testcase.job_type,
+            'revision': current_testcase.revision}
+  start_time = time.time()
+  try:
+    reproducer = definition.reproducer(
+        definition=definition,
+        binary_provider=binary_provider,
+        testcase=current_testcase,
+        sanitizer=definition.sanitizer,
+        options=options)
+    reproducer.reproduce(options.iterations)
+    status = 'reproduced'
+  except error.UnreproducibleError:
+    status = 'unreproducible'
+  except Exception as e:  # pylint: disable=broad-except
+    logger.exception('Failed to reproduce testcase %s', current_testcase.id)
+    status = 'error'
+    fields['error'] = e.message or e.__class__.__name__
+
+  fields['elapsed'] = round(time.time() - start_time, 1)
+  writer.write(current_testcase.id, status, **fields)
+
+
+def group_testcases(testcase_ids, build, writer):
+  """Group the testcases by the build they need. Testcases that cannot be
+    loaded are reported right away."""
+  groups = collections.OrderedDict()
+  for testcase_id in testcase_ids:
+    try:
+      current_testcase = testcase.Testcase(
+          reproduce.get_testcase_info(testcase_id))
+      definition = reproduce.get_definition(current_testcase.job_type, build)
+    except error.ExpectedException as e:
+      writer.write(testcase_id, 'error', error=e.message)
+      continue
+
+    groups.setdefault(get_group_key(current_testcase), []).append(
+        (current_testcase, definition))
+  return groups
+
+
+def execute(input_file, output, jobs, current, build, disable_goma,
+            goma_threads, goma_load, iterations, disable_xvfb, target_args,
+            disable_gclient, gn_check, worktree):
+  """Reproduce the testcases listed in input_file. Each group of testcases is
+    built or downloaded once, in order, and its reproductions run in a thread
+    pool. Downloads overlap with the reproductions of earlier groups."""
+  if input_file == '-':
+    testcase_ids = read_testcase_ids(sys.stdin)
+  else:
+    with open(input_file, 'r') as f:
+      testcase_ids = read_testcase_ids(f)
+
+  output_file = open(output, 'a')
+  writer = ResultWriter(output_file)
+  groups = group_testcases(testcase_ids, build, writer)
+  logger.info('Reproducing %d testcases in %d groups.',
+              sum(len(members) for members in groups.itervalues()),
+              len(groups))
+
+  goma_dir = None
+  if build != 'download' and not disable_goma:
+    goma_dir = reproduce.ensure_goma()
+
+  thread_pool = pool.ThreadPool(jobs)
+  pending_results = []
+  try:
+    for group, members in enumerate(groups.itervalues()):
+      first_testcase, first_definition = members[0]
+      options = common.Options(
+          testcase_id=str(first_testcase.id),
+          current=current,
+          build=build,
+          disable_goma=disable_goma,
+          goma_threads=goma_threads,
+          goma_load=goma_load,
+          iterations=iterations,
+          disable_xvfb=disable_xvfb,
+          target_args=target_args,
+          edit_mode=False,
+          disable_gclient=disable_gclient,
+          enable_debug=False,
+          gn_check=gn_check,
+          worktree=worktree,
+          goma_dir=goma_dir)
+
+      # The source builds of all the groups share the checkout and, when
+      # their args.gn match, the out directory. Building the next group would
+      # replace the binary that the reproductions of this group run;
+      # therefore, they are done first. The downloaded builds of the groups
+      # are in different directories, and overlap with the reproductions of
+      # earlier groups.
+      if build != 'download':
+        for result in pending_results:
+          result.wait()
+        pending_results = []
+      try:
+        binary_provider = reproduce.get_binary_provider(
+            first_testcase, first_definition, options)
+        binary_provider.get_binary_path()
+      except error.ExpectedException as e:
+        for current_testcase, _ in members:
+          writer.write(current_testcase.id, 'error', group=group,
+                       error=e.message)
+        continue
+
+      for current_testcase, definition in members:
+        pending_results.append(thread_pool.apply_async(
+            reproduce_testcase,
+            (writer, group, current_testcase, definition, binary_provider,
+             options)))
+  finally:
+    thread_pool.close()
+    thread_pool.join()
+    output_file.close()
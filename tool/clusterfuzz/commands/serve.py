@@ -0,0 +1,237 @@
+"""Module for the 'serve' command.
+
+Keeps a clusterfuzz process running, with its modules imported and its job
+table parsed, and forwards `clusterfuzz reproduce --daemon` to it over a Unix
+socket. Every request runs in a process forked from it, whose output is
+streamed back to the client."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import errno
+import json
+import logging
+import os
+import select
+import socket
+import sys
+
+from clusterfuzz import common
+from clusterfuzz import job_types
+from clusterfuzz import main
+from clusterfuzz.commands import reproduce
+from error import error
+
+SOCKET_PATH = os.path.join(common.CLUSTERFUZZ_DIR, 'serve.sock')
+# The exit code of a request follows its output, after this marker.
+EXIT_MARKER = '\0clusterfuzz-serve-exit:'
+READ_BUFFER_LENGTH = 4096
+# The seconds between the checks for the requests that are done.
+REAP_INTERVAL = 0.5
+# The seconds that a client has to send its request. The requests are read
+# before forking, so a client that sends nothing holds up the others.
+REQUEST_TIMEOUT = 5
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def read_request(conn):
+  """Read the request, which is a line of JSON."""
+  data = ''
+  while not data.endswith('\n'):
+    chunk = conn.recv(READ_BUFFER_LENGTH)
+    if not chunk:
+      raise ValueError('The request is incomplete.')
+    data += chunk
+  return json.loads(data)
+
+
+def run_request(conn, request):
+  """Run the request in this forked process, with the environment, the
+    working directory and the arguments of the client, and the output going
+    to the client. Return the exit code."""
+  sys.stdout.flush()
+  sys.stderr.flush()
+  # Nobody can answer a question; asking fails instead of hanging.
+  devnull = os.open(os.devnull, os.O_RDONLY)
+  os.dup2(devnull, 0)
+  os.dup2(conn.fileno(), 1)
+  os.dup2(conn.fileno(), 2)
+  os.environ.clear()
+  os.environ.update(request['env'])
+  try:
+    os.chdir(request['cwd'])
+    main.execute(request['argv'])
+    return 0
+  except SystemExit as e:
+    return e.code if isinstance(e.code, int) else 1
+  except BaseException:  # pylint: disable=broad-except
+    logger.exception('The request failed.')
+    return 1
+  finally:
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+
+def start_request(server, conn):
+  """Fork a process that runs the request of conn, and return its pid."""
+  conn.settimeout(REQUEST_TIMEOUT)
+  request = read_request(conn)
+  # A timeout makes the socket non-blocking, which the output of the request
+  # must not be.
+  conn.settimeout(None)
+  if request['argv'][:1] != ['reproduce']:
+    raise ValueError('Only `clusterfuzz reproduce` can be forwarded.')
+  logger.info('Running `clusterfuzz %s` in %s.',
+              ' '.join(request['argv']), request['cwd'])
+  pid = os.fork()
+  if pid == 0:
+    code = 1
+    try:
+      server.close()
+      code = run_request(conn, request)
+    finally:
+      os._exit(code)  # pylint: disable=protected-access
+  return pid
+
+
+def finish_request(conn, status):
+  """Send the exit code of a request that is done, and close conn."""
+  if os.WIFSIGNALED(status):
+    code = 128 + os.WTERMSIG(status)
+  else:
+    code = os.WEXITSTATUS(status)
+  try:
+    conn.sendall('%s%d\n' % (EXIT_MARKER, code))
+  except socket.error as e:
+    logger.debug('Unable to send the exit code: %s', e)
+  conn.close()
+
+
+def reap_requests(requests):
+  """Finish the requests whose processes are done."""
+  while requests:
+    try:
+      pid, status = os.waitpid(-1, os.WNOHANG)
+    except OSError as e:
+      if e.errno == errno.ECHILD:
+        return
+      raise
+    if not pid:
+      return
+    conn = requests.pop(pid, None)
+    if conn:
+      finish_request(conn, status)
+
+
+def create_server(socket_path):
+  """Listen on socket_path, unless another daemon already does."""
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    client.connect(socket_path)
+    raise error.DaemonRunningError(socket_path)
+  except socket.error:
+    pass
+  finally:
+    client.close()
+
+  if os.path.exists(socket_path):
+    os.remove(socket_path)
+  if not os.path.exists(os.path.dirname(socket_path)):
+    os.makedirs(os.path.dirname(socket_path))
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  server.bind(socket_path)
+  os.chmod(socket_path, 0600)
+  server.listen(5)
+  return server
+
+
+def warm_up():
+  """Do the work that every request would repeat, besides importing the
+    modules: parse the job table. The requests inherit it."""
+  job_types.get()
+  reproduce.get_supported_jobs()
+  # Importing requests is slow. No connection is made before the fork, so
+  # the requests don't share any.
+  common.get_http()
+
+
+def execute():
+  """Serve the requests of `clusterfuzz reproduce --daemon` until
+    interrupted."""
+  warm_up()
+  server = create_server(SOCKET_PATH)
+  logger.info('Serving on %s. Stop with Ctrl+C.', SOCKET_PATH)
+
+  # The requests are forked from this thread, and the server runs no other
+  # thread, so that no lock is held by another thread at a fork.
+  requests = {}
+  try:
+    while True:
+      readable, _, _ = select.select([server], [], [], REAP_INTERVAL)
+      if readable:
+        conn, _ = server.accept()
+        try:
+          requests[start_request(server, conn)] = conn
+        except (ValueError, socket.error) as e:
+          logger.info('Ignoring a bad request: %s', e)
+          conn.close()
+      reap_requests(requests)
+  finally:
+    server.close()
+    os.remove(SOCKET_PATH)
+
+
+def forward(argv, socket_path=SOCKET_PATH):
+  """Send argv to the daemon, print its output as it comes, and return its
+    exit code."""
+  client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    client.connect(socket_path)
+  except socket.error:
+    e = error.DaemonNotRunningError(socket_path)
+    logger.info(e.message)
+    return e.exit_code
+
+  try:
+    client.sendall(json.dumps({
+        'argv': argv, 'env': dict(os.environ), 'cwd': os.getcwd()}) + '\n')
+    return read_output(client, sys.stdout)
+  finally:
+    client.close()
+
+
+def read_output(client, output):
+  """Write the output of the request to output, and return its exit code.
+    The end of the output is held back until it can't be the exit marker."""
+  pending = ''
+  while True:
+    chunk = client.recv(READ_BUFFER_LENGTH)
+    pending += chunk
+    index = pending.find(EXIT_MARKER)
+    if index != -1:
+      output.write(pending[:index])
+      pending = pending[index:]
+    elif chunk:
+      keep = len(EXIT_MARKER) - 1
+      output.write(pending[:-keep])
+      pending = pending[-keep:]
+    output.flush()
+    if not chunk:
+      break
+
+  if not pending.startswith(EXIT_MARKER):
+    output.write(pending)
+    logger.info('The daemon stopped before the request finished.')
+    return 1
+  return int(pending[len(EXIT_MARKER):].strip())
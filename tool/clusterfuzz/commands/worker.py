@@ -0,0 +1,145 @@
+"""Module for the 'worker' command.
+
+Reproduces the testcases handed out by `clusterfuzz job-server`, one at a
+time, and sends the results back. The builds are kept for the later
+testcases that need them."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import socket
+import time
+import xmlrpclib
+
+from clusterfuzz import common
+from clusterfuzz import testcase
+from clusterfuzz.commands import reproduce
+from clusterfuzz.commands import reproduce_batch
+from error import error
+
+# The seconds to wait before asking again while the remaining jobs are all
+# taken by other workers, one of which might give up its job.
+WAIT_INTERVAL = 30
+
+logger = logging.getLogger('clusterfuzz')
+
+
+class ResultSender(object):
+  """Sends the result of a job to the server. It has the interface of
+    reproduce_batch.ResultWriter."""
+
+  def __init__(self, server, worker_id, job_id):
+    self.server = server
+    self.worker_id = worker_id
+    self.job_id = job_id
+
+  def write(self, testcase_id, status, **fields):
+    result = {'testcase_id': str(testcase_id), 'status': status}
+    result.update(fields)
+    self.server.put_result(self.worker_id, self.job_id, result)
+
+
+class Worker(object):
+  """Runs the jobs, and keeps a binary provider per build key."""
+
+  def __init__(self, server, worker_id):
+    self.server = server
+    self.worker_id = worker_id
+    self.binary_providers = {}
+    self.goma_dir = None
+
+  def get_options(self, job, options):
+    """Return the options of the job. GOMA is started on the first build."""
+    options = common.Options(
+        testcase_id=job['testcase_id'], goma_dir=None, **options)
+    if options.build != 'download' and not options.disable_goma:
+      if not self.goma_dir:
+        self.goma_dir = reproduce.ensure_goma()
+      options.goma_dir = self.goma_dir
+    return options
+
+  def get_binary_provider(self, key, current_testcase, definition, options):
+    """Return the binary provider of key, which builds or downloads the
+      binary on first use."""
+    if key not in self.binary_providers:
+      binary_provider = reproduce.get_binary_provider(
+          current_testcase, definition, options)
+      binary_provider.get_binary_path()
+      if options.build != 'download':
+        self.forget_replaced_builds(binary_provider.build_directory)
+      self.binary_providers[key] = binary_provider
+    return self.binary_providers[key]
+
+  def forget_replaced_builds(self, build_directory):
+    """Forget the source builds in build_directory, whose binary was just
+      replaced. The builds with the same args.gn share an out directory.
+      Every download has a directory of its own."""
+    for key, binary_provider in self.binary_providers.items():
+      if binary_provider.build_directory == build_directory:
+        del self.binary_providers[key]
+
+  def run_job(self, job, options):
+    """Reproduce the testcase of the job, and send its result."""
+    sender = ResultSender(self.server, self.worker_id, job['id'])
+    try:
+      options = self.get_options(job, options)
+      current_testcase = testcase.Testcase(
+          reproduce.get_testcase_info(job['testcase_id']))
+      definition = reproduce.get_definition(
+          current_testcase.job_type, options.build)
+      binary_provider = self.get_binary_provider(
+          job['key'], current_testcase, definition, options)
+    except error.ExpectedException as e:
+      sender.write(job['testcase_id'], 'error', group=job['group'],
+                   error=e.message)
+      return
+    except Exception as e:  # pylint: disable=broad-except
+      # The job is reported as done, instead of being handed out again only
+      # when its lease expires, and the worker goes on with the next job.
+      logger.exception('Failed to prepare testcase %s', job['testcase_id'])
+      sender.write(job['testcase_id'], 'error', group=job['group'],
+                   error=e.message or e.__class__.__name__)
+      return
+
+    reproduce_batch.reproduce_testcase(
+        sender, job['group'], current_testcase, definition, binary_provider,
+        options)
+
+  def run(self):
+    """Run jobs until the server has none left."""
+    while True:
+      response = self.server.get_job(
+          self.worker_id, self.binary_providers.keys())
+      if response['status'] == 'done':
+        return
+      elif response['status'] == 'wait':
+        time.sleep(WAIT_INTERVAL)
+      else:
+        self.run_job(response['job'], response['options'])
+
+
+def execute(server, worker_id):
+  """Reproduce the testcases of the job server at the URL server."""
+  worker_id = worker_id or '%s-%d' % (socket.gethostname(), os.getpid())
+  worker = Worker(xmlrpclib.ServerProxy(server, allow_none=True), worker_id)
+  logger.info('Worker %s is taking jobs from %s.', worker_id, server)
+  try:
+    worker.run()
+  except socket.error as e:
+    # The server exits once all the jobs are done, which a waiting worker
+    # learns by not reaching it.
+    logger.info('Stopping, because the job server is unreachable: %s', e)
+    return
+  logger.info('The job server has no jobs left.')
@@ -13,7 +13,14 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import collections
+import errno
+import functools
+import json
+import mmap
 import os
+import re
+import select
 import sys
 import stat
 import subprocess
@@ -22,14 +29,10 @@ import time
 import signal
 import shutil
 import tempfile
+import threading
 
 import namedlist
-import requests
-from requests.packages.urllib3.util import retry
-from requests import adapters
-from backports.shutil_get_terminal_size import get_terminal_size
 
-from cmd_editor import editor
 from clusterfuzz import local_logging
 from clusterfuzz import output_transformer
 from error import error
@@ -46,14 +49,29 @@ BASH_RESET_COLOR_MARKER = '\033[39m'
 
 NO_SUCH_PROCESS_ERRNO = 3
 DEFAULT_READ_BUFFER_LENGTH = 10
+OUTPUT_HEAD_LENGTH = 1024 * 1024
+# The end of the output is kept longer because it has the sanitizer report.
+OUTPUT_TAIL_LENGTH = 4 * 1024 * 1024
 
 CLUSTERFUZZ_DIR = os.path.expanduser(os.path.join('~', '.clusterfuzz'))
 CLUSTERFUZZ_CACHE_DIR = os.path.join(CLUSTERFUZZ_DIR, 'cache')
 CLUSTERFUZZ_TESTCASES_DIR = os.path.join(CLUSTERFUZZ_CACHE_DIR, 'testcases')
 CLUSTERFUZZ_BUILDS_DIR = os.path.join(CLUSTERFUZZ_CACHE_DIR, 'builds')
+CLUSTERFUZZ_WORKTREES_DIR = os.path.join(CLUSTERFUZZ_DIR, 'worktrees')
 AUTH_HEADER_FILE = os.path.join(CLUSTERFUZZ_CACHE_DIR, 'auth_header')
 DOMAIN_NAME = 'clusterfuzz.com'
-TERMINAL_WIDTH = get_terminal_size().columns
+FRAME_ADDRESS_REGEX = re.compile(r'0x[0-9a-fA-F]+')
+FRAME_PARAMETERS_REGEX = re.compile(r'\(.*\)\s*$')
+WHITESPACE_REGEX = re.compile(r'\s+')
+# The last line of a sanitizer or libFuzzer crash report.
+CRASH_REPORT_END_REGEX = re.compile(r'SUMMARY: (\w+Sanitizer|libFuzzer):')
+# The seconds to wait for the rest of the output after a crash report.
+CRASH_REPORT_GRACE_PERIOD = 2
+# The part of a line that is kept until it ends. A crash report line is short.
+MAX_PARTIAL_LINE_LENGTH = 1024
+# getrusage counts the I/O in blocks of 512 bytes, and the peak RSS in KB.
+RUSAGE_BLOCK_SIZE = 512
+RUSAGE_RSS_UNIT = 1024
 logger = logging.getLogger('clusterfuzz')
 
 
@@ -61,43 +79,178 @@ Options = namedlist.namedlist(
     'Options',
     ['testcase_id', 'current', 'build', 'disable_goma', 'goma_threads',
      'goma_load', 'iterations', 'disable_xvfb', 'target_args', 'edit_mode',
-     'disable_gclient', 'enable_debug', 'goma_dir']
+     'disable_gclient', 'enable_debug', 'gn_check', 'worktree', 'goma_dir']
 )
 
 
-# Configuring backoff retrying because sending a request to ClusterFuzz
-# might fail during a deployment.
-http = requests.Session()
-http.mount(
-    'https://',
-    adapters.HTTPAdapter(
-        # backoff_factor is 0.5. Therefore, the max wait time is 16s.
-        retry.Retry(
-            total=5, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]))
-)
+http = None
+
+
+def get_http():  # pragma: no cover
+  """Return the session for requests to ClusterFuzz. It's created on first use
+    because importing requests is slow, and most commands never need it."""
+  global http
+  if http is None:
+    import requests
+    from requests import adapters
+    from requests.packages.urllib3.util import retry
+
+    # Configuring backoff retrying because sending a request to ClusterFuzz
+    # might fail during a deployment.
+    session = requests.Session()
+    session.mount(
+        'https://',
+        adapters.HTTPAdapter(
+            # backoff_factor is 0.5. Therefore, the max wait time is 16s.
+            retry.Retry(
+                total=5, backoff_factor=0.5,
+                status_forcelist=[500, 502, 503, 504])))
+    http = session
+  return http
 
 
 def post(*args, **kwargs):  # pragma: no cover
   """Make a post request. This method is needed for mocking."""
-  return http.post(*args, **kwargs)
+  return get_http().post(*args, **kwargs)
+
+
+def head(*args, **kwargs):  # pragma: no cover
+  """Make a head request. This method is needed for mocking."""
+  return get_http().head(*args, **kwargs)
+
+
+def read_json(path):
+  """Return the JSON stored in path, or None if it's missing or corrupted."""
+  try:
+    with open(path, 'r') as f:
+      return json.load(f)
+  except (IOError, ValueError):
+    return None
+
+
+def write_json(path, data):
+  """Store data as JSON in path. The file is replaced atomically because
+    another thread or process might read it."""
+  if not os.path.exists(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+
+  tmp_path = '%s.%s.tmp' % (path, os.getpid())
+  with open(tmp_path, 'w') as f:
+    json.dump(data, f)
+  os.rename(tmp_path, path)
+
+
+def normalize_frame(frame):
+  """Return the frame without addresses, parameters and extra whitespace, so
+    that the same function matches across builds."""
+  frame = FRAME_ADDRESS_REGEX.sub('', frame)
+  frame = FRAME_PARAMETERS_REGEX.sub('', frame)
+  return WHITESPACE_REGEX.sub(' ', frame).strip()
+
+
+def get_ordered_overlap(frames, other_frames):
+  """Return the number of frames that appear in the same order in both, i.e.
+    the length of their longest common subsequence."""
+  previous = [0] * (len(other_frames) + 1)
+  for frame in frames:
+    current = [0]
+    for i, other_frame in enumerate(other_frames):
+      if frame == other_frame:
+        current.append(previous[i] + 1)
+      else:
+        current.append(max(previous[i + 1], current[i]))
+    previous = current
+  return previous[-1]
 
 
 class CrashSignature(object):
-  """Represents a crash signature (including output)."""
+  """Represents a crash signature (including the digest of its output)."""
 
-  def __init__(self, crash_type, crash_state_lines, output=''):
+  def __init__(self, crash_type, crash_state_lines, output_digest=None):
     self.crash_type = crash_type
     self.crash_state_lines = tuple(crash_state_lines)
-    self.output = output
+    self.output_digest = output_digest
+    self.frames = tuple(
+        frame for frame in (normalize_frame(line) for line in crash_state_lines)
+        if frame)
+    # The key of exact matches, which ignores the output.
+    self.key = (WHITESPACE_REGEX.sub(' ', crash_type).strip(), self.frames)
+
+  def get_similarity(self, other):
+    """Return a score from 0 to 1 that counts the matching crash type and the
+      frames that appear in the same order in both signatures."""
+    matches = get_ordered_overlap(self.frames, other.frames)
+    if self.key[0] == other.key[0]:
+      matches += 1
+    return float(matches) / (1 + max(len(self.frames), len(other.frames)))
 
   def __hash__(self):
-    return (self.crash_type, self.crash_state_lines, self.output).__hash__()
+    return (self.crash_type, self.crash_state_lines,
+            self.output_digest).__hash__()
 
   def __eq__(self, other):
     return (isinstance(other, CrashSignature) and
             self.crash_type == other.crash_type and
             self.crash_state_lines == other.crash_state_lines and
-            self.output == other.output)
+            self.output_digest == other.output_digest)
+
+
+class CrashSignatureIndex(object):
+  """Finds the known crash signatures that match a crash, e.g. to tell which
+    known testcase a new crash belongs to. Exact matches are looked up by
+    hash. Fuzzy matches are only scored against the signatures that share a
+    frame with the crash, or its crash type when it has no frames."""
+
+  def __init__(self):
+    self.entries = []
+    self.exact_matches = {}
+    self.postings = collections.defaultdict(list)
+
+  def add(self, signature, value):
+    """Add the signature of a known crash, and the value to return when it
+      matches, e.g. its testcase ID."""
+    entry_id = len(self.entries)
+    self.entries.append((signature, value))
+    self.exact_matches.setdefault(signature.key, []).append(value)
+    self.postings[('type', signature.key[0])].append(entry_id)
+    for frame in set(signature.frames):
+      self.postings[('frame', frame)].append(entry_id)
+
+  def find_exact(self, signature):
+    """Return the values of the signatures with the same type and frames."""
+    return list(self.exact_matches.get(signature.key, []))
+
+  def find(self, signature, min_score=0.75):
+    """Return (score, value) of the signatures scoring at least min_score,
+      the best first."""
+    if signature.frames:
+      posting_keys = [('frame', frame) for frame in set(signature.frames)]
+    else:
+      posting_keys = [('type', signature.key[0])]
+
+    candidates = set()
+    for posting_key in posting_keys:
+      candidates.update(self.postings.get(posting_key, []))
+
+    matches = []
+    for entry_id in candidates:
+      known_signature, _ = self.entries[entry_id]
+      score = signature.get_similarity(known_signature)
+      if score >= min_score:
+        matches.append((-score, entry_id))
+    return [(-score, self.entries[entry_id][1])
+            for score, entry_id in sorted(matches)]
+
+  def match(self, signature, min_score=0.75):
+    """Return the value of the best matching signature, or None."""
+    exact_matches = self.exact_matches.get(signature.key)
+    if exact_matches:
+      return exact_matches[0]
+    matches = self.find(signature, min_score)
+    return matches[0][1] if matches else None
+
+  def __len__(self):
+    return len(self.entries)
 
 
 def get_os_name():
@@ -123,18 +276,6 @@ def style(s, marker, reset_char):
     return s
 
 
-def get_binary_name(stacktrace):
-  prefix = 'Running command: '
-  stacktrace_lines = [l['content'] for l in stacktrace]
-  for l in stacktrace_lines:
-    if prefix in l:
-      l = l.replace(prefix, '').split(' ')
-      binary_name = os.path.basename(l[0])
-      return binary_name
-
-  raise error.MinimizationNotFinishedError()
-
-
 def get_version():
   """Print version."""
   with open(get_resource(0640, 'resources', 'VERSION')) as f:
@@ -206,6 +347,14 @@ def wait_timeout(proc, timeout):
 def kill(proc):
   """Kill a process multiple times.
     See: https://github.com/google/clusterfuzz-tools/pull/301"""
+  process_tree = getattr(proc, 'process_tree', None)
+  if process_tree:
+    # The whole tree is killed at once, including the processes that have
+    # left the process group.
+    process_tree.kill()
+    proc.wait()
+    return
+
   try:
     for sig in [signal.SIGTERM, signal.SIGTERM,
                 signal.SIGKILL, signal.SIGKILL]:
@@ -215,6 +364,8 @@ def kill(proc):
 
       # Wait for any shutdown stacktrace to be dumped.
       time.sleep(3)
+      # Reap the leader. Otherwise, its zombie keeps the group alive.
+      proc.poll()
 
     raise error.KillProcessFailedError(proc.args, proc.pid)
   except OSError as e:
@@ -227,6 +378,7 @@ def edit_if_needed(content, prefix, comment, should_edit):
   if not should_edit:
     return content
 
+  from cmd_editor import editor
   return editor.edit(content, prefix=prefix, comment=comment)
 
 
@@ -295,10 +447,209 @@ class StringStdin(Stdin):
     return '%s < %s' % (cmd, self.stdin.name)
 
 
+class OutputBuffer(object):
+  """Captures the output of a command with bounded memory. The head and the
+    tail of the output are kept in memory, and the whole output is spilled to
+    a temporary file once it doesn't fit."""
+
+  def __init__(self, head_length=OUTPUT_HEAD_LENGTH,
+               tail_length=OUTPUT_TAIL_LENGTH):
+    self.head_length = head_length
+    self.tail_length = tail_length
+    self.head = bytearray()
+    self.tail = bytearray()
+    self.length = 0
+    self.spill_file = None
+
+  def write(self, data):
+    """Add data to the output."""
+    self.length += len(data)
+    if self.spill_file:
+      self.spill_file.write(data)
+
+    if len(self.head) < self.head_length:
+      remaining = self.head_length - len(self.head)
+      self.head.extend(data[:remaining])
+      data = data[remaining:]
+    self.tail.extend(data)
+
+    if len(self.tail) > self.tail_length and not self.spill_file:
+      self.spill()
+    # The tail is trimmed only once it's twice as long, so that writing a
+    # byte at a time doesn't move the whole tail every time.
+    if len(self.tail) > 2 * self.tail_length:
+      del self.tail[:-self.tail_length]
+
+  def spill(self):
+    """Write the output so far to the temporary file, which gets everything
+      written after."""
+    self.spill_file = tempfile.NamedTemporaryFile(prefix='clusterfuzz-output-')
+    self.spill_file.write(self.head)
+    self.spill_file.write(self.tail)
+
+  def getvalue(self):
+    """Return the output, without its middle if it was spilled."""
+    if not self.spill_file:
+      return str(self.head + self.tail)
+
+    tail = self.tail[-self.tail_length:]
+    return '%s\n[... %d bytes of output omitted ...]\n%s' % (
+        self.head, self.length - len(self.head) - len(tail), tail)
+
+  def mmap(self):
+    """Return the whole output as a read-only mmap, e.g. to search it."""
+    if not self.length:
+      return ''
+    if not self.spill_file:
+      self.spill()
+    self.spill_file.flush()
+    return mmap.mmap(self.spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+  def close(self):
+    """Delete the temporary file."""
+    if self.spill_file:
+      self.spill_file.close()
+      self.spill_file = None
+
+  def __len__(self):
+    return self.length
+
+
+class CrashReportDetector(object):
+  """Recognises a complete sanitizer or libFuzzer crash report in the output of
+    a command as it's read, and sets the deadline for the command to finish
+    printing the rest."""
+
+  def __init__(self, grace_period=CRASH_REPORT_GRACE_PERIOD):
+    self.grace_period = grace_period
+    self.partial_line = ''
+    self.report_time = None
+    self.deadline = None
+
+  def process(self, chunk):
+    """Scan the lines that chunk completes."""
+    if self.deadline is not None:
+      return
+    if '\n' not in chunk:
+      self.partial_line = (self.partial_line + chunk)[:MAX_PARTIAL_LINE_LENGTH]
+      return
+
+    lines = (self.partial_line + chunk).split('\n')
+    self.partial_line = lines.pop()[:MAX_PARTIAL_LINE_LENGTH]
+    if any(CRASH_REPORT_END_REGEX.match(line) for line in lines):
+      logger.debug('The crash report is complete.')
+      self.report_time = time.time()
+      self.deadline = self.report_time + self.grace_period
+
+
+class ResourceUsage(object):
+  """The resources used by a command and by the descendants that it waited
+    for, e.g. the processes of a shell command. They're known once the
+    command is reaped."""
+
+  FIELDS = ['wall_time', 'user_time', 'system_time', 'peak_rss', 'read_bytes',
+            'write_bytes', 'process_count']
+
+  def __init__(self, binary):
+    self.binary = os.path.basename(binary)
+    self.start_time = time.time()
+    self.wall_time = None
+    self.user_time = None
+    self.system_time = None
+    self.peak_rss = None
+    self.read_bytes = None
+    self.write_bytes = None
+    # Only the process tree of a reproduction counts its processes.
+    self.process_count = None
+
+  def record(self, rusage):
+    """Fill in the usage from the rusage of the reaped command."""
+    self.wall_time = time.time() - self.start_time
+    self.user_time = rusage.ru_utime
+    self.system_time = rusage.ru_stime
+    self.peak_rss = rusage.ru_maxrss * RUSAGE_RSS_UNIT
+    self.read_bytes = rusage.ru_inblock * RUSAGE_BLOCK_SIZE
+    self.write_bytes = rusage.ru_oublock * RUSAGE_BLOCK_SIZE
+
+  def is_recorded(self):
+    return self.wall_time is not None
+
+  def __str__(self):
+    return (
+        '%s: %.1fs wall, %.1fs user, %.1fs system, %d MB peak RSS, %d MB read, '
+        '%d MB written%s' % (
+            self.binary, self.wall_time, self.user_time, self.system_time,
+            self.peak_rss / 1024 / 1024, self.read_bytes / 1024 / 1024,
+            self.write_bytes / 1024 / 1024,
+            '' if self.process_count is None else
+            ', %d processes' % self.process_count))
+
+
+class ResourceAccount(object):
+  """Sums up the resource usage of the commands of a run by binary, e.g. to
+    tell the target from gdb, the symbolizer and xdotool. It's shared by the
+    threads of reproduce-batch."""
+
+  def __init__(self):
+    self.totals = {}
+    self.lock = threading.Lock()
+
+  def add(self, usage):
+    with self.lock:
+      total = self.totals.setdefault(usage.binary, {'count': 0})
+      total['count'] += 1
+      for field in ResourceUsage.FIELDS:
+        value = getattr(usage, field)
+        if value is None:
+          continue
+        if field in ['peak_rss', 'process_count']:
+          total[field] = max(total.get(field, 0), value)
+        else:
+          total[field] = round(total.get(field, 0) + value, 2)
+
+  def get_totals(self):
+    """Return the totals by binary."""
+    with self.lock:
+      return dict((binary, total.copy())
+                  for binary, total in self.totals.iteritems())
+
+
+resource_account = ResourceAccount()
+
+
+def wait_with_usage(proc, options=0):
+  """Reap proc with wait4, which also returns the resources it used, and
+    return its returncode, or None if it's still running with os.WNOHANG.
+    It replaces the wait and poll methods of the Popen objects that
+    start_execute returns."""
+  while proc.returncode is None:
+    try:
+      pid, status, rusage = os.wait4(proc.pid, options)
+    except OSError as e:
+      if e.errno == errno.EINTR:
+        continue
+      if e.errno != errno.ECHILD:
+        raise
+      # Like subprocess, assume that something else reaped it.
+      proc.returncode = 0
+      break
+
+    if pid != proc.pid:
+      break
+    if os.WIFSIGNALED(status):
+      proc.returncode = -os.WTERMSIG(status)
+    else:
+      proc.returncode = os.WEXITSTATUS(status)
+    proc.usage.record(rusage)
+  return proc.returncode
+
+
 def start_execute(
     binary, args, cwd, env=None, print_command=True, stdin=None,
-    preexec_fn=os.setsid, redirect_stderr_to_stdout=False):
-  """Runs a command, and returns the subprocess.Popen object."""
+    preexec_fn=os.setsid, redirect_stderr_to_stdout=False, process_tree=None):
+  """Runs a command, and returns the subprocess.Popen object. With
+    process_tree, the command and its descendants are killed together, and
+    their memory usage is limited."""
   check_binary(binary, cwd)
 
   command = (binary + ' ' + args).strip()
@@ -325,6 +676,8 @@ def start_execute(
 
   final_env = os.environ.copy()
   final_env.update(sanitized_env)
+  if process_tree:
+    preexec_fn = process_tree.preexec
 
   proc = subprocess.Popen(
       command,
@@ -338,14 +691,91 @@ def start_execute(
       preexec_fn=preexec_fn)
 
   setattr(proc, 'args', command)
+  setattr(proc, 'process_tree', process_tree)
+  setattr(proc, 'usage', ResourceUsage(binary))
+  setattr(proc, 'wait', functools.partial(wait_with_usage, proc))
+  setattr(proc, 'poll', functools.partial(wait_with_usage, proc, os.WNOHANG))
+  if process_tree:
+    process_tree.start(proc.pid)
   return proc
 
 
+def is_stream_idle(stream):
+  """Return True if reading from the stream would block, e.g. when the process
+    waits for user input. Streams without a file descriptor are never idle."""
+  try:
+    fileno = stream.fileno()
+  except (AttributeError, IOError, ValueError):
+    return False
+  readable, _, _ = select.select([fileno], [], [], 0)
+  return not readable
+
+
+def read_until_crash(proc, read_buffer_length, timeout, crash_detector,
+                     idle_detector=None):
+  """Yield the stdout of proc as it runs. proc is killed once it times out, or
+    once crash_detector has seen a complete crash report and its grace period
+    is over, e.g. when the other processes of Chrome linger after a renderer
+    crashed. With idle_detector, proc is also killed once it seems to hang,
+    and with a process tree, once it uses more memory than its limit."""
+  fileno = proc.stdout.fileno()
+  process_tree = getattr(proc, 'process_tree', None)
+  monitors = [m for m in [idle_detector, process_tree] if m]
+  interval = min(m.interval for m in monitors) if monitors else None
+  deadline = time.time() + timeout if timeout else None
+  next_check = time.time() + interval if interval else None
+  while True:
+    if crash_detector and crash_detector.deadline is not None:
+      deadline = min(deadline or crash_detector.deadline,
+                     crash_detector.deadline)
+    wake_times = [t for t in [deadline, next_check] if t is not None]
+    wait = max(0, min(wake_times) - time.time()) if wake_times else None
+
+    readable, _, _ = select.select([fileno], [], [], wait)
+    if readable:
+      chunk = os.read(fileno, read_buffer_length)
+      if not chunk:
+        return
+      if crash_detector:
+        crash_detector.process(chunk)
+      if idle_detector:
+        idle_detector.record_output()
+      yield chunk
+
+    now = time.time()
+    if deadline is not None and now >= deadline:
+      if crash_detector and crash_detector.deadline is not None:
+        logger.info('Stopping the process after its crash report.')
+      break
+    if next_check is None or now < next_check:
+      continue
+
+    next_check = now + interval
+    if idle_detector and idle_detector.is_idle(proc.pid):
+      logger.info(
+          'The process seems to hang. It has neither printed nor used the CPU '
+          'for %d seconds.', idle_detector.idle_timeout)
+      break
+    if process_tree and process_tree.check_limits():
+      break
+
+  kill(proc)
+  # Read what the killed process printed before it exited.
+  for chunk in iter(lambda: os.read(fileno, read_buffer_length), b''):
+    yield chunk
+
+
 def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
                  timeout=None, stdout_transformer=None,
                  stderr_transformer=None,
-                 read_buffer_length=DEFAULT_READ_BUFFER_LENGTH):
-  """Looks after a command as it runs, and prints/returns its output after."""
+                 read_buffer_length=DEFAULT_READ_BUFFER_LENGTH,
+                 output_buffer=None, crash_detector=None, idle_detector=None):
+  """Looks after a command as it runs, and prints/returns its output after.
+    The whole output is captured, or only its head and tail if output_buffer
+    is given, e.g. for a target that may print without end. The caller closes
+    output_buffer. With crash_detector, the command is stopped shortly after
+    it prints a crash report, and with idle_detector, once it seems to
+    hang."""
   if stdout_transformer is None:
     stdout_transformer = output_transformer.Hidden()
 
@@ -353,22 +783,34 @@ def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
     stderr_transformer = output_transformer.Identity()
 
   logger.debug('---------------------------------------')
-  wait_timeout(proc, timeout)
+  if (crash_detector or idle_detector or
+      getattr(proc, 'process_tree', None)):
+    chunks = read_until_crash(
+        proc, read_buffer_length, timeout, crash_detector, idle_detector)
+  else:
+    wait_timeout(proc, timeout)
+    chunks = iter(lambda: proc.stdout.read(read_buffer_length), b'')
 
-  output_chunks = []
+  if output_buffer is None:
+    output_chunks = []
+    write_output = output_chunks.append
+  else:
+    write_output = output_buffer.write
   stdout_transformer.set_output(sys.stdout)
   stderr_transformer.set_output(sys.stderr)
 
   # Stdout is printed as the process runs because some commands (e.g. ninja)
   # might take a long time to run.
-  for chunk in iter(lambda: proc.stdout.read(read_buffer_length), b''):
+  for chunk in chunks:
     if print_output:
       local_logging.send_output(chunk)
       stdout_transformer.process(chunk)
+      # A prompt without a newline must be shown before the process blocks.
+      if (stdout_transformer.has_pending_output() and
+          is_stream_idle(proc.stdout)):
+        stdout_transformer.flush_output()
     if capture_output:
-      # According to: http://stackoverflow.com/questions/19926089, this is the
-      # fastest way to build strings.
-      output_chunks.append(chunk)
+      write_output(chunk)
 
   # We cannot read from stderr because it might cause a hang.
   # Therefore, we use communicate() to get stderr instead.
@@ -381,20 +823,32 @@ def wait_execute(proc, exit_on_error, capture_output=True, print_output=True,
   for (transformer, data) in [(stdout_transformer, stdout_data),
                               (stderr_transformer, stderr_data)]:
     if capture_output:
-      output_chunks.append(data)
+      write_output(data)
 
     if print_output:
       local_logging.send_output(data)
       transformer.process(data)
       transformer.flush()
 
+  if output_buffer is None:
+    output = ''.join(output_chunks)
+  else:
+    output = output_buffer.getvalue()
+
   logger.debug('---------------------------------------')
+  usage = getattr(proc, 'usage', None)
+  if isinstance(usage, ResourceUsage) and usage.is_recorded():
+    process_tree = getattr(proc, 'process_tree', None)
+    if process_tree:
+      usage.process_count = process_tree.get_process_count()
+    logger.debug('| %s', usage)
+    resource_account.add(usage)
   if proc.returncode != 0:
     logger.debug('| Return code is non-zero (%d).', proc.returncode)
     if exit_on_error:
       logger.debug('| Exit.')
       raise error.CommandFailedError(proc.args, proc.returncode, stderr_data)
-  return proc.returncode, ''.join(output_chunks)
+  return proc.returncode, output
 
 
 def execute(binary, args, cwd, print_command=True, print_output=True,
@@ -402,18 +856,21 @@ def execute(binary, args, cwd, print_command=True, print_output=True,
             stdout_transformer=None, stderr_transformer=None, timeout=None,
             stdin=None, preexec_fn=os.setsid,
             redirect_stderr_to_stdout=False,
-            read_buffer_length=DEFAULT_READ_BUFFER_LENGTH):
+            read_buffer_length=DEFAULT_READ_BUFFER_LENGTH, output_buffer=None,
+            crash_detector=None, idle_detector=None, process_tree=None):
   """Execute a bash command."""
   proc = start_execute(
       binary, args, cwd, env=env, print_command=print_command,
       stdin=stdin, preexec_fn=preexec_fn,
-      redirect_stderr_to_stdout=redirect_stderr_to_stdout)
+      redirect_stderr_to_stdout=redirect_stderr_to_stdout,
+      process_tree=process_tree)
   return wait_execute(
       proc=proc, exit_on_error=exit_on_error, capture_output=capture_output,
       print_output=print_output, timeout=timeout,
       stdout_transformer=stdout_transformer,
       stderr_transformer=stderr_transformer,
-      read_buffer_length=read_buffer_length)
+      read_buffer_length=read_buffer_length, output_buffer=output_buffer,
+      crash_detector=crash_detector, idle_detector=idle_detector)
 
 
 def check_confirm(question):
@@ -462,9 +919,11 @@ def ask(question, error_message, validate_fn):
 
 def get_resource(chmod_permission, *paths):
   """Take a relative filepath and return the actual path. chmod_permission is
-    needed because our packaging might destroy the permission."""
+    needed because our packaging might destroy the permission. The
+    permission is only changed when it's wrong."""
   full_path = os.path.join(os.path.dirname(__file__), *paths)
-  os.chmod(full_path, chmod_permission)
+  if stat.S_IMODE(os.stat(full_path).st_mode) != chmod_permission:
+    os.chmod(full_path, chmod_permission)
   return full_path
 
 
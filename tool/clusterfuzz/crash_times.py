@@ -0,0 +1,64 @@
+"""Records how long the targets of each job type take to crash or time out,
+  and derives the reproduction timeouts from it."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import math
+import os
+
+from clusterfuzz import common
+
+
+CACHE_PATH = os.path.join(common.CLUSTERFUZZ_CACHE_DIR, 'crash_times.json')
+# The number of recent runs that are kept for every job type.
+MAX_RECORDS = 20
+# The number of runs below which the timeout isn't shorter than the default.
+MIN_RECORDS = 5
+# The timeout is this many times the longest recent crash time.
+TIMEOUT_FACTOR = 3
+MIN_TIMEOUT = 10
+MAX_TIMEOUT = 180
+
+logger = logging.getLogger('clusterfuzz')
+
+
+def get_timeout(job_type, default):
+  """Return the timeout of a reproduction of job_type, or default when none
+    of its reproductions have crashed yet. The timeout isn't shorter than
+    default until there are MIN_RECORDS runs, or than a recent run that timed
+    out, whose target might have crashed later."""
+  records = (common.read_json(CACHE_PATH) or {}).get(job_type) or []
+  crash_times = [seconds for seconds, crashed in records if crashed]
+  if not crash_times:
+    return default
+
+  timeout = int(math.ceil(TIMEOUT_FACTOR * max(crash_times)))
+  if len(records) < MIN_RECORDS:
+    timeout = max(timeout, default)
+  timeout = max([timeout] +
+                [seconds for seconds, crashed in records if not crashed])
+  return min(MAX_TIMEOUT, max(MIN_TIMEOUT, timeout))
+
+
+def record(job_type, seconds, crashed=True):
+  """Record that a reproduction of job_type crashed after seconds, or that
+    it timed out after seconds without crashing."""
+  all_records = common.read_json(CACHE_PATH) or {}
+  records = all_records.get(job_type, []) + [[round(seconds, 2), crashed]]
+  all_records[job_type] = records[-MAX_RECORDS:]
+  try:
+    common.write_json(CACHE_PATH, all_records)
+  except (IOError, OSError) as e:
+    logger.debug('Unable to record the crash time: %s', e)
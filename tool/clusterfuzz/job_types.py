@@ -0,0 +1,128 @@
+"""Reads the supported job types with their presets resolved."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+
+from clusterfuzz import common
+from error import error
+
+
+BUILD_TYPES = ['chromium', 'standalone']
+CACHE_PATH = os.path.join(
+    common.CLUSTERFUZZ_CACHE_DIR, 'supported_job_types.json')
+
+logger = logging.getLogger('clusterfuzz')
+# The job types resolved in this process, and the cache key they were
+# resolved with.
+resolved = {}
+
+
+class FrozenDict(dict):
+  """A dict that can't be changed. The resolved job types are shared by all
+    the callers in the process."""
+
+  def raise_read_only(self, *unused_args, **unused_kwargs):
+    raise TypeError('The job types are read-only.')
+
+  __setitem__ = raise_read_only
+  __delitem__ = raise_read_only
+  clear = raise_read_only
+  pop = raise_read_only
+  popitem = raise_read_only
+  setdefault = raise_read_only
+  update = raise_read_only
+
+
+def freeze(value):
+  """Return a read-only copy of value, a tree of dicts and lists."""
+  if isinstance(value, dict):
+    return FrozenDict((k, freeze(v)) for k, v in value.iteritems())
+  if isinstance(value, list):
+    return tuple(freeze(v) for v in value)
+  return value
+
+
+def get_path():
+  """Return the path of supported_job_types.yml."""
+  return common.get_resource(0640, 'resources', 'supported_job_types.yml')
+
+
+def parse_job_definition(job_definition, presets):
+  """Reads in a job definition hash and parses it."""
+
+  to_return = {}
+  if 'preset' in job_definition:
+    to_return = parse_job_definition(presets[job_definition['preset']], presets)
+  for key, val in job_definition.iteritems():
+    if key == 'preset':
+      continue
+    to_return[key] = val
+
+  return to_return
+
+
+def load(path):
+  """Parse the job types in path and resolve their presets."""
+  # yaml is imported here because it's slow to import and the job types are
+  # usually read from the cache.
+  import yaml
+  # The loader backed by libyaml is much faster, but PyYAML might be installed
+  # without it.
+  loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+  with open(path) as stream:
+    job_types_yaml = yaml.load(stream, Loader=loader)
+
+  to_return = {}
+  for build_type in BUILD_TYPES:
+    to_return[build_type] = {}
+    for job_type, job_definition in job_types_yaml[build_type].iteritems():
+      try:
+        to_return[build_type][job_type] = parse_job_definition(
+            job_definition, job_types_yaml['presets'])
+      except KeyError:
+        raise error.BadJobTypeDefinitionError(
+            '%s %s' % (build_type, job_type))
+  return to_return
+
+
+def get_cache_key(path):
+  """Return the key that invalidates the cache when either the job types or
+    the tool change."""
+  return {'mtime': os.path.getmtime(path), 'version': common.get_version()}
+
+
+def get():
+  """Return the read-only job types with their presets resolved. They are
+    resolved once per process, and read from the cache unless
+    supported_job_types.yml has changed since it was written."""
+  path = get_path()
+  key = get_cache_key(path)
+  if resolved.get('key') == key:
+    return resolved['job_types']
+
+  cached = common.read_json(CACHE_PATH)
+  if cached and cached.get('key') == key:
+    job_types = cached['job_types']
+  else:
+    job_types = load(path)
+    try:
+      common.write_json(CACHE_PATH, {'key': key, 'job_types': job_types})
+    except (IOError, OSError) as e:
+      logger.debug('Unable to cache the job types: %s', e)
+
+  resolved['key'] = key
+  resolved['job_types'] = freeze(job_types)
+  return resolved['job_types']
@@ -52,9 +52,11 @@ def start_loggers():
     os.makedirs(LOG_DIR)
   config.dictConfig(logging_config)
   logger = logging.getLogger('clusterfuzz')
-  # Force rolling a log file; each log file represents a single run.
+  # Force rolling a log file; each log file represents a single run. An empty
+  # log has no run to keep, so it's reused instead of renaming every backup.
   for handler in logger.handlers:
-    if isinstance(handler, logging.handlers.RotatingFileHandler):
+    if (isinstance(handler, logging.handlers.RotatingFileHandler) and
+        os.path.getsize(handler.baseFilename) > 0):
       handler.doRollover()
 
 
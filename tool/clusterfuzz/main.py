@@ -16,6 +16,7 @@
 import argparse
 import importlib
 import logging
+import sys
 
 from clusterfuzz import common
 from clusterfuzz import local_logging
@@ -34,52 +35,152 @@ def execute(argv=None):
 
   subparsers.add_parser('supported_job_types',
                         help='List all supported job types')
-  reproduce = subparsers.add_parser('reproduce', help='Reproduce a crash.')
-  reproduce.add_argument('testcase_id', help='The testcase ID.')
-  reproduce.add_argument(
+  export = subparsers.add_parser(
+      'export', help='Write a testcase bundle for offline reproduction.')
+  export.add_argument('testcase_id', help='The testcase ID.')
+  export.add_argument(
+      '-o', '--output', action='store', default=None,
+      help='The bundle path (default: clusterfuzz_testcase_<id>.zip).')
+  prefetch = subparsers.add_parser(
+      'prefetch', help='Fetch the commits needed by testcases in advance.')
+  prefetch.add_argument('testcase_ids', nargs='+', help='The testcase IDs.')
+  out_dirs = subparsers.add_parser(
+      'out-dirs', help=('List the out directories, which are shared by the '
+                        'testcases with the same args.gn.'))
+  out_dirs.add_argument(
+      '--prune', action='store', default=None, type=int, metavar='DAYS',
+      help='Delete the out directories that have not been used for DAYS days.')
+
+  # The options shared by the commands that build or download binaries.
+  build_parser = argparse.ArgumentParser(add_help=False)
+  build_parser.add_argument(
       '-c', '--current', action='store_true', default=False,
       help=('Use the current tree; On the other hand, without --current, '
             'the Chrome repository will be switched to the commit specified in '
             'the testcase.'))
-  reproduce.add_argument(
+  build_parser.add_argument(
       '-b', '--build', action='store', default='chromium',
       choices=['download', 'chromium', 'standalone'],
       help='Select which type of build to run the testcase against.')
-  reproduce.add_argument(
+  build_parser.add_argument(
       '--disable-goma', action='store_true', default=False,
       help='Disable GOMA when building binaries locally.')
-  reproduce.add_argument(
+  build_parser.add_argument(
       '-j', '--goma-threads', action='store', default=None, type=int,
-      help='Manually specify the number of concurrent jobs for a ninja build.')
-  reproduce.add_argument(
+      help=('Manually specify the number of concurrent jobs for a ninja build. '
+            'By default, it is tuned from the available memory and the '
+            'previous builds.'))
+  build_parser.add_argument(
       '-l', '--goma-load', action='store', default=None, type=int,
-      help='Manually specify maximum load average for a ninja build.')
-  reproduce.add_argument(
+      help=('Manually specify maximum load average for a ninja build. By '
+            'default, it is tuned from the previous builds.'))
+  build_parser.add_argument(
       '-i', '--iterations', action='store', default=3, type=int,
       help='Specify the number of times to attempt reproduction.')
-  reproduce.add_argument(
+  build_parser.add_argument(
       '-dx', '--disable-xvfb', action='store_true', default=False,
       help='Disable running testcases in a virtual frame buffer.')
-  reproduce.add_argument(
+  build_parser.add_argument(
       '--target-args', action='store', default='',
       help='Additional arguments for the target (e.g. chrome).')
+  build_parser.add_argument(
+      '--disable-gclient', action='store_true', default=False,
+      help='Disable running gclient commands (e.g. sync, runhooks).')
+  build_parser.add_argument(
+      '--gn-check', action='store_true', default=False,
+      help=(
+          'Run `gn gen` with `--check` to validate header includes. This is '
+          'slow on large trees; therefore, it is disabled by default.'))
+  build_parser.add_argument(
+      '--worktree', action='store_true', default=False,
+      help=(
+          'Build in a pooled git worktree checked out at the revision of the '
+          'testcase instead of checking out your source tree. Each worktree '
+          'keeps its own out directory. The first build in a new worktree '
+          'requires a full `gclient sync`.'))
+
+  reproduce = subparsers.add_parser(
+      'reproduce', help='Reproduce a crash.', parents=[build_parser])
+  reproduce.add_argument('testcase_id', help='The testcase ID.')
   reproduce.add_argument(
       '--edit-mode', action='store_true', default=False,
       help='Edit args.gn before building and target arguments before running.')
-  reproduce.add_argument(
-      '--disable-gclient', action='store_true', default=False,
-      help='Disable running gclient commands (e.g. sync, runhooks).')
   reproduce.add_argument(
       '--enable-debug', action='store_true', default=False,
       help=(
           'Build Chrome with full debug symbols by injecting '
           '`sanitizer_keep_symbols = true` and `is_debug = true` to args.gn. '
           'Ready to debug with GDB.'))
+  reproduce.add_argument(
+      '--bundle', action='store', default=None, dest='bundle_path',
+      help=(
+          'Reproduce from a bundle written by `clusterfuzz export` instead of '
+          'downloading the testcase and resolving its revision.'))
+  reproduce.add_argument(
+      '--daemon', action='store_true', default=False,
+      help=(
+          'Forward the reproduction to `clusterfuzz serve`, which saves the '
+          'startup time. It cannot ask questions; set CF_QUIET to answer yes '
+          'to all of them.'))
+  subparsers.add_parser(
+      'serve', help=('Serve `clusterfuzz reproduce --daemon` from a running '
+                     'process. Reproductions in the same source directory run '
+                     'one at a time.'))
+
+  reproduce_batch = subparsers.add_parser(
+      'reproduce-batch', parents=[build_parser],
+      help=('Reproduce many crashes. Testcases with the same job type, '
+            'revision and build share a single build.'))
+  reproduce_batch.add_argument(
+      'input_file', nargs='?', default='-',
+      help='The file with one testcase ID per line (default: stdin).')
+  # The results don't go to stdout, which gets the logs and the output of
+  # the targets.
+  reproduce_batch.add_argument(
+      '-o', '--output', action='store', required=True,
+      help='The file to append JSON-lines results to.')
+  reproduce_batch.add_argument(
+      '--jobs', action='store', default=4, type=int,
+      help='The number of reproductions to run in parallel.')
+
+  job_server = subparsers.add_parser(
+      'job-server', parents=[build_parser],
+      help=('Hand many crashes out to `clusterfuzz worker` processes, which '
+            'may run on other machines, and collect their results. A worker '
+            'gets the testcases that need a build it already has.'))
+  job_server.add_argument(
+      'input_file', nargs='?', default='-',
+      help='The file with one testcase ID per line (default: stdin).')
+  job_server.add_argument(
+      '-o', '--output', action='store', required=True,
+      help='The file to append JSON-lines results to.')
+  job_server.add_argument(
+      '--host', action='store', default='localhost',
+      help=('The address to listen on. Use 0.0.0.0 to accept workers from '
+            'other machines.'))
+  job_server.add_argument(
+      '--port', action='store', default=8707, type=int,
+      help='The port to listen on.')
+  worker = subparsers.add_parser(
+      'worker', help='Reproduce the crashes of a `clusterfuzz job-server`.')
+  worker.add_argument(
+      '--server', action='store', default='http://localhost:8707',
+      help='The URL of the job server.')
+  worker.add_argument(
+      '--worker-id', action='store', default=None,
+      help='The name of the worker in the results (default: host-pid).')
 
   args = parser.parse_args(argv)
-  command = importlib.import_module('clusterfuzz.commands.%s' % args.command)
+  if getattr(args, 'daemon', False):
+    serve = importlib.import_module('clusterfuzz.commands.serve')
+    argv = sys.argv[1:] if argv is None else argv
+    sys.exit(serve.forward([arg for arg in argv if arg != '--daemon']))
+
+  command = importlib.import_module(
+      'clusterfuzz.commands.%s' % args.command.replace('-', '_'))
 
   arg_dict = {k: v for k, v in vars(args).items()}
   del arg_dict['command']
+  arg_dict.pop('daemon', None)
 
   command.execute(**arg_dict)
@@ -1,5 +1,19 @@
 """Transform the output before printing on screen."""
 
+import re
+import time
+
+from backports.shutil_get_terminal_size import get_terminal_size
+
+
+NINJA_PROGRESS_REGEX = re.compile(r'^\[(\d+)/(\d+)\] ')
+# The progress bar is redrawn at most once per interval.
+PROGRESS_INTERVAL = 0.25
+# The buffered output is sent on a newline, or when it's bigger than
+# FLUSH_SIZE or older than FLUSH_INTERVAL.
+FLUSH_SIZE = 4096
+FLUSH_INTERVAL = 0.1
+
 
 class Base(object):
   """Transform output and send to the output function."""
@@ -7,11 +21,35 @@ class Base(object):
   def set_output(self, output):
     """Set output."""
     self.output = output
+    self.pending = []
+    self.pending_size = 0
+    self.last_flush_time = time.time()
 
   def write(self, s):
-    """Write string to output."""
-    self.output.write(s)
+    """Buffer the string, and send the buffer to output on a newline or when
+      it's big or old enough."""
+    if not s:
+      return
+
+    self.pending.append(s)
+    self.pending_size += len(s)
+    if ('\n' in s or self.pending_size >= FLUSH_SIZE or
+        time.time() - self.last_flush_time >= FLUSH_INTERVAL):
+      self.flush_output()
+
+  def has_pending_output(self):
+    """Return True if some output hasn't been sent."""
+    return bool(self.pending)
+
+  def flush_output(self):
+    """Send the buffer to output. This is also needed when the process waits
+      for user input (e.g. a gdb prompt)."""
+    if self.pending:
+      self.output.write(''.join(self.pending))
+      self.pending = []
+      self.pending_size = 0
     self.output.flush()
+    self.last_flush_time = time.time()
 
   def process(self, string):
     """Process string and send to output_fn."""
@@ -45,6 +83,7 @@ class Hidden(Base):
   def flush(self):
     """Send the residue to output_fn."""
     self.write('.\n')
+    self.flush_output()
 
 
 class Identity(Base):
@@ -56,36 +95,83 @@ class Identity(Base):
 
   def flush(self):
     """Send the residue to output_fn."""
-    self.write('')
+    self.flush_output()
 
 
 class Ninja(Base):
-  """Process ninja output and correctly replace previous lines."""
+  """Render ninja's `[n/m]` lines as a single throttled progress line. Other
+    lines (e.g. compiler errors) are printed as they are."""
 
-  def __init__(self):
+  def __init__(self, interval=PROGRESS_INTERVAL, width=None):
+    self.interval = interval
+    self.width = width or get_terminal_size().columns - 1
     self.current_line = ''
-    self.previous_line_size = 0
+    self.progress = None
+    self.progress_changed = False
+    self.rendered_size = 0
+    self.last_render_time = None
+
+  def clear_progress(self):
+    """Return the string that erases the rendered progress line."""
+    if not self.rendered_size:
+      return ''
+    size = self.rendered_size
+    self.rendered_size = 0
+    self.progress_changed = True
+    return '\r%s\r' % (' ' * size)
+
+  def render_progress(self, now):
+    """Return the string that draws the latest progress line over the
+      previous one."""
+    line = self.progress[:self.width]
+    padding = ' ' * max(0, self.rendered_size - len(line))
+    self.rendered_size = len(line)
+    self.progress_changed = False
+    self.last_render_time = now
+    return '\r%s%s' % (line, padding)
 
   def process(self, string):
-    """Replace the previous line and print output."""
-    if '\n' in string:
-      tokens = string.split('\n')
-      self.current_line += tokens[0]
-      current_line_size = len(self.current_line)
-
-      if current_line_size < self.previous_line_size:
-        self.current_line += ' ' * (self.previous_line_size - current_line_size)
-
-      self.write('\b' * self.previous_line_size)
-      self.write(self.current_line)
-
-      self.previous_line_size = len(self.current_line)
-
-      self.current_line = tokens[-1]
-    else:
-      self.current_line += string
+    """Parse the complete lines and print them with a single write."""
+    lines = (self.current_line + string).split('\n')
+    self.current_line = lines.pop()
+
+    chunks = []
+    for line in lines:
+      line = line.rstrip('\r')
+      match = NINJA_PROGRESS_REGEX.match(line)
+      if match:
+        finished, total = match.groups()
+        self.progress = '[%s/%s] %d%% %s' % (
+            finished, total, int(finished) * 100 / max(1, int(total)),
+            line[match.end():])
+        self.progress_changed = True
+      else:
+        chunks.append(self.clear_progress())
+        chunks.append(line + '\n')
+
+    now = time.time()
+    rendered = False
+    if (self.progress_changed and self.progress is not None and
+        (self.last_render_time is None or
+         now - self.last_render_time >= self.interval)):
+      chunks.append(self.render_progress(now))
+      rendered = True
+
+    self.write(''.join(chunks))
+    # The progress line has no newline, so it's sent right away.
+    if rendered:
+      self.flush_output()
 
   def flush(self):
-    """Print the residue output."""
-    self.process('\n')
-    self.write('\n')
+    """Print the residue output and the final progress."""
+    if self.current_line:
+      self.process('\n')
+
+    chunks = []
+    if self.progress_changed and self.progress is not None:
+      chunks.append(self.render_progress(time.time()))
+    if self.rendered_size:
+      chunks.append('\n')
+      self.rendered_size = 0
+    self.write(''.join(chunks))
+    self.flush_output()
@@ -0,0 +1,353 @@
+"""Runs a command in a process tree that is killed at once, with limits and
+  accounting of its memory and CPU usage.
+
+With cgroup v2 delegated to us, the command runs in its own cgroup, which its
+descendants can't leave by calling setsid. Otherwise, the descendants are
+tracked with psutil."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import itertools
+import logging
+import os
+import signal
+import time
+
+import psutil
+
+
+MOUNTS_PATH = '/proc/mounts'
+SELF_CGROUP_PATH = '/proc/self/cgroup'
+CONTROLLERS = ['cpu', 'memory']
+CPU_MAX_PERIOD = 100000
+# The seconds between the samples of the memory usage.
+SAMPLE_INTERVAL = 1
+# The seconds to wait for the kernel to freeze or to empty a cgroup.
+FREEZE_TIMEOUT = 1
+
+logger = logging.getLogger('clusterfuzz')
+cgroup_ids = itertools.count()
+
+Usage = collections.namedtuple(
+    'Usage', ['peak_memory', 'cpu_time', 'process_count'])
+
+
+def get_cgroup_root():
+  """Return the cgroup v2 directory of this process, or None without cgroup
+    v2."""
+  with open(MOUNTS_PATH) as f:
+    mount_points = [
+        line.split()[1] for line in f if line.split()[2:3] == ['cgroup2']]
+  if not mount_points:
+    return None
+
+  with open(SELF_CGROUP_PATH) as f:
+    for line in f:
+      if line.startswith('0::'):
+        return os.path.join(mount_points[0], line[3:].strip().lstrip('/'))
+  return None
+
+
+def get_rss(pids):
+  """Return the resident memory of the processes."""
+  rss = 0
+  for pid in pids:
+    try:
+      rss += psutil.Process(pid).memory_info().rss
+    except psutil.Error:
+      continue
+  return rss
+
+
+class ProcessTree(object):
+  """A command and all of its descendants."""
+
+  interval = SAMPLE_INTERVAL
+
+  def __init__(self, memory_limit=None):
+    self.memory_limit = memory_limit
+    self.peak_memory = 0
+    self.pids = set()
+
+  def preexec(self):
+    """Run in the child before it runs the command."""
+    os.setsid()
+
+  def start(self, pid):
+    """Start tracking the command once it runs."""
+
+  def get_pids(self):
+    """Return the processes in the tree."""
+    raise NotImplementedError
+
+  def get_memory(self):
+    """Return the memory used by the tree."""
+    raise NotImplementedError
+
+  def get_cpu_time(self):
+    """Return the CPU seconds used by the tree."""
+    raise NotImplementedError
+
+  def kill(self):
+    """Kill the whole tree."""
+    raise NotImplementedError
+
+  def close(self):
+    """Kill what is left of the tree, e.g. the processes that outlived the
+      command, and release its resources."""
+
+  def get_peak_memory(self):
+    """Return the highest memory usage that was sampled."""
+    return self.peak_memory
+
+  def get_process_count(self):
+    """Return the number of processes that were sampled in the tree."""
+    return len(self.pids)
+
+  def check_limits(self):
+    """Sample the memory usage and the processes, and return True if the
+      memory usage is over the limit."""
+    self.pids.update(self.get_pids())
+    memory = self.get_memory()
+    self.peak_memory = max(self.peak_memory, memory)
+    if self.memory_limit and memory > self.memory_limit:
+      logger.info(
+          'Stopping the process. It uses %d MB of memory, which is more than '
+          'the limit of %d MB.', memory / 1024 / 1024,
+          self.memory_limit / 1024 / 1024)
+      return True
+    return False
+
+  def get_usage(self):
+    """Return the peak memory, the CPU time and the process count of the
+      tree."""
+    return Usage(
+        self.get_peak_memory(), self.get_cpu_time(), self.get_process_count())
+
+
+class CgroupTree(ProcessTree):
+  """A process tree in its own cgroup. The kernel enforces the limits when
+    the memory and cpu controllers are delegated."""
+
+  def __init__(self, path, memory_limit=None, cpu_limit=None):
+    super(CgroupTree, self).__init__(memory_limit)
+    self.path = path
+    self.pid = None
+    os.mkdir(path)
+    try:
+      if memory_limit:
+        self.write_limit('memory.max', str(memory_limit))
+      if cpu_limit:
+        self.write_limit('cpu.max', '%d %d' % (
+            cpu_limit * CPU_MAX_PERIOD, CPU_MAX_PERIOD))
+    except (IOError, OSError):
+      os.rmdir(path)
+      raise
+
+  def get_file_path(self, name):
+    return os.path.join(self.path, name)
+
+  def read(self, name):
+    with open(self.get_file_path(name)) as f:
+      return f.read()
+
+  def write(self, name, value):
+    with open(self.get_file_path(name), 'w') as f:
+      f.write(value)
+
+  def write_limit(self, name, value):
+    """Set the limit if its controller is enabled."""
+    if os.path.exists(self.get_file_path(name)):
+      self.write(name, value)
+    else:
+      logger.debug('Unable to set %s because its controller is disabled.', name)
+
+  def preexec(self):
+    """Move the child into the cgroup, which its descendants inherit."""
+    try:
+      self.write('cgroup.procs', str(os.getpid()))
+    except (IOError, OSError):
+      # The child is still killed with its process group.
+      pass
+    os.setsid()
+
+  def start(self, pid):
+    self.pid = pid
+
+  def get_pids(self):
+    """Return the processes in the cgroup."""
+    return [int(pid) for pid in self.read('cgroup.procs').split()]
+
+  def get_memory(self):
+    if os.path.exists(self.get_file_path('memory.current')):
+      return int(self.read('memory.current'))
+    return get_rss(self.get_pids())
+
+  def get_peak_memory(self):
+    # memory.peak misses nothing between the samples, but it's new in Linux
+    # 5.19.
+    if os.path.exists(self.get_file_path('memory.peak')):
+      return int(self.read('memory.peak'))
+    return self.peak_memory
+
+  def get_cpu_time(self):
+    for line in self.read('cpu.stat').splitlines():
+      name, value = line.split()
+      if name == 'usage_usec':
+        return int(value) / 1e6
+    return 0
+
+  def freeze(self, frozen):
+    """Freeze or thaw the cgroup, and wait until it's done."""
+    self.write('cgroup.freeze', '1' if frozen else '0')
+    deadline = time.time() + FREEZE_TIMEOUT
+    while ('frozen %d' % frozen not in self.read('cgroup.events') and
+           time.time() < deadline):
+      time.sleep(0.01)
+
+  def kill_processes(self):
+    """Kill the processes in the cgroup. Without cgroup.kill, which is new in
+      Linux 5.14, the cgroup is frozen first, so that no process forks while
+      it's killed."""
+    if os.path.exists(self.get_file_path('cgroup.kill')):
+      self.write('cgroup.kill', '1')
+      return
+
+    self.freeze(True)
+    for pid in self.get_pids():
+      try:
+        os.kill(pid, signal.SIGKILL)
+      except OSError:
+        continue
+    self.freeze(False)
+
+  def kill(self):
+    self.kill_processes()
+    # The command isn't in the cgroup if it failed to move itself there.
+    if self.pid:
+      try:
+        os.killpg(self.pid, signal.SIGKILL)
+      except OSError:
+        pass
+
+  def close(self):
+    self.kill_processes()
+    # The killed processes leave the cgroup asynchronously.
+    deadline = time.time() + FREEZE_TIMEOUT
+    while ('populated 1' in self.read('cgroup.events') and
+           time.time() < deadline):
+      time.sleep(0.01)
+    try:
+      os.rmdir(self.path)
+    except OSError as e:
+      logger.debug('Unable to remove the cgroup %s: %s', self.path, e)
+
+
+class TrackedTree(ProcessTree):
+  """A process tree that is tracked with psutil. A descendant that daemonizes
+    and whose parent exits between two samples escapes it."""
+
+  def __init__(self, memory_limit=None):
+    super(TrackedTree, self).__init__(memory_limit)
+    self.processes = {}
+    self.cpu_times = {}
+
+  def start(self, pid):
+    try:
+      self.processes[pid] = psutil.Process(pid)
+    except psutil.Error:
+      pass
+
+  def update(self):
+    """Track the new descendants and the CPU time of every process."""
+    # Every tracked process is searched, because the descendants of a process
+    # whose parent exited aren't the children of the command anymore.
+    for process in self.processes.values():
+      try:
+        children = process.children(recursive=True)
+      except psutil.Error:
+        continue
+      for child in children:
+        self.processes.setdefault(child.pid, child)
+
+    for pid, process in self.processes.items():
+      try:
+        times = process.cpu_times()
+      except psutil.Error:
+        # The CPU time of the process stays what it was last.
+        del self.processes[pid]
+        continue
+      self.cpu_times[pid] = times.user + times.system
+
+  def get_pids(self):
+    self.update()
+    return self.processes.keys()
+
+  def get_memory(self):
+    self.update()
+    return get_rss(self.processes.keys())
+
+  def get_cpu_time(self):
+    self.update()
+    return sum(self.cpu_times.values())
+
+  def kill(self):
+    """Stop all of the processes, so that none forks while they are killed,
+      and kill them."""
+    self.update()
+    for sig in [signal.SIGSTOP, signal.SIGKILL]:
+      for process in self.processes.values():
+        try:
+          process.send_signal(sig)
+        except psutil.Error:
+          continue
+
+  def close(self):
+    self.kill()
+
+
+def enable_controllers(root):
+  """Let the cgroups under root use the cpu and memory controllers. The kernel
+    refuses it if root has processes of its own, and then the limits are only
+    enforced by sampling."""
+  with open(os.path.join(root, 'cgroup.controllers')) as f:
+    available = f.read().split()
+  with open(os.path.join(root, 'cgroup.subtree_control')) as f:
+    enabled = f.read().split()
+
+  for controller in CONTROLLERS:
+    if controller not in available or controller in enabled:
+      continue
+    try:
+      with open(os.path.join(root, 'cgroup.subtree_control'), 'w') as f:
+        f.write('+%s' % controller)
+    except (IOError, OSError) as e:
+      logger.debug('Unable to enable the %s controller: %s', controller, e)
+
+
+def create(memory_limit=None, cpu_limit=None):
+  """Return a process tree in a new cgroup if cgroup v2 is delegated to us,
+    or a tracked one otherwise. memory_limit is in bytes, and cpu_limit is in
+    CPUs. Only cgroups enforce the CPU limit."""
+  try:
+    root = get_cgroup_root()
+    if root and os.access(root, os.W_OK):
+      enable_controllers(root)
+      path = os.path.join(
+          root, 'clusterfuzz-%d-%d' % (os.getpid(), next(cgroup_ids)))
+      return CgroupTree(path, memory_limit, cpu_limit)
+  except (IOError, OSError) as e:
+    logger.debug('Unable to create a cgroup: %s', e)
+  return TrackedTree(memory_limit)
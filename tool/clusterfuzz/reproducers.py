@@ -13,7 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import HTMLParser
+import hashlib
 import json
 import logging
 import os
@@ -26,7 +26,9 @@ import psutil
 import xvfbwrapper
 
 from clusterfuzz import common
+from clusterfuzz import crash_times
 from clusterfuzz import output_transformer
+from clusterfuzz import process_tree
 from error import error
 
 
@@ -35,37 +37,22 @@ DEFAULT_GESTURE_TIME = 5
 TEST_TIMEOUT = 30
 USER_DATA_DIR_PATH = '/tmp/clusterfuzz-user-data-dir'
 USER_DATA_DIR_ARG = '--user-data-dir'
+# The length of the output that is kept for every distinct crash signature.
+SIGNATURE_OUTPUT_LENGTH = 100000
+# A target that neither prints nor uses the CPU for this long seems to hang.
+# It's longer than the shortest adaptive timeout, so that a testcase that
+# waits on a timer isn't stopped before its timeout.
+IDLE_TIMEOUT = 2 * crash_times.MIN_TIMEOUT
+# The seconds between the samples of the CPU time of the target.
+IDLE_SAMPLE_INTERVAL = 1
+# The CPU seconds per second below which the target is idle.
+IDLE_CPU_RATE = 0.01
+# The share of the memory of the machine that the target may use.
+MEMORY_LIMIT_RATIO = 0.8
 
 logger = logging.getLogger('clusterfuzz')
 
 
-def strip_html(lines):
-  """Strip HTML tags and escape HTML chars."""
-  new_lines = []
-  parser = HTMLParser.HTMLParser()
-
-  for line in lines:
-    # We only strip <a> because that's all we need.
-    line = re.sub('<[/a][^<]+?>', '', line)
-    new_lines.append(parser.unescape(line))
-
-  return new_lines
-
-
-def get_only_first_stacktrace(lines):
-  """Get the first stacktrace because multiple stacktraces would make stacktrace
-    parsing wrong."""
-  new_lines = []
-  for line in lines:
-    line = line.rstrip()
-    if line.startswith('+----') and new_lines:
-      break
-    # We don't add the empty lines in the beginning.
-    if new_lines or line:
-      new_lines.append(line)
-  return new_lines
-
-
 def maybe_fix_dict_args(args, build_dir):
   """Fix the dict args of libfuzzer args if exists."""
   dict_path = args.get('dict')
@@ -98,14 +85,15 @@ def serialize_libfuzzer_args(args):
 def is_similar(new_signature, original_signature):
   """Check if the new state is similar enough to the original state."""
   count = 0
-  if new_signature.crash_type == original_signature.crash_type:
+  if new_signature.key[0] == original_signature.key[0]:
     count += 1
 
-  for line in new_signature.crash_state_lines:
-    if line in original_signature.crash_state_lines:
+  original_frames = set(original_signature.frames)
+  for frame in new_signature.frames:
+    if frame in original_frames:
       count += 1
 
-  return count >= len(original_signature.crash_state_lines)
+  return count >= len(original_signature.frames)
 
 
 def deserialize_sanitizer_options(options):
@@ -126,15 +114,17 @@ def serialize_sanitizer_options(options):
   return ':'.join(pairs)
 
 
-def ensure_user_data_dir_if_needed(args, require_user_data_dir):
-  """Ensure the right user-data-dir."""
+def ensure_user_data_dir_if_needed(args, require_user_data_dir, testcase_id):
+  """Ensure the right user-data-dir. Every testcase gets its own, so that
+    reproduce-batch can run the testcases in parallel."""
   if not require_user_data_dir and USER_DATA_DIR_ARG not in args:
     return args
 
   # Remove --user-data-dir-arg if exist.
   args = re.sub('%s[^ ]+' % USER_DATA_DIR_ARG, '', args)
-  common.delete_if_exists(USER_DATA_DIR_PATH)
-  return '%s %s=%s' % (args, USER_DATA_DIR_ARG, USER_DATA_DIR_PATH)
+  user_data_dir = '%s-%s' % (USER_DATA_DIR_PATH, testcase_id)
+  common.delete_if_exists(user_data_dir)
+  return '%s %s=%s' % (args, USER_DATA_DIR_ARG, user_data_dir)
 
 
 def update_testcase_path_in_layout_test(
@@ -162,6 +152,75 @@ def update_for_gdb_if_needed(binary_path, args, timeout, should_enable_gdb):
   return 'gdb', args, None
 
 
+def parse_stacktrace(job_type, trace):
+  """Post a stacktrace to ClusterFuzz and return its crash signature."""
+  response = common.post(
+      url=('https://clusterfuzz.com/v2/parse_stacktrace'),
+      data=json.dumps({'job': job_type, 'stacktrace': trace}))
+  response = json.loads(response.text)
+  crash_state_lines = tuple(
+      [x for x in response['crash_state'].split('\n') if x])
+  crash_type = response['crash_type'].replace('\n', ' ')
+  return common.CrashSignature(crash_type, crash_state_lines)
+
+
+def get_original_crash_signature(testcase):
+  """Return the crash signature of the first stacktrace of the testcase."""
+  return parse_stacktrace(
+      testcase.job_type, '\n'.join(testcase.stacktrace.first_stacktrace))
+
+
+def get_cpu_time(pid):
+  """Return the CPU seconds used by the process and its descendants, or None
+    if it has exited."""
+  try:
+    process = psutil.Process(pid)
+    processes = [process] + process.children(recursive=True)
+  except psutil.Error:
+    return None
+
+  cpu_time = 0
+  for process in processes:
+    try:
+      times = process.cpu_times()
+    except psutil.Error:
+      # The child has exited since it was listed.
+      continue
+    cpu_time += times.user + times.system
+  return cpu_time
+
+
+class IdleDetector(object):
+  """Detects a target that seems to hang because it has neither printed nor
+    used the CPU for a while."""
+
+  def __init__(self, idle_timeout=IDLE_TIMEOUT, interval=IDLE_SAMPLE_INTERVAL):
+    self.idle_timeout = idle_timeout
+    self.interval = interval
+    self.active_time = time.time()
+    self.cpu_time = None
+    self.sample_time = None
+
+  def record_output(self):
+    """Record that the target has printed."""
+    self.active_time = time.time()
+
+  def is_idle(self, pid):
+    """Sample the CPU time of the target, and return True if it has been idle
+      for idle_timeout."""
+    now = time.time()
+    cpu_time = get_cpu_time(pid)
+    if cpu_time is None:
+      return False
+
+    if (self.cpu_time is not None and
+        cpu_time - self.cpu_time > IDLE_CPU_RATE * (now - self.sample_time)):
+      self.active_time = now
+    self.cpu_time = cpu_time
+    self.sample_time = now
+    return now - self.active_time >= self.idle_timeout
+
+
 class BaseReproducer(object):
   """The basic reproducer class that all other ones are built on."""
 
@@ -179,6 +238,7 @@ class BaseReproducer(object):
     self.definition = definition
     self.original_testcase_path = testcase.absolute_path
     self.testcase_path = testcase.get_testcase_path()
+    self.testcase_id = testcase.id
     self.job_type = testcase.job_type
     self.environment = testcase.environment
     self.args = testcase.reproduction_args
@@ -192,10 +252,8 @@ class BaseReproducer(object):
     self.options = options
     self.timeout = TEST_TIMEOUT
 
-    stacktrace_lines = strip_html(
-        [l['content'] for l in testcase.stacktrace_lines])
-    stacktrace_lines = get_only_first_stacktrace(stacktrace_lines)
-    self.crash_signature = self.get_stacktrace_info('\n'.join(stacktrace_lines))
+    self.crash_signature = (
+        testcase.crash_signature or get_original_crash_signature(testcase))
 
     self.gesture_start_time = (self.get_gesture_start_time() if self.gestures
                                else None)
@@ -233,30 +291,76 @@ class BaseReproducer(object):
     self.set_up_symbolizers_suppressions()
     self.setup_args()
 
+  def get_detectors(self):
+    """Return the detectors that stop the target shortly after its crash
+      report or once it seems to hang. The target isn't stopped in gdb
+      because the user is using it, and a target that waits for its gestures
+      isn't idle."""
+    if self.options.enable_debug:
+      return None, None
+    idle_detector = None if self.gestures else IdleDetector()
+    return common.CrashReportDetector(), idle_detector
+
+  def create_process_tree(self):
+    """Return the process tree that the target runs in, which leaves some
+      memory and a CPU to the rest of the machine, or None in gdb."""
+    if self.options.enable_debug:
+      return None
+    return process_tree.create(
+        memory_limit=int(psutil.virtual_memory().total * MEMORY_LIMIT_RATIO),
+        cpu_limit=max(1, psutil.cpu_count() - 1))
+
+  def close_process_tree(self, tree):
+    """Report the resource usage of the target, and kill what is left of
+      it."""
+    if not tree:
+      return
+    usage = tree.get_usage()
+    tree.close()
+    logger.info(
+        'The target used %d MB of memory at most, %.1f seconds of CPU time, '
+        'and %d processes.', usage.peak_memory / 1024 / 1024, usage.cpu_time,
+        usage.process_count)
+
+  def record_crash_time(self, crash_detector, start_time):
+    """Record how long the target took to print its crash report, or that it
+      timed out, which adapts the timeouts of the job type."""
+    if not crash_detector:
+      return
+    if crash_detector.report_time:
+      crash_times.record(
+          self.job_type, crash_detector.report_time - start_time)
+    elif time.time() - start_time >= self.timeout:
+      crash_times.record(self.job_type, self.timeout, crashed=False)
+
   def reproduce_crash(self):
     """Reproduce the crash."""
-    # read_buffer_length needs to be 1, and stdin needs to be UserStdin.
-    # Otherwise, it wouldn't work well with gdb.
-    return common.execute(
-        self.binary_path, self.args,
-        self.build_directory, env=self.environment,
-        exit_on_error=False, timeout=self.timeout,
-        stdout_transformer=output_transformer.Identity(),
-        redirect_stderr_to_stdout=True,
-        stdin=common.UserStdin(),
-        read_buffer_length=1)
+    crash_detector, idle_detector = self.get_detectors()
+    tree = self.create_process_tree()
+    output_buffer = common.OutputBuffer()
+    start_time = time.time()
+    try:
+      # read_buffer_length needs to be 1, and stdin needs to be UserStdin.
+      # Otherwise, it wouldn't work well with gdb.
+      result = common.execute(
+          self.binary_path, self.args,
+          self.build_directory, env=self.environment,
+          exit_on_error=False, timeout=self.timeout,
+          stdout_transformer=output_transformer.Identity(),
+          redirect_stderr_to_stdout=True,
+          stdin=common.UserStdin(),
+          read_buffer_length=1,
+          output_buffer=output_buffer, crash_detector=crash_detector,
+          idle_detector=idle_detector, process_tree=tree)
+    finally:
+      output_buffer.close()
+      self.close_process_tree(tree)
+    self.record_crash_time(crash_detector, start_time)
+    return result
 
   def get_stacktrace_info(self, trace):
     """Post a stacktrace, return (crash_state, crash_type)."""
-
-    response = common.post(
-        url=('https://clusterfuzz.com/v2/parse_stacktrace'),
-        data=json.dumps({'job': self.job_type, 'stacktrace': trace}))
-    response = json.loads(response.text)
-    crash_state_lines = tuple(
-        [x for x in response['crash_state'].split('\n') if x])
-    crash_type = response['crash_type'].replace('\n', ' ')
-    return common.CrashSignature(crash_type, crash_state_lines)
+    return parse_stacktrace(self.job_type, trace)
 
   def setup_args(self):
     """Setup args."""
@@ -284,6 +388,7 @@ class BaseReproducer(object):
     else:
       self.args += ' %s' % self.testcase_path
 
+    self.timeout = crash_times.get_timeout(self.job_type, self.timeout)
     self.binary_path, self.args, self.timeout = update_for_gdb_if_needed(
         self.binary_path, self.args, self.timeout, self.options.enable_debug)
     self.args = common.edit_if_needed(
@@ -300,12 +405,15 @@ class BaseReproducer(object):
     """Reproduce normally."""
     iterations = 1
     signatures = set()
+    outputs = {}
     while iterations <= iteration_max:
       _, output = self.reproduce_crash()
 
       new_signature = self.get_stacktrace_info(output)
-      new_signature.output = output
+      new_signature.output_digest = hashlib.sha1(output).hexdigest()
       signatures.add(new_signature)
+      outputs.setdefault(
+          new_signature.output_digest, output[:SIGNATURE_OUTPUT_LENGTH])
 
       logger.info(
           'New crash type: %s\n'
@@ -336,7 +444,7 @@ class BaseReproducer(object):
       iterations += 1
       time.sleep(3)
 
-    raise error.UnreproducibleError(iteration_max, signatures)
+    raise error.UnreproducibleError(iteration_max, signatures, outputs)
 
   # TODO(tanin): Remove iteration_max and use self.options.iterations.
   def reproduce(self, iteration_max):
@@ -477,7 +585,7 @@ class LinuxChromeJobReproducer(BaseReproducer):
   def pre_build_steps(self):
     """Steps to run before building."""
     self.args = ensure_user_data_dir_if_needed(
-        self.args, self.definition.require_user_data_dir)
+        self.args, self.definition.require_user_data_dir, self.testcase_id)
     self.testcase_path = update_testcase_path_in_layout_test(
         self.testcase_path, self.original_testcase_path, self.source_directory)
 
@@ -513,23 +621,34 @@ class LinuxChromeJobReproducer(BaseReproducer):
   def reproduce_crash(self):
     """Reproduce the crash, running gestures if necessary."""
 
+    crash_detector, idle_detector = self.get_detectors()
+    tree = self.create_process_tree()
+    output_buffer = common.OutputBuffer()
+    start_time = time.time()
     with Xvfb(self.options.disable_xvfb) as display_name:
       self.environment['DISPLAY'] = display_name
 
-      # stdin needs to be UserStdin. Otherwise, it wouldn't work with gdb.
-      process = common.start_execute(
-          self.binary_path, self.args,
-          self.build_directory, env=self.environment,
-          stdin=common.UserStdin(),
-          redirect_stderr_to_stdout=True)
-
-      if self.gestures:
-        self.run_gestures(process, display_name)
-
-      # read_buffer_length needs to be 1. Otherwise, it wouldn't work well with
-      # gdb.
-      err, out = common.wait_execute(
-          process, exit_on_error=False, timeout=self.timeout,
-          stdout_transformer=output_transformer.Identity(),
-          read_buffer_length=1)
+      try:
+        # stdin needs to be UserStdin. Otherwise, it wouldn't work with gdb.
+        process = common.start_execute(
+            self.binary_path, self.args,
+            self.build_directory, env=self.environment,
+            stdin=common.UserStdin(),
+            redirect_stderr_to_stdout=True,
+            process_tree=tree)
+
+        if self.gestures:
+          self.run_gestures(process, display_name)
+
+        # read_buffer_length needs to be 1. Otherwise, it wouldn't work well
+        # with gdb.
+        err, out = common.wait_execute(
+            process, exit_on_error=False, timeout=self.timeout,
+            stdout_transformer=output_transformer.Identity(),
+            read_buffer_length=1, output_buffer=output_buffer,
+            crash_detector=crash_detector, idle_detector=idle_detector)
+      finally:
+        output_buffer.close()
+        self.close_process_tree(tree)
+      self.record_crash_time(crash_detector, start_time)
       return err, self.post_run_symbolize(out)
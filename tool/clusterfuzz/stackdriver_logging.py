@@ -24,8 +24,6 @@ import traceback
 
 from clusterfuzz import common
 from clusterfuzz import local_logging
-from httplib2 import Http
-from oauth2client.service_account import ServiceAccountCredentials
 from error import error
 
 
@@ -42,6 +40,10 @@ def get_session_id():
 
 def send_log(params, stacktrace=None):
   """Joins the params dict with info like user id and then sends logs."""
+  # oauth2client and httplib2 are slow to import, and only the commands that
+  # log to Stackdriver need them.
+  from httplib2 import Http
+  from oauth2client.service_account import ServiceAccountCredentials
 
   scopes = ['https://www.googleapis.com/auth/logging.write']
   filename = common.get_resource(
@@ -90,10 +92,17 @@ def send_start(params):
   send_log(params)
 
 
+def add_resource_usage(params):
+  """Add the resources used by the commands of the run, by binary, e.g. to
+    size the CI machines."""
+  params['resource_usage'] = common.resource_account.get_totals()
+
+
 def send_success(params):
   """Sends a success message to show the reproduction completed."""
   params = params.copy()
   params['success'] = True
+  add_resource_usage(params)
   send_log(params)
 
 
@@ -106,6 +115,7 @@ def send_failure(exception, stacktrace, params):
     params['extras'] = exception.extras
 
   params['success'] = False
+  add_resource_usage(params)
   send_log(params, stacktrace)
 
 
@@ -141,6 +151,8 @@ def log(func):
           e.__class__.__name__, e.message)
       sys.exit(e.exit_code)
     finally:
+      logger.debug('Resource usage by binary: %s', json.dumps(
+          common.resource_account.get_totals(), sort_keys=True))
       print ('\nDetailed log of this run can be found in: %s' %
              local_logging.LOG_FILE_PATH)
   return wrapped
@@ -0,0 +1,136 @@
+"""Runs the independent steps of a command concurrently, e.g. downloading the
+  testcase while the build is prepared, and reports the critical path."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import logging
+import sys
+import threading
+import time
+from multiprocessing import pool
+
+
+# The seconds between the checks for KeyboardInterrupt while waiting. Waiting
+# on a condition without a timeout can't be interrupted in Python 2.
+WAIT_INTERVAL = 0.5
+
+logger = logging.getLogger('clusterfuzz')
+
+
+class Task(object):
+  """A step, and the names of the steps that it needs."""
+
+  def __init__(self, name, fn, deps):
+    self.name = name
+    self.fn = fn
+    self.deps = deps
+    self.result = None
+    self.start_time = None
+    self.end_time = None
+
+  def get_duration(self):
+    return self.end_time - self.start_time
+
+
+class TaskGraph(object):
+  """Runs every task on a thread pool once the tasks it depends on are done.
+    A task depends only on tasks that were added before it; therefore, the
+    graph has no cycle."""
+
+  def __init__(self, name):
+    self.name = name
+    self.tasks = collections.OrderedDict()
+
+  def add(self, name, fn, deps=()):
+    """Add the task name, which runs fn after the tasks in deps, with their
+      results as the arguments."""
+    for dep in deps:
+      if dep not in self.tasks:
+        raise ValueError('%s depends on the unknown task %s.' % (name, dep))
+    self.tasks[name] = Task(name, fn, list(deps))
+
+  def run(self):
+    """Run the tasks, and return their results by name. After a task fails,
+      no other task is started, and its exception is raised once the running
+      tasks are done."""
+    pending = self.tasks.values()
+    running = set()
+    done = set()
+    errors = []
+    condition = threading.Condition()
+
+    def run_task(task):
+      task.start_time = time.time()
+      try:
+        task.result = task.fn(*[self.tasks[dep].result for dep in task.deps])
+      except BaseException:  # pylint: disable=broad-except
+        with condition:
+          errors.append(sys.exc_info())
+      finally:
+        task.end_time = time.time()
+        with condition:
+          running.remove(task.name)
+          done.add(task.name)
+          condition.notify()
+
+    thread_pool = pool.ThreadPool(max(1, len(self.tasks)))
+    try:
+      with condition:
+        while True:
+          ready = [] if errors else [
+              task for task in pending if set(task.deps) <= done]
+          for task in ready:
+            pending.remove(task)
+            running.add(task.name)
+            thread_pool.apply_async(run_task, (task,))
+          if not running:
+            break
+          condition.wait(WAIT_INTERVAL)
+    finally:
+      # The threads aren't joined after an interruption, because they might
+      # wait for a command that outlives it.
+      thread_pool.close()
+
+    if errors:
+      exc_type, exc_value, exc_traceback = errors[0]
+      raise exc_type, exc_value, exc_traceback
+    return dict((name, task.result) for name, task in self.tasks.iteritems())
+
+  def get_critical_path(self):
+    """Return the chain of tasks that the run waited for: the task that ended
+      last, the dependency of it that ended last, and so on."""
+    path = []
+    candidates = [task for task in self.tasks.values() if task.end_time]
+    while candidates:
+      task = max(candidates, key=lambda t: t.end_time)
+      path.append(task)
+      candidates = [self.tasks[dep] for dep in task.deps]
+    return list(reversed(path))
+
+  def log_critical_path(self, level=logging.INFO):
+    """Log the critical path, and how much time running the tasks
+      concurrently saved."""
+    path = self.get_critical_path()
+    if not path:
+      return
+    ran = [task for task in self.tasks.values() if task.end_time]
+    elapsed = (max(task.end_time for task in ran) -
+               min(task.start_time for task in ran))
+    logger.log(
+        level, 'The %s took %.1f seconds instead of %.1f one step after '
+        'another. Critical path: %s', self.name, elapsed,
+        sum(task.get_duration() for task in ran),
+        ' -> '.join('%s (%.1fs)' % (task.name, task.get_duration())
+                    for task in path))
@@ -13,20 +13,151 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
+import htmlentitydefs
 import os
+import re
+import shutil
+import time
 import zipfile
 import logging
 
 from clusterfuzz import common
+from error import error
 
 
 CLUSTERFUZZ_TESTCASE_URL = (
     'https://%s/v2/testcase-detail/download-testcase?id=%s' %
     (common.DOMAIN_NAME, '%s'))
 DOWNLOAD_TIMEOUT = 100
+# The downloaded testcase is reused without asking Clusterfuzz within
+# TESTCASE_FILE_TTL. After that, it's reused if its size hasn't changed.
+TESTCASE_FILE_TTL = 60 * 60
+ENVIRONMENT_PREFIX = '[Environment] '
+COMMAND_PREFIX = 'Running command: '
+STACKTRACE_SEPARATOR = '+----'
+# We only strip <a> because that's all we need.
+HTML_TAG_REGEX = re.compile('<[/a][^<]+?>')
+HTML_ENTITY_REGEX = re.compile(r'&(#?[xX]?(?:[0-9a-fA-F]+|\w{1,8}));')
+HTML_ENTITIES = dict(htmlentitydefs.name2codepoint, apos=ord("'"))
 logger = logging.getLogger('clusterfuzz')
 
 
+def get_cache_dir(testcase_id):
+  """Return the directory that caches the data of the testcase."""
+  return os.path.join(
+      common.CLUSTERFUZZ_TESTCASES_DIR, '%s_cache' % testcase_id)
+
+
+def get_file_sha256(path):
+  """Return the sha256 of the file's content."""
+  digest = hashlib.sha256()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(65536), b''):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def get_remote_testcase_size(testcase_id):
+  """Return the size of the testcase file on Clusterfuzz, or None if it's
+    unknown."""
+  # requests is imported here because it's slow to import; common.head
+  # imports it anyway.
+  import requests
+  try:
+    response = common.head(
+        CLUSTERFUZZ_TESTCASE_URL % testcase_id,
+        headers={
+            'Authorization': common.get_stored_auth_header(),
+            'User-Agent': 'clusterfuzz-tools'},
+        allow_redirects=True)
+  except requests.exceptions.RequestException:
+    return None
+
+  if response.status_code != 200 or 'content-length' not in response.headers:
+    return None
+  return int(response.headers['content-length'])
+
+
+def unescape_html_entity(match):
+  """Return the character of the matched HTML entity."""
+  entity = match.group(1)
+  try:
+    if entity.startswith(('#x', '#X')):
+      return unichr(int(entity[2:], 16))
+    if entity.startswith('#'):
+      return unichr(int(entity[1:]))
+  except ValueError:
+    return match.group(0)
+  if entity in HTML_ENTITIES:
+    return unichr(HTML_ENTITIES[entity])
+  return match.group(0)
+
+
+def encode_utf8(value):
+  """Return value as a UTF-8 str. The environment and the args are passed to
+    processes, which need bytes."""
+  if isinstance(value, unicode):
+    return value.encode('utf-8')
+  return value
+
+
+def clean_stacktrace_line(line):
+  """Strip the <a> tags and unescape the HTML entities of a stacktrace
+    line."""
+  if '<' in line:
+    line = HTML_TAG_REGEX.sub('', line)
+  if '&' in line:
+    line = HTML_ENTITY_REGEX.sub(unescape_html_entity, line)
+  return line
+
+
+class Stacktrace(object):
+  """The information in the stacktrace of a testcase, read in a single pass:
+    the environment, the reproduction args, the binary name and the first
+    stacktrace. Multiple stacktraces would make stacktrace parsing wrong."""
+
+  def __init__(self, lines):
+    self.environment = {}
+    self.args = ''
+    self.binary_name = None
+    self.first_stacktrace = []
+
+    in_first_stacktrace = True
+    for line in lines:
+      line = clean_stacktrace_line(line['content'])
+
+      if ENVIRONMENT_PREFIX in line:
+        self.parse_environment_line(line)
+      elif COMMAND_PREFIX in line:
+        tokens = line.replace(COMMAND_PREFIX, '').split(' ')
+        if self.binary_name is None:
+          self.binary_name = os.path.basename(tokens[0])
+        # Strip off the binary & testcase paths.
+        self.args = encode_utf8(' '.join(tokens[1:len(tokens)-1]))
+
+      if in_first_stacktrace:
+        line = line.rstrip()
+        if line.startswith(STACKTRACE_SEPARATOR) and self.first_stacktrace:
+          in_first_stacktrace = False
+        # We don't add the empty lines in the beginning.
+        elif self.first_stacktrace or line:
+          self.first_stacktrace.append(line)
+
+  def parse_environment_line(self, line):
+    """Add the variable set by an [Environment] line."""
+    tokens = line.replace(ENVIRONMENT_PREFIX, '').split(' = ', 1)
+    if len(tokens) != 2:
+      return
+    name, value = [encode_utf8(token) for token in tokens]
+
+    if '_OPTIONS' in name:
+      value = value.replace('symbolize=0', 'symbolize=1')
+      if 'symbolize=1' not in value:
+        value += ':symbolize=1'
+    self.environment[name] = value
+
+
 class Testcase(object):
   """The Testase module, to abstract away logic using the testcase JSON."""
 
@@ -38,51 +169,22 @@ class Testcase(object):
     else:
       return '.%s' % split_filename[-1]
 
-  def _unescape(self, string):
-    """Un-escape a string."""
-    string = string.replace("&lt;", "<")
-    string = string.replace("&gt;", ">")
-    string = string.replace("&apos;", "'")
-    string = string.replace("&quot;", "\"")
-    # This has to be last call.
-    string = string.replace("&amp;", "&")
-    return string
-
   def get_environment_and_args(self):
-    """Sets up the environment by parsing stacktrace lines."""
-
-    new_env = {}
-    args = ''
-    stacktrace_lines = [self._unescape(line['content'])
-                        for line in self.stacktrace_lines]
-    for line in stacktrace_lines:
-      if '[Environment] ' in line:
-        line = line.replace('[Environment] ', '')
-        tokens = line.split(' = ', 1)
-        if len(tokens) != 2:
-          continue
-        name, value = tokens
-
-        if '_OPTIONS' in name:
-          value = value.replace('symbolize=0', 'symbolize=1')
-          if 'symbolize=1' not in value:
-            value += ':symbolize=1'
-        new_env[name] = value
-
-      elif 'Running command: ' in line:
-        line = line.replace('Running command: ', '').split(' ')
-
-        # Strip off the binary & testcase paths.
-        line = line[1:len(line)-1]
-
-        args = " ".join(line)
+    """Return the environment and the args of the command that crashed."""
+    return dict(self.stacktrace.environment), self.stacktrace.args
 
-    return new_env, args
+  def get_binary_name(self):
+    """Return the name of the binary that crashed."""
+    if self.stacktrace.binary_name is None:
+      raise error.MinimizationNotFinishedError()
+    return self.stacktrace.binary_name
 
-  def __init__(self, testcase_json):
+  def __init__(self, testcase_json, bundle=None):
 
+    self.bundle = bundle
     self.id = testcase_json['id']
     self.stacktrace_lines = testcase_json['crash_stacktrace']['lines']
+    self.stacktrace = Stacktrace(self.stacktrace_lines)
     self.environment, self.reproduction_args = self.get_environment_and_args()
     if not self.reproduction_args:
       self.reproduction_args = (
@@ -98,8 +200,14 @@ class Testcase(object):
     self.crash_type = testcase_json['crash_type']
     self.crash_state = testcase_json['crash_state']
     self.gn_args = testcase_json['metadata'].get('gn_args')
+    if bundle:
+      self.gn_args = bundle.gn_args
     if self.gn_args:
       self.gn_args = self.gn_args.rstrip('\n')
+    # The original crash signature is parsed by ClusterFuzz unless it comes
+    # from a bundle.
+    self.crash_signature = bundle.crash_signature if bundle else None
+    self.downloaded_file = None
 
   def testcase_dir_name(self):
     """Returns a testcases' respective directory."""
@@ -131,6 +239,65 @@ class Testcase(object):
     common.delete_if_exists(testcase_dir)
     os.makedirs(testcase_dir)
 
+    downloaded_filename = self.download_testcase(testcase_dir)
+    filename = self.get_true_testcase_path(downloaded_filename)
+
+    return filename
+
+  def download_testcase(self, testcase_dir):
+    """Download the testcase file to testcase_dir, or extract it from the
+      bundle, and return its name."""
+    if self.bundle:
+      logger.info('Extracting testcase data from %s...', self.bundle.path)
+      return self.bundle.extract_testcase_files(testcase_dir)[0]
+
+    path = self.get_downloaded_testcase_file()
+    shutil.copy(path, testcase_dir)
+    return os.path.basename(path)
+
+  def get_downloaded_testcase_file(self):
+    """Return the testcase file in the cache, and download it first if
+      needed. It can run ahead of get_testcase_path, e.g. while the build is
+      prepared."""
+    if not self.downloaded_file:
+      self.downloaded_file = (
+          self.get_cached_testcase_file() or self.fetch_testcase_file())
+    return self.downloaded_file
+
+  def get_download_manifest_path(self):
+    """Return the path of the manifest of the downloaded testcase file."""
+    return os.path.join(get_cache_dir(self.id), 'download.json')
+
+  def get_cached_testcase_file(self):
+    """Return the downloaded testcase file if it's intact and its size on
+      Clusterfuzz hasn't changed. Return None otherwise."""
+    manifest = common.read_json(self.get_download_manifest_path())
+    if not manifest:
+      return None
+
+    path = os.path.join(
+        get_cache_dir(self.id), 'download', manifest['filename'])
+    if (not os.path.isfile(path) or
+        os.path.getsize(path) != manifest['size'] or
+        get_file_sha256(path) != manifest['sha256']):
+      return None
+
+    if time.time() - manifest['fetched_at'] >= TESTCASE_FILE_TTL:
+      remote_size = get_remote_testcase_size(self.id)
+      if remote_size is not None and remote_size != manifest['size']:
+        return None
+      manifest['fetched_at'] = time.time()
+      common.write_json(self.get_download_manifest_path(), manifest)
+
+    logger.info('Reusing the downloaded testcase data.')
+    return path
+
+  def fetch_testcase_file(self):
+    """Download the testcase file to the cache and return its path."""
+    download_dir = os.path.join(get_cache_dir(self.id), 'download')
+    common.delete_if_exists(download_dir)
+    os.makedirs(download_dir)
+
     logger.info('Downloading testcase data...')
 
     auth_header = common.get_stored_auth_header()
@@ -140,9 +307,13 @@ class Testcase(object):
         '--no-verbose --waitretry=%s --retry-connrefused --content-disposition '
         '--header="Authorization: %s" "%s"' %
         (DOWNLOAD_TIMEOUT, auth_header, CLUSTERFUZZ_TESTCASE_URL % self.id))
-    common.execute('wget', args, testcase_dir)
-    downloaded_filename = os.listdir(testcase_dir)[0]
+    common.execute('wget', args, download_dir)
+    filename = os.listdir(download_dir)[0]
 
-    filename = self.get_true_testcase_path(downloaded_filename)
-
-    return filename
+    path = os.path.join(download_dir, filename)
+    common.write_json(self.get_download_manifest_path(), {
+        'filename': filename,
+        'size': os.path.getsize(path),
+        'sha256': get_file_sha256(path),
+        'fetched_at': time.time()})
+    return path
@@ -0,0 +1,189 @@
+"""Installs a pex into a pre-extracted directory with a launcher.
+
+A pex built with zip_safe=False is extracted into ~/.pex on the first run of
+every new version, and every run still resolves its distributions through
+the zip. This unzips the pex once, compiles it, and writes a launcher that
+puts the extracted code on sys.path and calls the entry point directly.
+
+Usage (with the interpreter that should run the tool):
+  python tool/pex_launcher.py dist/clusterfuzz-ci.pex --link ~/bin/clusterfuzz
+"""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import argparse
+import compileall
+import hashlib
+import json
+import os
+import shutil
+import sys
+import tempfile
+import zipfile
+
+
+INSTALL_ROOT = os.path.expanduser(os.path.join('~', '.clusterfuzz', 'pex'))
+LAUNCHER_NAME = 'launcher'
+# The members of the pex that only its own bootstrapping needs.
+SKIPPED_PREFIXES = ('.bootstrap/', '__main__.py')
+HASH_LENGTH = 12
+READ_BUFFER_LENGTH = 65536
+
+LAUNCHER_TEMPLATE = '''#!%(executable)s
+"""Runs %(entry_point)s from the extracted pex in this directory."""
+import os
+import site
+import sys
+
+ROOT = os.path.dirname(os.path.realpath(__file__))
+
+# Like the pex, only the standard library is used from the interpreter.
+sys.path = [
+    path for path in sys.path
+    if not path.endswith(('site-packages', 'dist-packages'))]
+for path in %(dep_paths)r:
+  # addsitedir handles the .pth files of namespace packages.
+  site.addsitedir(os.path.join(ROOT, path))
+
+from %(module)s import %(function)s
+sys.exit(%(function)s())
+'''
+
+
+def get_file_hash(path):
+  """Return the sha1 of the file."""
+  sha1 = hashlib.sha1()
+  with open(path, 'rb') as f:
+    for chunk in iter(lambda: f.read(READ_BUFFER_LENGTH), ''):
+      sha1.update(chunk)
+  return sha1.hexdigest()
+
+
+def get_install_name(pex_path):
+  """Return the name of the install directory, e.g.
+    clusterfuzz-ci-0123456789ab. A new pex gets a new directory, so a running
+    launcher is never changed underneath."""
+  name = os.path.splitext(os.path.basename(pex_path))[0]
+  return '%s-%s' % (name, get_file_hash(pex_path)[:HASH_LENGTH])
+
+
+def extract(pex_path, dest):
+  """Extract the code and the distributions of the pex into dest, and return
+    the PEX-INFO."""
+  with zipfile.ZipFile(pex_path) as pex:
+    pex_info = json.loads(pex.read('PEX-INFO'))
+    for member in pex.namelist():
+      # The .pyc files in the pex might be from another interpreter.
+      if member.startswith(SKIPPED_PREFIXES) or member.endswith('.pyc'):
+        continue
+      pex.extract(member, dest)
+  return pex_info
+
+
+def write_launcher(dest, pex_info):
+  """Write the launcher of the entry point into dest."""
+  deps_dir = os.path.join(dest, '.deps')
+  dep_paths = []
+  if os.path.isdir(deps_dir):
+    dep_paths = [os.path.join('.deps', name)
+                 for name in sorted(os.listdir(deps_dir))]
+
+  module, function = pex_info['entry_point'].split(':')
+  path = os.path.join(dest, LAUNCHER_NAME)
+  with open(path, 'w') as f:
+    f.write(LAUNCHER_TEMPLATE % {
+        'executable': sys.executable,
+        'entry_point': pex_info['entry_point'],
+        'dep_paths': dep_paths,
+        'module': module,
+        'function': function})
+  os.chmod(path, 0755)
+  return path
+
+
+def install(pex_path, root=INSTALL_ROOT):
+  """Install the pex into root unless it's already installed, and return the
+    path of its launcher."""
+  dest = os.path.join(root, get_install_name(pex_path))
+  launcher_path = os.path.join(dest, LAUNCHER_NAME)
+  if os.path.exists(launcher_path):
+    return launcher_path
+
+  if not os.path.exists(root):
+    os.makedirs(root)
+
+  # The pex is installed into a temporary directory and renamed, so a
+  # launcher is never seen half-installed.
+  tmp_dest = tempfile.mkdtemp(dir=root)
+  try:
+    pex_info = extract(pex_path, tmp_dest)
+    write_launcher(tmp_dest, pex_info)
+    compileall.compile_dir(tmp_dest, quiet=True)
+    os.chmod(tmp_dest, 0755)
+    os.rename(tmp_dest, dest)
+  except OSError:
+    # Another install of the same pex won the race.
+    if not os.path.exists(launcher_path):
+      raise
+  finally:
+    if os.path.exists(tmp_dest):
+      shutil.rmtree(tmp_dest)
+  return launcher_path
+
+
+def link(launcher_path, link_path):
+  """Point link_path at the launcher. The link is replaced atomically because
+    the old version might be running."""
+  tmp_link_path = '%s.%s.tmp' % (link_path, os.getpid())
+  os.symlink(launcher_path, tmp_link_path)
+  os.rename(tmp_link_path, link_path)
+
+
+def prune(pex_path, root, keep):
+  """Delete all but the `keep` most recent installs of the same pex name."""
+  name = os.path.splitext(os.path.basename(pex_path))[0]
+  installs = []
+  for install_name in os.listdir(root):
+    prefix, _, install_hash = install_name.rpartition('-')
+    if prefix == name and len(install_hash) == HASH_LENGTH:
+      path = os.path.join(root, install_name)
+      installs.append((os.path.getmtime(path), path))
+
+  for _, path in sorted(installs, reverse=True)[keep:]:
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument('pex_path', help='The pex to install.')
+  parser.add_argument(
+      '--root', default=INSTALL_ROOT,
+      help='The directory of the installs (default: %(default)s).')
+  parser.add_argument(
+      '--link', default=None,
+      help='The path of a symlink to the launcher, e.g. the binary in PATH.')
+  parser.add_argument(
+      '--keep', default=3, type=int,
+      help='The number of installs of this pex to keep (default: 3).')
+  args = parser.parse_args(argv)
+
+  launcher_path = install(args.pex_path, args.root)
+  if args.link:
+    link(launcher_path, args.link)
+  prune(args.pex_path, args.root, args.keep)
+  print launcher_path
+
+
+if __name__ == '__main__':
+  main()
@@ -13,11 +13,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fcntl
 import os
 import json
+import shutil
+import subprocess
+import tempfile
+import threading
 import mock
 
 from clusterfuzz import binary_providers
+from clusterfuzz import build_tuner
 from clusterfuzz import common
 from clusterfuzz import output_transformer
 from error import error
@@ -48,6 +54,7 @@ class ShaFromRevisionTest(helpers.ExtendedTestCase):
 
   def setUp(self):
     helpers.patch(self, ['urlfetch.fetch'])
+    binary_providers.resolved_shas.clear()
 
   def test_get_sha_from_response_body(self):
     """Tests to ensure that the sha is grabbed from the response correctly"""
@@ -60,6 +67,13 @@ class ShaFromRevisionTest(helpers.ExtendedTestCase):
     result = binary_providers.sha_from_revision(123456, 'v8/v8')
     self.assertEqual(result, '1a2s3d4f')
 
+  def test_resolved(self):
+    """Tests using the resolved sha, e.g. from a bundle."""
+    binary_providers.resolved_shas['v8/v8@123456'] = 'sha'
+    self.assertEqual(
+        'sha', binary_providers.sha_from_revision(123456, 'v8/v8'))
+    self.assert_n_calls(0, [self.mock.fetch])
+
 
 class GetPdfiumShaTest(helpers.ExtendedTestCase):
   """Tests the get_pdfium_sha method."""
@@ -70,6 +84,7 @@ class GetPdfiumShaTest(helpers.ExtendedTestCase):
         body=('dmFycyA9IHsNCiAgJ3BkZml1bV9naXQnOiAnaHR0cHM6Ly9wZGZpdW0uZ29vZ'
               '2xlc291cmNlLmNvbScsDQogICdwZGZpdW1fcmV2aXNpb24nOiAnNDA5MzAzOW'
               'QxOWY4MzIxNzNlYzU4Y2ZkOWYyZThhYzM5M2E3NjA5MScsDQp9DQo='))
+    binary_providers.resolved_shas.clear()
 
   def test_decode_pdfium_sha(self):
     """Tests if the method correctly grabs the sha from the b64 download."""
@@ -156,7 +171,11 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.V8Builder.download_build_data',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.V8Builder.checkout_source_by_sha',
+        'clusterfuzz.binary_providers.V8Builder.checkout_worktree',
         'clusterfuzz.binary_providers.V8Builder.build_target',
+        'clusterfuzz.binary_providers.V8Builder.get_gn_args',
+        'clusterfuzz.binary_providers.lock_source_directory',
+        'clusterfuzz.binary_providers.record_out_dir',
         'clusterfuzz.common.ask',
         'clusterfuzz.binary_providers.get_current_sha',
         'clusterfuzz.common.execute',
@@ -167,6 +186,9 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
     self.mock.get_current_sha.return_value = '1a2s3d4f5g6h'
     self.mock.execute.return_value = [0, '']
     self.chrome_source = os.path.join('chrome', 'src', 'dir')
+    self.mock.get_gn_args.return_value = 'use_goma = true'
+    self.out_dir = binary_providers.get_out_dir(
+        self.chrome_source, 'use_goma = true')
 
   def test_parameter_not_set_valid_source(self):
     """Tests functionality when build has never been downloaded."""
@@ -179,13 +201,19 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
         testcase, definition, libs.make_options(testcase_id=testcase.id))
 
     result = provider.get_build_directory()
-    self.assertEqual(
-        result, os.path.join(self.chrome_source, 'out', 'clusterfuzz_12345'))
+    self.assertEqual(result, self.out_dir)
     self.assert_exact_calls(self.mock.download_build_data,
                             [mock.call(provider)])
     self.assert_exact_calls(self.mock.build_target, [mock.call(provider)])
     self.assert_exact_calls(self.mock.checkout_source_by_sha,
                             [mock.call(provider)])
+    self.mock.record_out_dir.assert_called_once_with(
+        self.out_dir, testcase.job_type, 12345)
+    self.mock.execute.assert_called_once_with(
+        'gclient', 'sync', self.chrome_source)
+    self.assertTrue(provider.source_synced)
+    self.mock.lock_source_directory.assert_called_once_with(
+        self.chrome_source)
     self.assert_n_calls(0, [self.mock.ask])
 
   def test_parameter_not_set_invalid_source(self):
@@ -201,14 +229,29 @@ class V8BuilderGetBuildDirectoryTest(helpers.ExtendedTestCase):
     self.mock.get_source_directory.return_value = self.chrome_source
 
     result = provider.get_build_directory()
-    self.assertEqual(
-        result, os.path.join(self.chrome_source, 'out', 'clusterfuzz_12345'))
+    self.assertEqual(result, self.out_dir)
     self.assert_exact_calls(self.mock.download_build_data,
                             [mock.call(provider)])
     self.assert_exact_calls(self.mock.build_target, [mock.call(provider)])
     self.assert_exact_calls(self.mock.checkout_source_by_sha,
                             [mock.call(provider)])
 
+  def test_worktree(self):
+    """Tests building in a worktree instead of checking out the source."""
+
+    self.mock_os_environment({'V8_SRC': self.chrome_source})
+    testcase = mock.Mock(id=12345, build_url=self.build_url, revision=54321,
+                         gn_args=None)
+    definition = mock.Mock(source_var='V8_SRC')
+    provider = binary_providers.V8Builder(
+        testcase, definition,
+        libs.make_options(testcase_id=testcase.id, worktree=True))
+
+    provider.get_build_directory()
+    self.assert_exact_calls(self.mock.checkout_worktree,
+                            [mock.call(provider)])
+    self.assert_n_calls(0, [self.mock.checkout_source_by_sha])
+
   def test_parameter_already_set(self):
     """Tests functionality when build_directory parameter is already set."""
 
@@ -263,6 +306,7 @@ class BuildTargetTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.binary_providers.V8Builder.get_goma_cores',
         'clusterfuzz.binary_providers.V8Builder.get_goma_load',
+        'clusterfuzz.build_tuner.NinjaTuner.monitor',
         'clusterfuzz.binary_providers.V8Builder.setup_gn_args',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.common.execute'])
@@ -300,6 +344,22 @@ class BuildTargetTest(helpers.ExtendedTestCase):
         output_transformer.Ninja)
     self.assert_exact_calls(self.mock.setup_gn_args, [mock.call(builder)])
 
+  def test_synced(self):
+    """Tests not running `gclient sync` again."""
+    self.mock_os_environment({'V8_SRC': '/chrome/source'})
+    testcase = mock.Mock(id=54321, build_url='', revision=12345)
+    definition = mock.Mock(source_var='V8_SRC', binary_name='binary')
+    builder = binary_providers.V8Builder(
+        testcase, definition, libs.make_options())
+    builder.build_directory = '/chrome/source/out/clusterfuzz_54321'
+    builder.source_synced = True
+    builder.build_target()
+
+    self.assertNotIn(mock.call('gclient', 'sync', '/chrome/source'),
+                     self.mock.execute.call_args_list)
+    self.mock.monitor.assert_called_once_with(
+        builder.get_tuner(), '/chrome/source/out/clusterfuzz_54321')
+
 
 class SetupGnArgsTest(helpers.ExtendedTestCase):
   """Tests the setup_gn_args method."""
@@ -310,14 +370,16 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.setup_debug_symbol_if_needed',
+        'clusterfuzz.binary_providers.is_build_ninja_up_to_date',
         'clusterfuzz.common.edit_if_needed',
     ])
     self.testcase_dir = os.path.expanduser(os.path.join('~', 'test_dir'))
-    testcase = mock.Mock(id=1234, build_url='', revision=54321, gn_args=None)
+    self.testcase = mock.Mock(
+        id=1234, build_url='', revision=54321, gn_args=None)
     self.mock_os_environment({'V8_SRC': '/chrome/source/dir'})
     self.definition = mock.Mock(source_var='V8_SRC')
     self.builder = binary_providers.V8Builder(
-        testcase, self.definition, libs.make_options(goma_dir='/goma/dir'))
+        self.testcase, self.definition, libs.make_options(goma_dir='/goma/dir'))
 
     self.mock.setup_debug_symbol_if_needed.side_effect = lambda v, _1, _2: v
     self.mock.edit_if_needed.side_effect = (
@@ -332,6 +394,9 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
       f.write('goma_dir = /not/correct/dir\n')
       f.write('use_goma = true')
 
+    self.builder = binary_providers.V8Builder(
+        self.testcase, self.definition,
+        libs.make_options(goma_dir='/goma/dir', gn_check=True))
     self.builder.build_directory = self.testcase_dir
     self.builder.setup_gn_args()
 
@@ -362,8 +427,7 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
     self.builder.setup_gn_args()
 
     self.assert_exact_calls(self.mock.execute, [
-        mock.call('gn', 'gen --check %s' % self.testcase_dir,
-                  '/chrome/source/dir')])
+        mock.call('gn', 'gen  %s' % self.testcase_dir, '/chrome/source/dir')])
     with open(os.path.join(self.testcase_dir, 'args.gn'), 'r') as f:
       self.assertEqual(f.read(), 'goma_dir = "/goma/dir"\nuse_goma = true')
     self.mock.setup_debug_symbol_if_needed.assert_called_once_with(
@@ -373,6 +437,87 @@ class SetupGnArgsTest(helpers.ExtendedTestCase):
         'goma_dir = "/goma/dir"\nuse_goma = true', prefix=mock.ANY,
         comment=mock.ANY, should_edit=False)
 
+  def test_args_unchanged(self):
+    """Tests skipping gn gen when args.gn is unchanged and build.ninja is
+      up-to-date."""
+    os.makedirs(self.testcase_dir)
+    with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
+      f.write('goma_dir = "/goma/dir"\nuse_goma = true')
+    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
+    os.makedirs(build_dir)
+    with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
+      f.write('goma_dir = /not/correct/dir')
+    self.mock.is_build_ninja_up_to_date.return_value = True
+
+    self.builder.build_directory = self.testcase_dir
+    self.builder.setup_gn_args()
+
+    self.assert_n_calls(0, [self.mock.execute])
+    self.assertEqual(
+        'goma_dir = "/goma/dir"\nuse_goma = true', self.builder.gn_args)
+    self.mock.is_build_ninja_up_to_date.assert_called_once_with(
+        self.testcase_dir)
+
+  def test_build_ninja_outdated(self):
+    """Tests running gn gen when args.gn is unchanged but build.ninja is
+      out-of-date."""
+    os.makedirs(self.testcase_dir)
+    with open(os.path.join(self.testcase_dir, 'args.gn'), 'w') as f:
+      f.write('goma_dir = "/goma/dir"\nuse_goma = true')
+    build_dir = os.path.join(common.CLUSTERFUZZ_BUILDS_DIR, '1234_build')
+    os.makedirs(build_dir)
+    with open(os.path.join(build_dir, 'args.gn'), 'w') as f:
+      f.write('goma_dir = /not/correct/dir')
+    self.mock.is_build_ninja_up_to_date.return_value = False
+
+    self.builder.build_directory = self.testcase_dir
+    self.builder.setup_gn_args()
+
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('gn', 'gen  %s' % self.testcase_dir, '/chrome/source/dir')])
+
+
+class IsBuildNinjaUpToDateTest(helpers.ExtendedTestCase):
+  """Tests is_build_ninja_up_to_date."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.build_dir = '/chrome/src/out/dir'
+    os.makedirs(self.build_dir)
+    os.makedirs('/chrome/src/base')
+    self.build_ninja = os.path.join(self.build_dir, 'build.ninja')
+
+    for path in ['/chrome/src/BUILD.gn', '/chrome/src/base/BUILD.gn',
+                 os.path.join(self.build_dir, 'args.gn'), self.build_ninja]:
+      with open(path, 'w') as f:
+        f.write('content')
+      os.utime(path, (100, 100))
+    with open('%s.d' % self.build_ninja, 'w') as f:
+      f.write('build.ninja: ../../BUILD.gn ../../base/BUILD.gn ./args.gn\n')
+
+  def test_up_to_date(self):
+    """Test when build.ninja is newer than its inputs."""
+    os.utime(self.build_ninja, (200, 200))
+    self.assertTrue(binary_providers.is_build_ninja_up_to_date(self.build_dir))
+
+  def test_input_changed(self):
+    """Test when an input is newer than build.ninja."""
+    os.utime('/chrome/src/base/BUILD.gn', (300, 300))
+    os.utime(self.build_ninja, (200, 200))
+    self.assertFalse(
+        binary_providers.is_build_ninja_up_to_date(self.build_dir))
+
+  def test_input_deleted(self):
+    """Test when an input doesn't exist anymore."""
+    os.remove('/chrome/src/base/BUILD.gn')
+    self.assertFalse(
+        binary_providers.is_build_ninja_up_to_date(self.build_dir))
+
+  def test_no_build_ninja(self):
+    """Test when build.ninja hasn't been generated."""
+    os.remove(self.build_ninja)
+    self.assertFalse(
+        binary_providers.is_build_ninja_up_to_date(self.build_dir))
 
 
 class CheckoutSourceByShaTest(helpers.ExtendedTestCase):
@@ -433,6 +578,149 @@ class CheckoutSourceByShaTest(helpers.ExtendedTestCase):
     self.assert_n_calls(0, [self.mock.check_confirm, self.mock.execute])
 
 
+class CheckoutWorktreeTest(helpers.ExtendedTestCase):
+  """Tests the checkout_worktree method."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.ensure_sha',
+        'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.binary_providers.WorktreePool',
+    ])
+    self.mock_os_environment({'V8_SRC': '/chrome/src'})
+    testcase = mock.Mock(id=12345, build_url='', revision=4567)
+    definition = mock.Mock(source_var='V8_SRC', binary_name='binary')
+    self.builder = binary_providers.ChromiumBuilder(
+        testcase, definition, libs.make_options(worktree=True))
+    self.builder.git_sha = '1a2s3d4f'
+
+  def test_checkout(self):
+    """Tests switching the source directory to the worktree."""
+    self.mock.WorktreePool.return_value.acquire.return_value = '/worktree/src'
+    self.builder.checkout_worktree()
+
+    self.assertEqual('/worktree/src', self.builder.source_directory)
+    self.mock.ensure_sha.assert_called_once_with('1a2s3d4f', '/chrome/src')
+    self.mock.WorktreePool.assert_called_once_with('/chrome/src')
+    self.mock.WorktreePool.return_value.acquire.assert_called_once_with(
+        4567, '1a2s3d4f')
+
+
+class WorktreePoolTest(helpers.ExtendedTestCase):
+  """Tests WorktreePool."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.common.execute',
+        'clusterfuzz.binary_providers.is_repo_dirty',
+        'time.time',
+    ])
+    self.mock.is_repo_dirty.return_value = False
+    self.mock.time.return_value = 1000
+    self.mock.execute.side_effect = self._execute
+    os.makedirs('/chrome/src')
+    with open('/chrome/.gclient', 'w') as f:
+      f.write('solutions = []')
+    self.pool = binary_providers.WorktreePool('/chrome/src', size=2)
+
+  def _execute(self, binary, args, cwd):
+    """Create the worktree directory like git does."""
+    if args.startswith('worktree add'):
+      os.makedirs(args.split(' ')[3])
+    return 0, ''
+
+  def _make_worktrees(self, worktrees):
+    """Create worktrees and store them in the manifest."""
+    os.makedirs(self.pool.pool_directory)
+    for worktree in worktrees:
+      os.makedirs(worktree['path'])
+    self.pool.save(worktrees)
+
+  def test_add(self):
+    """Test adding the first worktree."""
+    path = self.pool.acquire(100, 'sha1')
+
+    self.assertEqual(os.path.join(self.pool.pool_directory, '0', 'src'), path)
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('git', 'worktree prune', '/chrome/src'),
+        mock.call('git', 'worktree add --detach %s sha1' % path, '/chrome/src')
+    ])
+    self.assertTrue(os.path.isfile(
+        os.path.join(self.pool.pool_directory, '0', '.gclient')))
+    self.assertEqual(
+        [{'path': path, 'revision': 100, 'sha': 'sha1', 'last_used': 1000}],
+        self.pool.load())
+
+  def test_reuse_exact(self):
+    """Test reusing the worktree on the same sha."""
+    path = os.path.join(self.pool.pool_directory, '0', 'src')
+    self._make_worktrees(
+        [{'path': path, 'revision': 100, 'sha': 'sha1', 'last_used': 1}])
+
+    self.assertEqual(path, self.pool.acquire(100, 'sha1'))
+    self.assert_n_calls(0, [self.mock.execute])
+    self.assertEqual(1000, self.pool.load()[0]['last_used'])
+
+  def test_reuse_nearest(self):
+    """Test checking out the nearest worktree."""
+    far = os.path.join(self.pool.pool_directory, '0', 'src')
+    near = os.path.join(self.pool.pool_directory, '1', 'src')
+    self._make_worktrees([
+        {'path': far, 'revision': 100, 'sha': 'sha1', 'last_used': 1},
+        {'path': near, 'revision': 600, 'sha': 'sha2', 'last_used': 1}])
+
+    self.assertEqual(near, self.pool.acquire(500, 'sha3'))
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('git', 'checkout sha3', near)])
+    self.assertEqual(
+        [('sha1', 100), ('sha3', 500)],
+        [(w['sha'], w['revision']) for w in self.pool.load()])
+
+  def test_add_when_far(self):
+    """Test adding a worktree when no worktree is near."""
+    path = os.path.join(self.pool.pool_directory, '0', 'src')
+    self._make_worktrees(
+        [{'path': path, 'revision': 100, 'sha': 'sha1', 'last_used': 1}])
+
+    self.assertEqual(os.path.join(self.pool.pool_directory, '1', 'src'),
+                     self.pool.acquire(50000, 'sha2'))
+    self.assertEqual(2, len(self.pool.load()))
+
+  def test_evict_lru(self):
+    """Test checking out the least recently used worktree when the pool is
+      full."""
+    old = os.path.join(self.pool.pool_directory, '0', 'src')
+    new = os.path.join(self.pool.pool_directory, '1', 'src')
+    self._make_worktrees([
+        {'path': new, 'revision': 100, 'sha': 'sha1', 'last_used': 20},
+        {'path': old, 'revision': 200, 'sha': 'sha2', 'last_used': 10}])
+
+    self.assertEqual(old, self.pool.acquire(50000, 'sha3'))
+    self.assert_exact_calls(self.mock.execute, [
+        mock.call('git', 'checkout sha3', old)])
+
+  def test_dirty(self):
+    """Test raising an error when the worktree to check out is dirty."""
+    path = os.path.join(self.pool.pool_directory, '0', 'src')
+    self._make_worktrees(
+        [{'path': path, 'revision': 100, 'sha': 'sha1', 'last_used': 1}])
+    self.mock.is_repo_dirty.return_value = True
+
+    with self.assertRaises(error.DirtyRepoError):
+      self.pool.acquire(200, 'sha2')
+    self.assert_n_calls(0, [self.mock.execute])
+
+  def test_drop_deleted(self):
+    """Test dropping worktrees that were deleted."""
+    path = os.path.join(self.pool.pool_directory, '0', 'src')
+    self._make_worktrees(
+        [{'path': path, 'revision': 100, 'sha': 'sha1', 'last_used': 1}])
+    os.rmdir(path)
+
+    self.assertEqual([], self.pool.load())
+
+
 class EnsureShaTest(helpers.ExtendedTestCase):
   """Tests ensure_sha."""
 
@@ -460,21 +748,180 @@ class EnsureShaTest(helpers.ExtendedTestCase):
         'git', 'fetch origin sha', 'source')
 
 
+class EnsureShasTest(helpers.ExtendedTestCase):
+  """Tests ensure_shas."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.common.execute',
+        'clusterfuzz.binary_providers.sha_exists',
+    ])
+
+  def test_all_exist(self):
+    """Test when all shas exist."""
+    self.mock.sha_exists.return_value = True
+    binary_providers.ensure_shas(['b', 'a', 'b'], 'source')
+
+    self.assert_exact_calls(self.mock.sha_exists, [
+        mock.call('a', 'source'), mock.call('b', 'source')])
+    self.assertEqual(0, self.mock.execute.call_count)
+
+  def test_fetch_missing(self):
+    """Test fetching all missing shas at once."""
+    self.mock.sha_exists.side_effect = lambda sha, _: sha == 'b'
+    binary_providers.ensure_shas(['c', 'b', 'a'], 'source')
+
+    self.mock.execute.assert_called_once_with(
+        'git', 'fetch origin a c', 'source')
+
+
 class V8BuilderOutDirNameTest(helpers.ExtendedTestCase):
   """Tests the out_dir_name builder method."""
 
   def setUp(self):
-    helpers.patch(self, ['clusterfuzz.binary_providers.sha_from_revision'])
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.sha_from_revision',
+        'clusterfuzz.common.edit_if_needed',
+    ])
     self.mock_os_environment({'V8_SRC': '/source/dir'})
-    testcase = mock.Mock(id=1234, build_url='', revision=54321)
-    definition = mock.Mock(source_var='V8_SRC')
-    self.builder = binary_providers.V8Builder(
-        testcase, definition, libs.make_options(testcase_id=testcase.id))
+    self.mock.edit_if_needed.side_effect = (
+        lambda content, prefix, comment, should_edit: content)
+
+  def create_builder(self, gn_args, **options):
+    testcase = mock.Mock(id=1234, build_url='', revision=54321,
+                         gn_args=gn_args)
+    definition = mock.Mock(source_var='V8_SRC', sanitizer='ASAN')
+    return binary_providers.V8Builder(
+        testcase, definition, libs.make_options(testcase_id=testcase.id,
+                                                **options))
 
   def test_dir(self):
-    """Tests when no changes have been made to the dir."""
-    result = self.builder.out_dir_name()
-    self.assertEqual(result, '/source/dir/out/clusterfuzz_1234')
+    """Tests naming the dir after the hash of the effective args.gn."""
+    builder = self.create_builder('is_asan = true')
+    self.assertEqual(
+        binary_providers.get_out_dir(
+            '/source/dir', 'is_asan = true\nuse_goma = false'),
+        builder.out_dir_name())
+    self.assertRegexpMatches(
+        builder.out_dir_name(), r'^/source/dir/out/clusterfuzz_[0-9a-f]{12}$')
+
+  def test_same_args(self):
+    """Tests sharing the dir between testcases with the same args.gn."""
+    self.assertEqual(
+        self.create_builder('a = 1\nb = 2').out_dir_name(),
+        self.create_builder('b = 2\na = 1').out_dir_name())
+
+  def test_different_args(self):
+    """Tests not sharing the dir when the goma or debug options differ."""
+    builder = self.create_builder('is_asan = true')
+    self.assertNotEqual(
+        builder.out_dir_name(),
+        self.create_builder('is_asan = true',
+                            enable_debug=True).out_dir_name())
+    self.assertNotEqual(
+        builder.out_dir_name(),
+        self.create_builder('is_asan = true',
+                            goma_dir='/goma').out_dir_name())
+
+  def test_edit_once(self):
+    """Tests letting the user edit args.gn only once."""
+    builder = self.create_builder('is_asan = true', edit_mode=True)
+    builder.out_dir_name()
+    builder.get_gn_args()
+    self.mock.edit_if_needed.assert_called_once_with(
+        'is_asan = true\nuse_goma = false', prefix=mock.ANY, comment=mock.ANY,
+        should_edit=True)
+
+
+class LockSourceDirectoryTest(helpers.ExtendedTestCase):
+  """Tests lock_source_directory."""
+
+  def setUp(self):
+    self.locks_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.locks_dir)
+    helpers.patch(self, ['clusterfuzz.binary_providers.logger'])
+    patchers = [
+        mock.patch('clusterfuzz.binary_providers.SOURCE_LOCKS_DIR',
+                   os.path.join(self.locks_dir, 'locks')),
+        mock.patch.dict('clusterfuzz.binary_providers.source_locks', {},
+                        clear=True)]
+    for patcher in patchers:
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def test_lock_once(self):
+    """Test locking a source directory once per process."""
+    binary_providers.lock_source_directory('/src')
+    lock_file = binary_providers.source_locks['/src']
+    binary_providers.lock_source_directory('/src')
+    self.assertIs(lock_file, binary_providers.source_locks['/src'])
+    self.assertEqual(0, self.mock.logger.info.call_count)
+
+  def test_not_inherited(self):
+    """Test that the processes started afterwards don't inherit the lock."""
+    binary_providers.lock_source_directory('/src')
+    lock_file = binary_providers.source_locks['/src']
+    self.assertTrue(
+        fcntl.fcntl(lock_file, fcntl.F_GETFD) & fcntl.FD_CLOEXEC)
+
+    fd = lock_file.fileno()
+    returncode = subprocess.call(
+        ['sh', '-c', 'exec 3>&%d' % fd], stderr=open(os.devnull, 'w'))
+    self.assertNotEqual(0, returncode)
+
+  def test_wait(self):
+    """Test waiting until another process unlocks the source directory."""
+    binary_providers.lock_source_directory('/src')
+    other_lock_file = binary_providers.source_locks.pop('/src')
+
+    thread = threading.Thread(
+        target=binary_providers.lock_source_directory, args=('/src',))
+    thread.start()
+    thread.join(0.2)
+    self.assertTrue(thread.is_alive())
+    fcntl.flock(other_lock_file, fcntl.LOCK_UN)
+    thread.join(5)
+
+    self.assertFalse(thread.is_alive())
+    self.assertIn('/src', binary_providers.source_locks)
+    self.mock.logger.info.assert_called_once_with(mock.ANY, '/src')
+
+
+class OutDirsManifestTest(helpers.ExtendedTestCase):
+  """Tests load_out_dirs and record_out_dir."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, ['time.time'])
+    self.mock.time.return_value = 100
+    os.makedirs('/src/out/clusterfuzz_a')
+    os.makedirs('/src/out/clusterfuzz_b')
+
+  def test_record(self):
+    """Test updating the entry of a reused out dir."""
+    binary_providers.record_out_dir('/src/out/clusterfuzz_a', 'job1', 1)
+    binary_providers.record_out_dir('/src/out/clusterfuzz_b', 'job2', 2)
+    self.mock.time.return_value = 200
+    binary_providers.record_out_dir('/src/out/clusterfuzz_a', 'job1', 3)
+
+    self.assertEqual([
+        {'path': '/src/out/clusterfuzz_b', 'job_type': 'job2',
+         'testcase_id': '2', 'last_used': 100},
+        {'path': '/src/out/clusterfuzz_a', 'job_type': 'job1',
+         'testcase_id': '3', 'last_used': 200}],
+                     binary_providers.load_out_dirs())
+
+  def test_deleted(self):
+    """Test dropping the out dirs that were deleted."""
+    binary_providers.record_out_dir('/src/out/clusterfuzz_a', 'job1', 1)
+    binary_providers.record_out_dir('/src/out/clusterfuzz_b', 'job2', 2)
+    os.rmdir('/src/out/clusterfuzz_a')
+    self.assertEqual(['/src/out/clusterfuzz_b'],
+                     [d['path'] for d in binary_providers.load_out_dirs()])
+
+  def test_no_manifest(self):
+    """Test having no out dirs without a manifest."""
+    self.assertEqual([], binary_providers.load_out_dirs())
 
 
 class PdfiumSetupGnArgsTest(helpers.ExtendedTestCase):
@@ -554,6 +1001,7 @@ class PdfiumBuildTargetTest(helpers.ExtendedTestCase):
         'clusterfuzz.common.execute',
         'clusterfuzz.binary_providers.PdfiumBuilder.get_goma_cores',
         'clusterfuzz.binary_providers.PdfiumBuilder.get_goma_load',
+        'clusterfuzz.build_tuner.NinjaTuner.monitor',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.binary_providers.get_pdfium_sha'])
     self.mock.get_goma_cores.return_value = 120
@@ -594,11 +1042,14 @@ class ChromiumBuilderTest(helpers.ExtendedTestCase):
         'clusterfuzz.binary_providers.ChromiumBuilder.get_build_directory',
         'clusterfuzz.binary_providers.ChromiumBuilder.get_goma_cores',
         'clusterfuzz.binary_providers.ChromiumBuilder.get_goma_load',
+        'clusterfuzz.binary_providers.ChromiumBuilder.get_targets',
+        'clusterfuzz.build_tuner.NinjaTuner.monitor',
         'clusterfuzz.binary_providers.ChromiumBuilder.setup_gn_args',
         'clusterfuzz.binary_providers.sha_from_revision',
         'clusterfuzz.common.execute',
     ])
     self.mock.sha_from_revision.return_value = '1a2s3d4f5g'
+    self.mock.get_targets.return_value = ['binary', 'data.pak']
     self.mock.get_build_directory.return_value = '/chromium/build/dir'
     self.testcase = mock.Mock(id=12345, build_url='', revision=4567)
     self.mock_os_environment({'V8_SRC': '/chrome/src'})
@@ -612,12 +1063,8 @@ class ChromiumBuilderTest(helpers.ExtendedTestCase):
 
   def test_no_binary_name(self):
     """Test the functionality when no binary name is provided."""
-    stacktrace = [
-        {'content': 'not correct'}, {'content': '[Environment] A = b'},
-        {'content': ('Running command: path/to/binary --flag-1 --flag2 opt'
-                     ' /testcase/path')}]
-    testcase = mock.Mock(id=12345, build_url='', revision=4567,
-                         stacktrace_lines=stacktrace)
+    testcase = mock.Mock(id=12345, build_url='', revision=4567)
+    testcase.get_binary_name.return_value = 'binary'
     definition = mock.Mock(source_var='V8_SRC', binary_name=None)
     builder = binary_providers.ChromiumBuilder(
         testcase, definition, libs.make_options())
@@ -637,7 +1084,7 @@ class ChromiumBuilderTest(helpers.ExtendedTestCase):
         mock.call(
             'ninja',
             ("-w 'dupbuild=err' -C /chrome/src/out/clusterfuzz_builds "
-             '-j 120 -l 8 target'),
+             '-j 120 -l 8 binary data.pak'),
             '/chrome/src',
             capture_output=False,
             stdout_transformer=mock.ANY)
@@ -652,6 +1099,158 @@ class ChromiumBuilderTest(helpers.ExtendedTestCase):
     self.assertEqual(result, '/chromium/build/dir/binary')
 
 
+class ChromiumBuilderGetTargetsTest(helpers.ExtendedTestCase):
+  """Tests ChromiumBuilder.get_targets."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.count_ninja_steps',
+        'clusterfuzz.binary_providers.get_executable_label',
+        'clusterfuzz.binary_providers.get_ninja_outputs',
+        'clusterfuzz.binary_providers.get_runtime_deps',
+        'clusterfuzz.binary_providers.sha_from_revision',
+    ])
+    self.mock_os_environment({'V8_SRC': '/chrome/src'})
+    testcase = mock.Mock(id=12345, build_url='', revision=4567)
+    definition = mock.Mock(
+        source_var='V8_SRC', binary_name='d8', target='meta')
+    self.builder = binary_providers.ChromiumBuilder(
+        testcase, definition, libs.make_options())
+    self.builder.build_directory = '/chrome/src/out/dir'
+    self.mock.get_executable_label.return_value = '//v8:d8'
+    self.mock.get_runtime_deps.return_value = ['./d8', 'a.bin', '../../x.js']
+    self.mock.get_ninja_outputs.return_value = ['d8', 'a.bin', 'b.bin']
+    self.mock.count_ninja_steps.side_effect = [10]
+
+  def test_runtime_deps(self):
+    """Test building the binary and its runtime deps."""
+    self.assertEqual(['d8', 'a.bin'], self.builder.get_targets())
+    self.assert_exact_calls(self.mock.count_ninja_steps, [
+        mock.call('/chrome/src', '/chrome/src/out/dir', ['d8', 'a.bin'])
+    ])
+
+  def test_too_many_deps(self):
+    """Test falling back to the target when the targets don't fit in an
+      argument."""
+    deps = ['gen/file%d.bin' % i for i in xrange(10000)]
+    self.mock.get_runtime_deps.return_value = deps
+    self.mock.get_ninja_outputs.return_value = ['d8'] + deps
+    self.assertEqual(['meta'], self.builder.get_targets())
+    self.assert_n_calls(0, [self.mock.count_ninja_steps])
+
+  def test_target_is_binary(self):
+    """Test building the binary when it's the target."""
+    self.builder.target = 'd8'
+    self.assertEqual(['d8'], self.builder.get_targets())
+    self.assert_n_calls(0, [self.mock.get_executable_label])
+
+  def test_no_label(self):
+    """Test falling back to the target without a gn label."""
+    self.mock.get_executable_label.return_value = None
+    self.assertEqual(['meta'], self.builder.get_targets())
+    self.assert_n_calls(0, [self.mock.get_runtime_deps])
+
+  def test_incomplete_deps(self):
+    """Test falling back to the target when a dep can't be built."""
+    self.mock.get_runtime_deps.return_value = ['d8', 'missing']
+    self.assertEqual(['meta'], self.builder.get_targets())
+    self.assert_n_calls(0, [self.mock.count_ninja_steps])
+
+  def test_dry_run_fails(self):
+    """Test falling back to the target when the dry run fails."""
+    self.mock.count_ninja_steps.side_effect = [None]
+    self.assertEqual(['meta'], self.builder.get_targets())
+
+
+class GetExecutableLabelTest(helpers.ExtendedTestCase):
+  """Tests get_executable_label."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+
+  def test_found(self):
+    """Test finding the label by the executable name."""
+    self.mock.execute.return_value = (0, '//v8:d8\n//chrome\n//a:b\n')
+    self.assertEqual('//v8:d8', binary_providers.get_executable_label(
+        '/src', 'out/dir', 'd8'))
+    self.assertEqual('//chrome', binary_providers.get_executable_label(
+        '/src', 'out/dir', 'chrome'))
+    self.mock.execute.assert_called_with(
+        'gn', 'ls out/dir --type=executable', '/src', print_command=False,
+        print_output=False, exit_on_error=False,
+        read_buffer_length=binary_providers.QUERY_READ_BUFFER_LENGTH)
+
+  def test_ambiguous(self):
+    """Test returning None when several executables match."""
+    self.mock.execute.return_value = (0, '//v8:d8\n//other:d8\n')
+    self.assertIsNone(
+        binary_providers.get_executable_label('/src', 'out/dir', 'd8'))
+
+  def test_error(self):
+    """Test returning None when gn fails."""
+    self.mock.execute.return_value = (1, '//v8:d8')
+    self.assertIsNone(
+        binary_providers.get_executable_label('/src', 'out/dir', 'd8'))
+
+
+class GetNinjaOutputsTest(helpers.ExtendedTestCase):
+  """Tests get_ninja_outputs."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+
+  def test_parse(self):
+    """Test parsing the outputs of `ninja -t targets all`."""
+    self.mock.execute.return_value = (
+        0, 'obj/a.o: cxx\nd8: link\nweird: name: phony\n')
+    self.assertEqual(['obj/a.o', 'd8', 'weird: name'],
+                     binary_providers.get_ninja_outputs('/src', 'out'))
+
+
+class GetMinimalTargetsTest(helpers.ExtendedTestCase):
+  """Tests get_minimal_targets."""
+
+  def test_targets(self):
+    """Test mapping files and directories to ninja outputs."""
+    outputs = ['d8', 'a.bin', 'res/x.pak', 'res/y.pak', 'resources.pak']
+    self.assertEqual(
+        ['d8', 'a.bin', 'res/x.pak', 'res/y.pak'],
+        binary_providers.get_minimal_targets(
+            'd8', ['./d8', './a.bin', 'res/', '../../src.js', 'a.bin'],
+            outputs))
+
+  def test_missing(self):
+    """Test returning None when a dep isn't a ninja output."""
+    self.assertIsNone(
+        binary_providers.get_minimal_targets('d8', ['gen.txt'], ['d8']))
+
+
+class CountNinjaStepsTest(helpers.ExtendedTestCase):
+  """Tests count_ninja_steps."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+
+  def test_steps(self):
+    """Test reading the total from the last progress line."""
+    self.mock.execute.return_value = (0, '[1/2] CXX a.o\n[2/3] LINK d8\n')
+    self.assertEqual(3, binary_providers.count_ninja_steps(
+        '/src', 'out', ['d8', 'a.bin']))
+    self.mock.execute.assert_called_with(
+        'ninja', '-C out -n d8 a.bin', '/src', print_command=False,
+        print_output=False, exit_on_error=False,
+        read_buffer_length=binary_providers.QUERY_READ_BUFFER_LENGTH)
+
+  def test_no_work(self):
+    """Test counting no steps when everything is up to date."""
+    self.mock.execute.return_value = (0, 'ninja: no work to do.')
+    self.assertEqual(0, binary_providers.count_ninja_steps('/src', 'out', []))
+
+  def test_error(self):
+    """Test returning None when ninja fails."""
+    self.mock.execute.return_value = (1, 'unknown target')
+    self.assertIsNone(binary_providers.count_ninja_steps('/src', 'out', []))
+
 class CfiChromiumBuilderTest(helpers.ExtendedTestCase):
   """Tests the pre-build step of CfiChromiumBuilder."""
 
@@ -796,7 +1395,10 @@ class GetGomaCoresTest(helpers.ExtendedTestCase):
 
   def setUp(self):
     helpers.patch(self, ['multiprocessing.cpu_count',
+                         'clusterfuzz.build_tuner.get_available_memory',
                          'clusterfuzz.binary_providers.sha_from_revision'])
+    self.setup_fake_filesystem()
+    self.mock.get_available_memory.return_value = 256 * build_tuner.GIB
 
     self.testcase = mock.Mock(id=12345, build_url='', revision=4567)
     self.definition = mock.Mock(
@@ -825,51 +1427,123 @@ class GetGomaCoresTest(helpers.ExtendedTestCase):
     self.assertEqual(self.builder.get_goma_cores(), 3200)
     self.assertEqual(self.builder.get_goma_load(), 128)
 
+  def test_not_specifying_without_goma(self):
+    """Test not specifying threads without goma."""
+    self.builder = binary_providers.ChromiumBuilder(
+        self.testcase, self.definition,
+        libs.make_options(goma_threads=None, goma_load=None, goma_dir=None))
+    self.assertEqual(self.builder.get_goma_cores(), 48)
+    self.assertEqual(self.builder.get_goma_load(), 128)
+
 
-class ShaExistsTest(helpers.ExtendedTestCase):
-  """Tests for sha_exists."""
+class GitStatusTest(helpers.ExtendedTestCase):
+  """Tests GitStatus."""
 
   def setUp(self):
-    helpers.patch(self, ['clusterfuzz.common.execute'])
+    helpers.patch(self, [
+        'clusterfuzz.common.execute',
+        'clusterfuzz.common.start_execute',
+    ])
+    self.proc = mock.Mock()
+    self.proc.poll.return_value = None
+    self.mock.start_execute.return_value = self.proc
+    self.status = binary_providers.GitStatus('/dir')
+
+  def test_sha_exists(self):
+    """Test looking up shas through a single cat-file process."""
+    self.proc.stdout.readline.side_effect = [
+        'aaa commit 250\n', 'bbb missing\n', 'ccc ambiguous\n']
+
+    self.assertTrue(self.status.sha_exists('aaa'))
+    self.assertFalse(self.status.sha_exists('bbb'))
+    self.assertFalse(self.status.sha_exists('ccc'))
+
+    self.mock.start_execute.assert_called_once_with(
+        'git', 'cat-file --batch-check', '/dir', print_command=False,
+        stdin=mock.ANY)
+    self.assert_exact_calls(self.proc.stdin.write, [
+        mock.call('aaa\n'), mock.call('bbb\n'), mock.call('ccc\n')])
+
+  def test_restart(self):
+    """Test restarting the cat-file process when it has exited."""
+    self.proc.stdout.readline.return_value = 'aaa commit 250\n'
+    self.status.sha_exists('aaa')
+    self.proc.poll.return_value = 1
+    self.status.sha_exists('aaa')
+
+    self.assertEqual(2, self.mock.start_execute.call_count)
+
+  def test_close(self):
+    """Test closing the cat-file process."""
+    self.status.close()
+    self.proc.stdout.readline.return_value = 'aaa commit 250\n'
+    self.status.sha_exists('aaa')
+    self.status.close()
+
+    self.proc.stdin.close.assert_called_once_with()
+    self.proc.wait.assert_called_once_with()
+    self.assertIsNone(self.status.cat_file)
 
-  def test_exist(self):
-    """Test exists."""
+  def test_clean(self):
+    """Test a clean tree."""
     self.mock.execute.return_value = (0, '')
-    self.assertTrue(binary_providers.sha_exists('SHA', '/dir'))
+    self.assertFalse(self.status.is_dirty())
 
     self.mock.execute.assert_called_once_with(
-        'git', 'cat-file -e SHA', cwd='/dir', exit_on_error=False)
+        'git', 'diff --quiet HEAD --', '/dir', print_command=False,
+        print_output=False, capture_output=False, exit_on_error=False)
 
-  def test_not_exist(self):
-    """Test not exists."""
+  def test_dirty(self):
+    """Test a dirty tree."""
     self.mock.execute.return_value = (1, '')
-    self.assertFalse(binary_providers.sha_exists('SHA', '/dir'))
+    self.assertTrue(self.status.is_dirty())
 
-    self.mock.execute.assert_called_once_with(
-        'git', 'cat-file -e SHA', cwd='/dir', exit_on_error=False)
+  def test_dirty_error(self):
+    """Test raising the error of git instead of calling the tree dirty."""
+    self.mock.execute.return_value = (128, '')
+    with self.assertRaises(error.CommandFailedError):
+      self.status.is_dirty()
 
 
-class IsRepoDirtyTest(helpers.ExtendedTestCase):
-  """Tests for is_repo_dirty."""
+class GitStatusHelperTest(helpers.ExtendedTestCase):
+  """Tests git_status, sha_exists, and is_repo_dirty."""
 
   def setUp(self):
-    helpers.patch(self, ['clusterfuzz.common.execute'])
+    patcher = mock.patch.dict(binary_providers.git_statuses, clear=True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.GitStatus.sha_exists',
+        'clusterfuzz.binary_providers.GitStatus.is_dirty',
+    ])
 
-  def test_clean(self):
-    """Test exists."""
-    self.mock.execute.return_value = (0, '')
-    self.assertFalse(binary_providers.is_repo_dirty('/dir'))
+  def test_shared(self):
+    """Test sharing a GitStatus per directory."""
+    status = binary_providers.git_status('/dir')
+    self.assertIs(status, binary_providers.git_status('/dir/'))
+    self.assertIsNot(status, binary_providers.git_status('/dir2'))
 
-    self.mock.execute.assert_called_once_with(
-        'git', 'diff', '/dir', print_command=False, print_output=False)
+  def test_sha_exists(self):
+    """Test sha_exists."""
+    self.mock.sha_exists.return_value = True
+    self.assertTrue(binary_providers.sha_exists('SHA', '/dir'))
+    self.mock.sha_exists.assert_called_once_with(
+        binary_providers.git_status('/dir'), 'SHA')
 
-  def test_dirty(self):
-    """Test not exists."""
-    self.mock.execute.return_value = (0, 'some change')
+  def test_is_repo_dirty(self):
+    """Test is_repo_dirty."""
+    self.mock.is_dirty.return_value = True
     self.assertTrue(binary_providers.is_repo_dirty('/dir'))
-
-    self.mock.execute.assert_called_once_with(
-        'git', 'diff', '/dir', print_command=False, print_output=False)
+    self.mock.is_dirty.assert_called_once_with(
+        binary_providers.git_status('/dir'))
+
+  def test_close_git_statuses(self):
+    """Test closing the cat-file processes, which runs at exit."""
+    with mock.patch.object(binary_providers.GitStatus, 'close') as close:
+      binary_providers.git_status('/dir')
+      binary_providers.git_status('/dir2')
+      binary_providers.close_git_statuses()
+    self.assertEqual(2, close.call_count)
 
 
 class SetupDebugSymbolIfNeededTest(helpers.ExtendedTestCase):
@@ -0,0 +1,207 @@
+"""Test the build_tuner module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+
+from clusterfuzz import build_tuner
+from test_libs import helpers
+
+
+GIB = build_tuner.GIB
+MIB = build_tuner.MIB
+
+
+class ReadNinjaLogTest(helpers.ExtendedTestCase):
+  """Tests read_ninja_log."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.path = '/build/.ninja_log'
+    os.makedirs('/build')
+    with open(self.path, 'w') as f:
+      f.write('# ninja log v5\n')
+      f.write('0\t100\t0\ta.o\thash\n')
+      f.write('100\t300\t0\tb.o\thash\n')
+
+  def test_read_all(self):
+    """Test reading all edges."""
+    self.assertEqual(
+        [(0, 100, 'a.o'), (100, 300, 'b.o')],
+        build_tuner.read_ninja_log(self.path))
+
+  def test_read_from_offset(self):
+    """Test reading the edges appended after the offset."""
+    offset = os.path.getsize(self.path)
+    with open(self.path, 'a') as f:
+      f.write('0\t50\t0\tchrome\thash\n')
+
+    self.assertEqual(
+        [(0, 50, 'chrome')], build_tuner.read_ninja_log(self.path, offset))
+
+  def test_recompacted(self):
+    """Test reading from the beginning when the log was recompacted."""
+    self.assertEqual(2, len(build_tuner.read_ninja_log(self.path, 100000)))
+
+  def test_missing(self):
+    """Test a missing log."""
+    self.assertEqual([], build_tuner.read_ninja_log('/missing'))
+
+
+class SummarizeEdgesTest(helpers.ExtendedTestCase):
+  """Tests summarize_edges."""
+
+  def test_summary(self):
+    """Test listing the rate and the slowest steps."""
+    edges = [
+        (0, 1000, 'obj/a.o'), (0, 3000, 'obj/b.o'), (1000, 1500, 'obj/c.o'),
+        (3000, 9000, 'chrome'), (3000, 3100, 'gen/x.stamp')]
+    self.assertEqual(
+        'Built 5 steps in 9.0s (0.6 steps/s).\n'
+        'Slowest compile steps:\n'
+        '      3.0s obj/b.o\n'
+        '      1.0s obj/a.o\n'
+        '      0.5s obj/c.o\n'
+        'Slowest link steps:\n'
+        '      6.0s chrome',
+        build_tuner.summarize_edges(edges))
+
+  def test_empty(self):
+    """Test no summary without edges."""
+    self.assertIsNone(build_tuner.summarize_edges([]))
+
+
+class MemoryMonitorTest(helpers.ExtendedTestCase):
+  """Tests MemoryMonitor."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.build_tuner.get_available_memory'])
+    self.mock.get_available_memory.side_effect = [5, 3, 4] + [6] * 1000
+
+  def test_min(self):
+    """Test keeping the minimum available memory."""
+    with build_tuner.MemoryMonitor(interval=0.001) as monitor:
+      while self.mock.get_available_memory.call_count < 4:
+        pass
+    self.assertEqual(3, monitor.min_available)
+    self.assertFalse(monitor.thread.is_alive())
+
+
+class NinjaTunerTest(helpers.ExtendedTestCase):
+  """Tests NinjaTuner."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.build_tuner.get_available_memory',
+        'multiprocessing.cpu_count',
+    ])
+    self.mock.get_available_memory.return_value = 256 * GIB
+    self.mock.cpu_count.return_value = 8
+    self.path = '/stats/ninja_stats.json'
+
+  def write_stats(self, stats):
+    """Write stats to the stats file."""
+    os.makedirs('/stats')
+    with open(self.path, 'w') as f:
+      json.dump(stats, f)
+
+  def test_default_goma(self):
+    """Test the defaults with goma."""
+    tuner = build_tuner.NinjaTuner(True, self.path)
+    self.assertEqual(400, tuner.get_jobs())
+    self.assertEqual(16, tuner.get_load())
+
+  def test_default_local(self):
+    """Test the defaults without goma."""
+    tuner = build_tuner.NinjaTuner(False, self.path)
+    self.assertEqual(6, tuner.get_jobs())
+    self.assertEqual(16, tuner.get_load())
+
+  def test_low_memory(self):
+    """Test limiting the goma jobs by the available memory."""
+    self.mock.get_available_memory.return_value = 11 * GIB
+    self.assertEqual(61, build_tuner.NinjaTuner(True, self.path).get_jobs())
+
+  def test_less_memory_than_a_link(self):
+    """Test not reserving the memory of a link job that doesn't fit."""
+    self.mock.get_available_memory.return_value = 2 * GIB
+    self.assertEqual(40, build_tuner.NinjaTuner(True, self.path).get_jobs())
+
+  def test_min_jobs(self):
+    """Test not going below one goma job per cpu, or below the usual local
+      parallelism, however little memory is available."""
+    self.mock.get_available_memory.return_value = 100 * MIB
+    self.assertEqual(8, build_tuner.NinjaTuner(True, self.path).get_jobs())
+    self.assertEqual(6, build_tuner.NinjaTuner(False, self.path).get_jobs())
+
+  def test_previous_stats(self):
+    """Test using the stats of the previous build."""
+    self.write_stats({
+        'goma': {'scale': 0.5, 'compile_latency': 2},
+        'local': {'scale': 1.0}})
+    tuner = build_tuner.NinjaTuner(True, self.path)
+    self.assertEqual(80, tuner.get_jobs())
+    self.assertEqual(8, tuner.get_load())
+
+  def test_record_memory_pressure(self):
+    """Test halving the parallelism after running low on memory."""
+    self.write_stats({'local': {'scale': 1.0}})
+    tuner = build_tuner.NinjaTuner(True, self.path)
+    tuner.record([(0, 1000, 'a.o'), (0, 3000, 'b.obj'), (0, 9000, 'chrome')],
+                 GIB / 2)
+
+    with open(self.path, 'r') as f:
+      self.assertEqual({
+          'goma': {'scale': 0.5, 'compile_latency': 2.0,
+                   'min_available_memory': GIB / 2},
+          'local': {'scale': 1.0}}, json.load(f))
+
+  def test_record_recovery(self):
+    """Test growing the parallelism back after a build without pressure."""
+    self.write_stats({'local': {'scale': 0.5, 'compile_latency': 3.0}})
+    tuner = build_tuner.NinjaTuner(False, self.path)
+    tuner.record([], 10 * GIB)
+    self.assertEqual(
+        {'scale': 0.625, 'compile_latency': 3.0,
+         'min_available_memory': 10 * GIB},
+        build_tuner.NinjaTuner(False, self.path).stats)
+
+    for _ in range(5):
+      tuner.record([], 10 * GIB)
+    self.assertEqual(1.0, tuner.get_scale())
+
+  def test_monitor(self):
+    """Test recording the edges built inside the context."""
+    os.makedirs('/build')
+    with open('/build/.ninja_log', 'w') as f:
+      f.write('# ninja log v5\n0\t100\t0\told.o\thash\n')
+
+    tuner = build_tuner.NinjaTuner(True, self.path)
+    with tuner.monitor('/build'):
+      with open('/build/.ninja_log', 'a') as f:
+        f.write('0\t4000\t0\tnew.o\thash\n')
+
+    self.assertEqual(4.0, tuner.stats['compile_latency'])
+    self.assertEqual(256 * GIB, tuner.stats['min_available_memory'])
+
+  def test_monitor_failure(self):
+    """Test recording the stats when the build fails."""
+    tuner = build_tuner.NinjaTuner(True, self.path)
+    with self.assertRaises(RuntimeError):
+      with tuner.monitor('/build'):
+        raise RuntimeError()
+
+    self.assertTrue(os.path.isfile(self.path))
@@ -0,0 +1,137 @@
+"""Tests the bundle module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+from clusterfuzz import bundle
+from clusterfuzz import common
+from error import error
+from test_libs import helpers
+
+
+class BundleTest(helpers.ExtendedTestCase):
+  """Tests writing and reading bundles."""
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp_dir)
+    self.path = os.path.join(self.tmp_dir, 'bundle.zip')
+
+  def write_bundle(self, gn_args='is_asan = true'):
+    """Write a bundle with a testcase file."""
+    testcase_file = os.path.join(self.tmp_dir, 'fuzz-1.js')
+    with open(testcase_file, 'w') as f:
+      f.write('crash();')
+    bundle.write(
+        self.path, {'id': 1234}, [testcase_file],
+        {'v8/v8@5678': 'sha'}, gn_args,
+        common.CrashSignature('Heap-overflow', ['a', 'b']))
+
+  def test_round_trip(self):
+    """Test reading back what's written."""
+    self.write_bundle()
+
+    testcase_bundle = bundle.Bundle(self.path)
+    self.assertEqual({'id': 1234}, testcase_bundle.testcase_json)
+    self.assertEqual({'v8/v8@5678': 'sha'}, testcase_bundle.shas)
+    self.assertEqual('is_asan = true', testcase_bundle.gn_args)
+    self.assertEqual(
+        common.CrashSignature('Heap-overflow', ['a', 'b']),
+        testcase_bundle.crash_signature)
+
+    dest_dir = os.path.join(self.tmp_dir, 'dest')
+    os.makedirs(dest_dir)
+    self.assertEqual(
+        ['fuzz-1.js'], testcase_bundle.extract_testcase_files(dest_dir))
+    with open(os.path.join(dest_dir, 'fuzz-1.js')) as f:
+      self.assertEqual('crash();', f.read())
+
+  def test_without_gn_args(self):
+    """Test leaving args.gn out when the testcase has none."""
+    self.write_bundle(gn_args=None)
+    with zipfile.ZipFile(self.path, 'r') as bundle_zip:
+      manifest = json.loads(bundle_zip.read(bundle.MANIFEST_NAME))
+    self.assertNotIn('gn_args', manifest)
+    self.assertIsNone(bundle.Bundle(self.path).gn_args)
+
+  def test_not_a_zip(self):
+    """Test raising when the file is not a bundle."""
+    with open(self.path, 'w') as f:
+      f.write('not a zip')
+    with self.assertRaises(error.BadBundleError):
+      bundle.Bundle(self.path)
+
+  def test_missing(self):
+    """Test raising when the file doesn't exist."""
+    with self.assertRaises(error.BadBundleError):
+      bundle.Bundle(self.path)
+
+  def test_version(self):
+    """Test raising on a bundle from another version."""
+    with zipfile.ZipFile(self.path, 'w') as bundle_zip:
+      bundle_zip.writestr(bundle.MANIFEST_NAME, json.dumps({'version': 0}))
+    with self.assertRaises(error.BadBundleError):
+      bundle.Bundle(self.path)
+
+  def write_manifest(self, **fields):
+    """Write a bundle with a manifest that has fields instead of the valid
+      ones."""
+    manifest = {
+        'version': bundle.BUNDLE_VERSION,
+        'testcase': {'id': 1234},
+        'testcase_files': ['fuzz-1.js'],
+        'shas': {},
+        'gn_args': '',
+        'crash_signature': {'crash_type': 'type', 'crash_state_lines': []}}
+    manifest.update(fields)
+    manifest = dict((k, v) for k, v in manifest.iteritems() if v is not None)
+    with zipfile.ZipFile(self.path, 'w') as bundle_zip:
+      bundle_zip.writestr(bundle.MANIFEST_NAME, json.dumps(manifest))
+
+  def test_missing_field(self):
+    """Test raising when the manifest misses a field."""
+    self.write_manifest(shas=None)
+    with self.assertRaises(error.BadBundleError) as cm:
+      bundle.Bundle(self.path)
+    self.assertIn("has no 'shas'", cm.exception.message)
+
+    self.write_manifest(testcase={})
+    with self.assertRaises(error.BadBundleError) as cm:
+      bundle.Bundle(self.path)
+    self.assertIn("has no 'id'", cm.exception.message)
+
+  def test_malformed_field(self):
+    """Test raising when a field of the manifest has the wrong type."""
+    self.write_manifest(crash_signature=[])
+    with self.assertRaises(error.BadBundleError):
+      bundle.Bundle(self.path)
+
+  def test_path_traversal(self):
+    """Test raising on a testcase file outside the testcase directory."""
+    for name in ['../../.bashrc', '/etc/passwd', 'dir/file', '..', '']:
+      self.write_manifest(testcase_files=[name])
+      with self.assertRaises(error.BadBundleError):
+        bundle.Bundle(self.path)
+
+  def test_missing_testcase_file(self):
+    """Test raising when a testcase file isn't in the bundle."""
+    self.write_manifest()
+    testcase_bundle = bundle.Bundle(self.path)
+    with self.assertRaises(error.BadBundleError):
+      testcase_bundle.extract_testcase_files(self.tmp_dir)
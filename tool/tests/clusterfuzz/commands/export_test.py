@@ -0,0 +1,78 @@
+"""Tests the export command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import mock
+
+from clusterfuzz.commands import export
+from test_libs import helpers
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests execute."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.bundle.write',
+        'clusterfuzz.commands.export.logger',
+        'clusterfuzz.commands.reproduce.get_definition',
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.reproducers.get_original_crash_signature',
+        'clusterfuzz.testcase.Testcase',
+        'tempfile.mkdtemp',
+        'shutil.rmtree',
+    ])
+    patcher = mock.patch.dict(
+        'clusterfuzz.binary_providers.resolved_shas', {'v8/v8@1': 'sha'},
+        clear=True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.testcase = mock.Mock(job_type='job', gn_args='args')
+    self.mock.Testcase.return_value = self.testcase
+    self.testcase.download_testcase.return_value = 'fuzz.js'
+    self.mock.mkdtemp.return_value = '/tmp/export'
+    self.definition = self.mock.get_definition.return_value
+
+  def test_export(self):
+    """Test writing the bundle."""
+    export.execute('1234', None)
+
+    self.mock.get_testcase_info.assert_called_once_with('1234')
+    self.mock.get_definition.assert_called_once_with('job', 'chromium')
+    self.definition.builder.assert_called_once_with(
+        testcase=self.testcase, definition=self.definition, options=mock.ANY)
+    self.testcase.download_testcase.assert_called_once_with('/tmp/export')
+    self.mock.write.assert_called_once_with(
+        'clusterfuzz_testcase_1234.zip',
+        self.mock.get_testcase_info.return_value,
+        [os.path.join('/tmp/export', 'fuzz.js')], {'v8/v8@1': 'sha'}, 'args',
+        self.mock.get_original_crash_signature.return_value)
+    self.mock.rmtree.assert_called_once_with('/tmp/export')
+
+  def test_without_gn_args(self):
+    """Test exporting a testcase without args.gn."""
+    self.testcase.gn_args = None
+    export.execute('1234', 'out.zip')
+    self.assertIsNone(self.mock.write.call_args[0][4])
+    self.assertIn(
+        'has no args.gn', self.mock.logger.info.call_args_list[0][0][0])
+
+  def test_cleanup_on_error(self):
+    """Test removing the temporary directory when the download fails."""
+    self.testcase.download_testcase.side_effect = RuntimeError()
+    with self.assertRaises(RuntimeError):
+      export.execute('1234', 'out.zip')
+    self.mock.rmtree.assert_called_once_with('/tmp/export')
@@ -0,0 +1,189 @@
+"""Tests the job-server command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import collections
+import json
+import multiprocessing
+import StringIO
+
+import mock
+
+from clusterfuzz.commands import job_server
+from clusterfuzz.commands import reproduce_batch
+from clusterfuzz.commands import worker
+from test_libs import helpers
+
+
+def make_jobs(*keys):
+  return [job_server.Job(i, str(i), key, 0) for i, key in enumerate(keys)]
+
+
+class JobQueueTest(helpers.ExtendedTestCase):
+  """Tests the cache-affine scheduling of JobQueue."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.commands.job_server.logger',
+                         'time.time'])
+    self.mock.time.return_value = 100
+
+  def test_affinity(self):
+    """Test handing a worker the jobs of the build it has first."""
+    queue = job_server.JobQueue(make_jobs('a', 'b', 'b'))
+    self.assertEqual(1, queue.get('w1', ['b']).id)
+    self.assertEqual(2, queue.get('w1', ['b']).id)
+    self.assertEqual(0, queue.get('w1', ['b']).id)
+    self.assertIsNone(queue.get('w1', ['a', 'b']))
+
+  def test_unclaimed(self):
+    """Test handing a new worker a build that no other worker is getting."""
+    queue = job_server.JobQueue(make_jobs('a', 'a', 'b'))
+    self.assertEqual(0, queue.get('w1', []).id)
+    self.assertEqual(2, queue.get('w2', []).id)
+    # Only builds that w1 is getting are left.
+    self.assertEqual(1, queue.get('w2', ['b']).id)
+
+  def test_claimed_by_other_worker(self):
+    """Test skipping the builds that other workers have."""
+    queue = job_server.JobQueue(make_jobs('a', 'b', 'c'))
+    self.assertEqual(0, queue.get('w1', ['a', 'b']).id)
+    self.assertEqual(2, queue.get('w2', []).id)
+
+  def test_expired(self):
+    """Test handing a job out again when its lease expires, and ignoring the
+      result that comes too late."""
+    queue = job_server.JobQueue(make_jobs('a'), lease_seconds=10)
+    self.assertEqual(0, queue.get('w1', []).id)
+    self.assertIsNone(queue.get('w2', []))
+    self.assertFalse(queue.is_done())
+
+    self.mock.time.return_value = 111
+    self.assertEqual(0, queue.get('w2', []).id)
+    self.assertTrue(queue.finish(0))
+    self.assertFalse(queue.finish(0))
+    self.assertTrue(queue.is_done())
+
+
+class JobServerTest(helpers.ExtendedTestCase):
+  """Tests JobServer."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.commands.job_server.logger'])
+    self.output = StringIO.StringIO()
+    self.server = job_server.JobServer(
+        job_server.JobQueue(make_jobs('a', 'a')),
+        reproduce_batch.ResultWriter(self.output), {'build': 'download'})
+
+  def test_get_job(self):
+    """Test returning the job with the options, then waiting, then being
+      done."""
+    self.assertEqual(
+        {'status': 'job', 'options': {'build': 'download'},
+         'job': {'id': 0, 'testcase_id': '0', 'key': 'a', 'group': 0}},
+        self.server.get_job('w1', []))
+    self.server.get_job('w1', ['a'])
+    self.assertEqual({'status': 'wait'}, self.server.get_job('w1', ['a']))
+
+    self.server.put_result('w1', 0, {'testcase_id': '0', 'status': 'error'})
+    self.server.put_result('w1', 1, {'testcase_id': '1', 'status': 'error'})
+    self.assertEqual({'status': 'done'}, self.server.get_job('w1', ['a']))
+
+  def test_put_result(self):
+    """Test writing a result with the worker, once."""
+    self.server.get_job('w1', [])
+    result = {'testcase_id': '0', 'status': 'reproduced', 'group': 0}
+    self.assertTrue(self.server.put_result('w1', 0, result))
+    self.assertFalse(self.server.put_result('w2', 0, result))
+    self.assertEqual(
+        [{'testcase_id': '0', 'status': 'reproduced', 'group': 0,
+          'worker': 'w1'}],
+        [json.loads(line) for line in self.output.getvalue().splitlines()])
+
+
+class GetJobsTest(helpers.ExtendedTestCase):
+  """Tests get_jobs."""
+
+  def test_get_jobs(self):
+    """Test a job per testcase, keyed by its group."""
+    groups = collections.OrderedDict([
+        (('job', 1, 'url'),
+         [(mock.Mock(id=10), 'd'), (mock.Mock(id=11), 'd')]),
+        (('job', 2, 'url'), [(mock.Mock(id=12), 'd')])])
+    jobs = job_server.get_jobs(groups)
+    self.assertEqual(
+        [(0, '10', '["job", 1, "url"]', 0), (1, '11', '["job", 1, "url"]', 0),
+         (2, '12', '["job", 2, "url"]', 1)],
+        [(job.id, job.testcase_id, job.key, job.group) for job in jobs])
+
+
+def run_worker(server, worker_id):
+  """Run a worker in a child process. The copy of the listening socket is
+    closed; otherwise, the worker would connect to it after the server is
+    gone, and wait for a response forever."""
+  server.server_close()
+  worker.execute('http://localhost:%d' % server.server_address[1], worker_id)
+
+
+class ServeTest(helpers.ExtendedTestCase):
+  """Tests serving jobs to two worker processes over XML-RPC."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.job_server.logger',
+        'clusterfuzz.commands.worker.logger',
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.commands.reproduce.get_definition',
+        'clusterfuzz.commands.reproduce.get_binary_provider',
+        'clusterfuzz.commands.reproduce_batch.logger',
+        'clusterfuzz.testcase.Testcase',
+    ])
+    self.mock.Testcase.side_effect = lambda info: mock.Mock(
+        id=int(info), job_type='job', revision=int(info) % 2)
+    self.mock.get_testcase_info.side_effect = lambda testcase_id: testcase_id
+    patcher = mock.patch.object(worker, 'WAIT_INTERVAL', 0.01)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_serve(self):
+    """Test that every testcase gets a result from one of the workers."""
+    jobs = make_jobs('a', 'b', 'a', 'b', 'a')
+    output = StringIO.StringIO()
+    options = {
+        'current': False, 'build': 'download', 'disable_goma': False,
+        'goma_threads': None, 'goma_load': None, 'iterations': 1,
+        'disable_xvfb': False, 'target_args': '', 'edit_mode': False,
+        'disable_gclient': False, 'enable_debug': False, 'gn_check': False,
+        'worktree': False}
+    queue = job_server.JobQueue(jobs)
+    server = job_server.create_server(
+        'localhost', 0, job_server.JobServer(
+            queue, reproduce_batch.ResultWriter(output), options))
+
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(server, 'w%d' % i))
+        for i in range(2)]
+    for process in workers:
+      process.start()
+    job_server.serve(server, queue)
+    for process in workers:
+      process.join(10)
+      self.assertEqual(0, process.exitcode)
+
+    results = [json.loads(line) for line in output.getvalue().splitlines()]
+    self.assertEqual(
+        ['0', '1', '2', '3', '4'],
+        sorted(result['testcase_id'] for result in results))
+    for result in results:
+      self.assertEqual('reproduced', result['status'])
+      self.assertIn(result['worker'], ['w0', 'w1'])
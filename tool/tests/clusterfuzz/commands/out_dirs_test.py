@@ -0,0 +1,68 @@
+"""Test the 'out_dirs' command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz.commands import out_dirs
+from test_libs import helpers
+
+
+DAY = out_dirs.SECONDS_PER_DAY
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests execute."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.load_out_dirs',
+        'clusterfuzz.binary_providers.save_out_dirs',
+        'clusterfuzz.commands.out_dirs.logger',
+        'clusterfuzz.common.check_confirm',
+        'clusterfuzz.common.delete_if_exists',
+        'time.time',
+    ])
+    self.mock.time.return_value = 100 * DAY
+    self.old = {'path': '/src/out/clusterfuzz_old', 'job_type': 'job',
+                'testcase_id': '1', 'last_used': 50 * DAY}
+    self.new = {'path': '/src/out/clusterfuzz_new', 'job_type': 'job',
+                'testcase_id': '2', 'last_used': 99 * DAY}
+    self.mock.load_out_dirs.return_value = [self.old, self.new]
+
+  def test_list(self):
+    """Test listing the most recently used out directory first."""
+    out_dirs.execute(prune=None)
+    self.assert_exact_calls(self.mock.logger.info, [
+        mock.call('/src/out/clusterfuzz_new (job, last used 1.0 days ago by '
+                  'testcase 2)'),
+        mock.call('/src/out/clusterfuzz_old (job, last used 50.0 days ago by '
+                  'testcase 1)')])
+    self.assert_n_calls(
+        0, [self.mock.delete_if_exists, self.mock.save_out_dirs])
+
+  def test_prune(self):
+    """Test deleting the out directories unused for the given days."""
+    out_dirs.execute(prune=30)
+    self.mock.check_confirm.assert_called_once_with(mock.ANY)
+    self.mock.delete_if_exists.assert_called_once_with(
+        '/src/out/clusterfuzz_old')
+    self.mock.save_out_dirs.assert_called_once_with([self.new])
+
+  def test_prune_nothing(self):
+    """Test not asking when no out directory is old enough."""
+    out_dirs.execute(prune=60)
+    self.assert_n_calls(
+        0, [self.mock.check_confirm, self.mock.delete_if_exists,
+            self.mock.save_out_dirs])
@@ -0,0 +1,79 @@
+"""Test the 'prefetch' command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import mock
+
+from clusterfuzz.commands import prefetch
+from error import error
+from test_libs import helpers
+
+
+class GetSourceAndShaTest(helpers.ExtendedTestCase):
+  """Tests get_source_and_sha."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.get_definition',
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.testcase.Testcase',
+    ])
+    self.definition = mock.Mock()
+    self.mock.get_definition.return_value = self.definition
+    self.definition.builder.return_value = mock.Mock(
+        source_directory='/chrome/src', git_sha='sha')
+    self.mock.Testcase.return_value = mock.Mock(job_type='job')
+
+  def test_get(self):
+    """Test getting the source directory and sha from the builder."""
+    self.assertEqual(('/chrome/src', 'sha'), prefetch.get_source_and_sha(12))
+
+    self.mock.get_testcase_info.assert_called_once_with(12)
+    self.mock.Testcase.assert_called_once_with(
+        self.mock.get_testcase_info.return_value)
+    self.mock.get_definition.assert_called_once_with('job', 'chromium')
+    self.definition.builder.assert_called_once_with(
+        testcase=self.mock.Testcase.return_value, definition=self.definition,
+        options=mock.ANY)
+    options = self.definition.builder.call_args[1]['options']
+    self.assertEqual(12, options.testcase_id)
+    self.assertTrue(options.disable_goma)
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests execute."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.binary_providers.ensure_shas',
+        'clusterfuzz.commands.prefetch.get_source_and_sha',
+    ])
+
+  def test_execute(self):
+    """Test grouping shas by source directory and skipping failures."""
+    self.mock.get_source_and_sha.side_effect = [
+        ('/chrome/src', 'sha1'),
+        error.JobTypeNotSupportedError('job'),
+        ('/chrome/src', 'sha2'),
+        (None, 'sha3'),
+        ('/v8', 'sha4'),
+        ('/chrome/src', 'sha1'),
+    ]
+    prefetch.execute(testcase_ids=['1', '2', '3', '4', '5', '6'])
+
+    self.assertEqual(2, self.mock.ensure_shas.call_count)
+    self.mock.ensure_shas.assert_has_calls([
+        mock.call(set(['sha1', 'sha2']), '/chrome/src'),
+        mock.call(set(['sha4']), '/v8'),
+    ], any_order=True)
@@ -0,0 +1,203 @@
+"""Tests the reproduce-batch command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import StringIO
+import time
+
+import mock
+
+from clusterfuzz.commands import reproduce_batch
+from error import error
+from test_libs import helpers
+
+
+class ReadTestcaseIdsTest(helpers.ExtendedTestCase):
+  """Tests read_testcase_ids."""
+
+  def test_read(self):
+    """Test skipping empty lines and comments."""
+    stream = StringIO.StringIO('123\n\n  456  # flaky\n# 789\n')
+    self.assertEqual(
+        ['123', '456'], reproduce_batch.read_testcase_ids(stream))
+
+
+class ResultWriterTest(helpers.ExtendedTestCase):
+  """Tests ResultWriter."""
+
+  def test_write(self):
+    """Test writing a JSON line."""
+    output = StringIO.StringIO()
+    reproduce_batch.ResultWriter(output).write('1', 'reproduced', group=0)
+    self.assertEqual(
+        {'testcase_id': '1', 'status': 'reproduced', 'group': 0},
+        json.loads(output.getvalue()))
+    self.assertTrue(output.getvalue().endswith('\n'))
+
+
+class ReproduceTestcaseTest(helpers.ExtendedTestCase):
+  """Tests reproduce_testcase."""
+
+  def setUp(self):
+    helpers.patch(self, ['time.time'])
+    self.mock.time.side_effect = [10] + [12.5] * 5
+    self.writer = mock.Mock()
+    self.testcase = mock.Mock(id=1, job_type='job', revision=2)
+    self.definition = mock.Mock()
+    self.options = mock.Mock(iterations=3)
+    self.reproducer = self.definition.reproducer.return_value
+
+  def reproduce(self):
+    reproduce_batch.reproduce_testcase(
+        self.writer, 0, self.testcase, self.definition, 'provider',
+        self.options)
+
+  def test_reproduced(self):
+    """Test writing a reproduced result."""
+    self.reproduce()
+    self.definition.reproducer.assert_called_once_with(
+        definition=self.definition, binary_provider='provider',
+        testcase=self.testcase, sanitizer=self.definition.sanitizer,
+        options=self.options)
+    self.reproducer.reproduce.assert_called_once_with(3)
+    self.writer.write.assert_called_once_with(
+        1, 'reproduced', group=0, job_type='job', revision=2, elapsed=2.5)
+
+  def test_unreproducible(self):
+    """Test writing an unreproducible result."""
+    self.reproducer.reproduce.side_effect = error.UnreproducibleError(3, [])
+    self.reproduce()
+    self.writer.write.assert_called_once_with(
+        1, 'unreproducible', group=0, job_type='job', revision=2,
+        elapsed=2.5)
+
+  def test_error(self):
+    """Test writing the error instead of raising."""
+    self.reproducer.reproduce.side_effect = RuntimeError('boom')
+    self.reproduce()
+    self.writer.write.assert_called_once_with(
+        1, 'error', group=0, job_type='job', revision=2, elapsed=2.5,
+        error='boom')
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests execute."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.ensure_goma',
+        'clusterfuzz.commands.reproduce.get_binary_provider',
+        'clusterfuzz.commands.reproduce.get_definition',
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.commands.reproduce_batch.reproduce_testcase',
+        'clusterfuzz.testcase.Testcase',
+    ])
+    self.testcases = {
+        '1': mock.Mock(id='1', job_type='job', revision=1, build_url='a'),
+        '2': mock.Mock(id='2', job_type='job', revision=1, build_url='a'),
+        '3': mock.Mock(id='3', job_type='job', revision=2, build_url='b'),
+    }
+    self.mock.get_testcase_info.side_effect = lambda i: i
+    self.mock.Testcase.side_effect = lambda i: self.testcases[i]
+    self.mock.ensure_goma.return_value = '/goma'
+    self.providers = [mock.Mock(), mock.Mock()]
+    self.mock.get_binary_provider.side_effect = self.providers
+    with open('/ids', 'w') as f:
+      f.write('1\n3\n2\n')
+
+  def execute(self, **kwargs):
+    args = dict(
+        input_file='/ids', output='/results', jobs=2, current=False,
+        build='chromium', disable_goma=False, goma_threads=None,
+        goma_load=None, iterations=3, disable_xvfb=False, target_args='',
+        disable_gclient=False, gn_check=False, worktree=False)
+    args.update(kwargs)
+    reproduce_batch.execute(**args)
+
+  def test_groups(self):
+    """Test building each group once and reproducing every testcase."""
+    self.execute()
+
+    definition = self.mock.get_definition.return_value
+    self.assertEqual(2, self.mock.get_binary_provider.call_count)
+    first_call = self.mock.get_binary_provider.call_args_list[0][0]
+    self.assertEqual((self.testcases['1'], definition), first_call[:2])
+    self.assertEqual('1', first_call[2].testcase_id)
+    self.assertEqual('/goma', first_call[2].goma_dir)
+    for provider in self.providers:
+      provider.get_binary_path.assert_called_once_with()
+
+    calls = sorted(
+        (c[0][1], c[0][2].id, c[0][4])
+        for c in self.mock.reproduce_testcase.call_args_list)
+    self.assertEqual([
+        (0, '1', self.providers[0]),
+        (0, '2', self.providers[0]),
+        (1, '3', self.providers[1])], calls)
+
+  def record_events(self):
+    """Record the builds, and the start and the end of every reproduction.
+      The reproductions are slow enough to overlap a build that doesn't wait
+      for them."""
+    events = []
+    for index, provider in enumerate(self.providers):
+      provider.get_binary_path.side_effect = (
+          lambda index=index: events.append(('build', index)))
+
+    def reproduce_testcase(unused_writer, unused_group, current_testcase,
+                           *unused_args):
+      events.append(('start', current_testcase.id))
+      time.sleep(0.05)
+      events.append(('end', current_testcase.id))
+    self.mock.reproduce_testcase.side_effect = reproduce_testcase
+    return events
+
+  def test_source_builds_wait(self):
+    """Test building the next group in the shared checkout only after the
+      reproductions of the previous group are done."""
+    events = self.record_events()
+    self.execute()
+
+    self.assertEqual(('build', 0), events[0])
+    self.assertEqual(
+        [('end', '1'), ('end', '2'), ('start', '1'), ('start', '2')],
+        sorted(events[1:5]))
+    self.assertEqual([('build', 1), ('start', '3'), ('end', '3')], events[5:])
+
+  def test_downloads_overlap(self):
+    """Test downloading the next group while the previous group
+      reproduces."""
+    events = self.record_events()
+    self.execute(build='download')
+
+    self.assertEqual(8, len(events))
+    self.assertLess(events.index(('build', 1)), events.index(('end', '1')))
+    self.assertLess(events.index(('build', 1)), events.index(('end', '2')))
+
+  def test_errors(self):
+    """Test reporting the testcases that cannot be loaded or built."""
+    self.mock.get_definition.side_effect = [
+        error.JobTypeNotSupportedError('job'), mock.Mock(), mock.Mock()]
+    self.providers[0].get_binary_path.side_effect = (
+        error.DirtyRepoError('/src'))
+    self.execute(build='download')
+
+    self.assert_n_calls(0, [self.mock.ensure_goma])
+    with open('/results') as f:
+      results = [json.loads(l) for l in f]
+    self.assertEqual(['1', '3'], [r['testcase_id'] for r in results])
+    self.assertEqual(['error', 'error'], [r['status'] for r in results])
+    self.assertEqual(1, self.mock.reproduce_testcase.call_count)
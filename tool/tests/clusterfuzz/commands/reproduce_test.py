@@ -19,6 +19,7 @@ import mock
 
 from clusterfuzz import common
 from clusterfuzz import binary_providers
+from clusterfuzz import job_types
 from clusterfuzz import reproducers
 from clusterfuzz.commands import reproduce
 from error import error
@@ -55,6 +56,7 @@ class ExecuteTest(helpers.ExtendedTestCase):
     self.mock_os_environment({'V8_SRC': '/v8/src', 'CHROME_SRC': '/pdf/src'})
     helpers.patch(self, [
         'clusterfuzz.commands.reproduce.get_definition',
+        'clusterfuzz.commands.reproduce.load_bundle',
         'clusterfuzz.commands.reproduce.get_testcase_info',
         'clusterfuzz.testcase.Testcase',
         'clusterfuzz.commands.reproduce.ensure_goma',
@@ -92,10 +94,7 @@ class ExecuteTest(helpers.ExtendedTestCase):
   def test_download_no_defined_binary(self):
     """Test what happens when no binary name is defined."""
     self.definition.binary_name = None
-    self.testcase.stacktrace_lines = [
-        {'content': 'incorrect'}, {'content': '[Environment] A = b'},
-        {'content': ('Running command: path/to/stacktrace_binary --args --arg2 '
-                     '/path/to/testcase')}]
+    self.testcase.get_binary_name.return_value = 'stacktrace_binary'
 
     self.options.build = 'download'
     reproduce.execute(**vars(self.options))
@@ -120,10 +119,7 @@ class ExecuteTest(helpers.ExtendedTestCase):
   def test_grab_data_with_download(self):
     """Ensures all method calls are made correctly when downloading."""
     self.definition.binary_name = 'defined_binary'
-    self.testcase.stacktrace_lines = [
-        {'content': 'incorrect'}, {'content': '[Environment] A = b'},
-        {'content': ('Running command: path/to/stacktrace_binary --args --arg2 '
-                     '/path/to/testcase')}]
+    self.testcase.get_binary_name.return_value = 'stacktrace_binary'
 
     self.options.build = 'download'
     reproduce.execute(**vars(self.options))
@@ -174,8 +170,82 @@ class ExecuteTest(helpers.ExtendedTestCase):
         ])
 
 
-class GetTestcaseInfoTest(helpers.ExtendedTestCase):
-  """Test get_testcase_info."""
+  def test_prepare(self):
+    """Ensures the testcase file and the build are prepared before the
+      reproducer is created."""
+    self.options.build = 'standalone'
+
+    def create_reproducer(**unused_kwargs):
+      self.assert_n_calls(1, [self.testcase.get_downloaded_testcase_file,
+                              self.builder.get_build_directory])
+      return mock.DEFAULT
+
+    self.definition.reproducer.side_effect = create_reproducer
+    reproduce.execute(**vars(self.options))
+    self.options.goma_dir = '/goma/dir'
+    self.definition.reproducer.assert_called_once_with(
+        binary_provider=self.builder, definition=self.definition,
+        testcase=self.testcase, sanitizer=self.definition.sanitizer,
+        options=self.options)
+
+  def test_bundle(self):
+    """Ensures the testcase is loaded from the bundle without network."""
+    self.mock.load_bundle.return_value = self.testcase
+    self.options.build = 'standalone'
+    reproduce.execute(bundle_path='/b.zip', **vars(self.options))
+    self.options.goma_dir = '/goma/dir'
+
+    self.assert_exact_calls(
+        self.mock.load_bundle, [mock.call('/b.zip', '1234')])
+    self.assert_n_calls(0, [self.mock.get_testcase_info, self.mock.Testcase])
+    self.definition.reproducer.assert_called_once_with(
+        binary_provider=self.builder, definition=self.definition,
+        testcase=self.testcase, sanitizer=self.definition.sanitizer,
+        options=self.options)
+
+
+class LoadBundleTest(helpers.ExtendedTestCase):
+  """Test load_bundle."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.bundle.Bundle',
+        'clusterfuzz.testcase.Testcase',
+    ])
+    self.bundle = mock.Mock(
+        testcase_json={'id': 1234}, testcase_id=1234,
+        shas={'v8/v8@1': 'sha'})
+    self.mock.Bundle.return_value = self.bundle
+    patcher = mock.patch.dict(
+        'clusterfuzz.binary_providers.resolved_shas', {}, clear=True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  def test_load(self):
+    """Test loading the testcase and the resolved shas."""
+    self.assertEqual(
+        self.mock.Testcase.return_value,
+        reproduce.load_bundle('/b.zip', '1234'))
+    self.mock.Testcase.assert_called_once_with(
+        {'id': 1234}, bundle=self.bundle)
+    self.assertEqual(
+        {'v8/v8@1': 'sha'}, binary_providers.resolved_shas)
+
+  def test_other_testcase(self):
+    """Test raising when the bundle holds another testcase."""
+    with self.assertRaises(error.BadBundleError):
+      reproduce.load_bundle('/b.zip', '5678')
+
+  def test_malformed_testcase(self):
+    """Test raising when the testcase misses a field."""
+    self.mock.Testcase.side_effect = KeyError('crash_stacktrace')
+    with self.assertRaises(error.BadBundleError) as cm:
+      reproduce.load_bundle('/b.zip', '1234')
+    self.assertIn("has no 'crash_stacktrace'", cm.exception.message)
+
+
+class FetchTestcaseInfoTest(helpers.ExtendedTestCase):
+  """Test fetch_testcase_info."""
 
   def setUp(self):
     helpers.patch(self, [
@@ -199,7 +269,7 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
         text=json.dumps(response_dict),
         headers=response_headers)
 
-    response = reproduce.get_testcase_info(999)
+    response = reproduce.fetch_testcase_info(999)
 
     self.assert_exact_calls(self.mock.get_stored_auth_header, [mock.call()])
     self.assert_exact_calls(self.mock.store_auth_header, [
@@ -229,7 +299,7 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
     self.mock.get_stored_auth_header.return_value = 'Bearer 12345'
     self.mock.get_verification_header.return_value = 'VerificationCode 12345'
 
-    response = reproduce.get_testcase_info(999)
+    response = reproduce.fetch_testcase_info(999)
 
     self.assert_exact_calls(self.mock.get_stored_auth_header, [mock.call()])
     self.assert_exact_calls(self.mock.get_verification_header, [mock.call()])
@@ -267,7 +337,7 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
         text=json.dumps(response_dict),
         headers=response_headers)
 
-    response = reproduce.get_testcase_info(999)
+    response = reproduce.fetch_testcase_info(999)
 
     self.assert_exact_calls(self.mock.get_stored_auth_header, [mock.call()])
     self.assert_exact_calls(self.mock.get_verification_header, [mock.call()])
@@ -304,7 +374,7 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
         headers=response_headers)
 
     with self.assertRaises(error.ClusterfuzzAuthError) as cm:
-      reproduce.get_testcase_info(999)
+      reproduce.fetch_testcase_info(999)
     self.assertIn('Invalid verification code (12345)', cm.exception.message)
     self.assert_exact_calls(self.mock.post, [
         mock.call(
@@ -334,7 +404,7 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
         headers=response_headers)
 
     with self.assertRaises(error.ClusterfuzzAuthError) as cm:
-      reproduce.get_testcase_info(999)
+      reproduce.fetch_testcase_info(999)
     self.assertIn('404', cm.exception.message)
     self.assert_exact_calls(self.mock.post, [
         mock.call(
@@ -346,6 +416,90 @@ class GetTestcaseInfoTest(helpers.ExtendedTestCase):
     ])
 
 
+class SendRequestTest(helpers.ExtendedTestCase):
+  """Test send_request without interaction."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.common.get_stored_auth_header',
+        'clusterfuzz.commands.reproduce.get_verification_header',
+        'clusterfuzz.common.post'])
+
+  def test_no_stored_header(self):
+    """Test raising instead of prompting without a stored header."""
+    self.mock.get_stored_auth_header.return_value = None
+    with self.assertRaises(error.ClusterfuzzAuthError):
+      reproduce.send_request('url', 'data', interactive=False)
+    self.assert_n_calls(
+        0, [self.mock.get_verification_header, self.mock.post])
+
+  def test_expired(self):
+    """Test raising instead of prompting when the token expired."""
+    self.mock.get_stored_auth_header.return_value = 'Bearer 1'
+    self.mock.post.return_value = mock.Mock(status_code=401, text='expired')
+    with self.assertRaises(error.ClusterfuzzAuthError):
+      reproduce.send_request('url', 'data', interactive=False)
+    self.assert_n_calls(0, [self.mock.get_verification_header])
+    self.assert_n_calls(1, [self.mock.post])
+
+
+class GetTestcaseInfoTest(helpers.ExtendedTestCase):
+  """Test get_testcase_info."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.fetch_testcase_info',
+        'threading.Thread',
+        'time.time'])
+    self.mock.time.return_value = 100000
+    self.mock.fetch_testcase_info.return_value = {'id': 'new'}
+    self.path = reproduce.get_testcase_info_path(1234)
+
+  def write_cache(self, age):
+    """Cache the testcase information fetched age seconds ago."""
+    common.write_json(
+        self.path, {'fetched_at': 100000 - age, 'response': {'id': 'old'}})
+
+  def test_no_cache(self):
+    """Test fetching and caching without a cache."""
+    self.assertEqual({'id': 'new'}, reproduce.get_testcase_info(1234))
+    self.mock.fetch_testcase_info.assert_called_once_with(1234, True)
+    self.assertEqual(
+        {'fetched_at': 100000, 'response': {'id': 'new'}},
+        common.read_json(self.path))
+
+  def test_fresh(self):
+    """Test using a fresh cache without any request."""
+    self.write_cache(reproduce.TESTCASE_INFO_TTL - 1)
+    self.assertEqual({'id': 'old'}, reproduce.get_testcase_info(1234))
+    self.assert_n_calls(0, [self.mock.fetch_testcase_info, self.mock.Thread])
+
+  def test_stale(self):
+    """Test using a stale cache and refreshing it in the background."""
+    self.write_cache(reproduce.TESTCASE_INFO_TTL + 1)
+    self.assertEqual({'id': 'old'}, reproduce.get_testcase_info(1234))
+    self.mock.Thread.assert_called_once_with(
+        target=reproduce.refresh_testcase_info, args=(1234,))
+    self.assertTrue(self.mock.Thread.return_value.daemon)
+    self.mock.Thread.return_value.start.assert_called_once_with()
+    self.assert_n_calls(0, [self.mock.fetch_testcase_info])
+
+  def test_expired(self):
+    """Test fetching when the cache is too old."""
+    self.write_cache(reproduce.TESTCASE_INFO_MAX_AGE + 1)
+    self.assertEqual({'id': 'new'}, reproduce.get_testcase_info(1234))
+    self.assert_n_calls(0, [self.mock.Thread])
+
+  def test_refresh(self):
+    """Test refreshing without prompting and keeping the cache on errors."""
+    self.write_cache(reproduce.TESTCASE_INFO_TTL + 1)
+    self.mock.fetch_testcase_info.side_effect = error.ClusterfuzzAuthError('')
+    reproduce.refresh_testcase_info(1234)
+    self.mock.fetch_testcase_info.assert_called_once_with(1234, False)
+    self.assertEqual({'id': 'old'}, common.read_json(self.path)['response'])
+
+
 class GetVerificationHeaderTest(helpers.ExtendedTestCase):
   """Tests the get_verification_header method"""
 
@@ -474,6 +628,15 @@ class GetDefinitionTest(helpers.ExtendedTestCase):
 class GetSupportedJobsTest(helpers.ExtendedTestCase):
   """Tests the get_supported_jobs method."""
 
+  def setUp(self):
+    load = job_types.load
+    helpers.patch(self, ['clusterfuzz.job_types.get'])
+    self.mock.get.side_effect = lambda: load(job_types.get_path())
+    self.supported_jobs = mock.patch.dict(
+        'clusterfuzz.commands.reproduce.supported_jobs', {}, clear=True)
+    self.supported_jobs.start()
+    self.addCleanup(self.supported_jobs.stop)
+
   def test_raise_from_key_error(self):
     """Tests that a BadJobTypeDefinition error is raised when parsing fails."""
     helpers.patch(self, [
@@ -482,11 +645,21 @@ class GetSupportedJobsTest(helpers.ExtendedTestCase):
 
     with self.assertRaises(error.BadJobTypeDefinitionError):
       reproduce.get_supported_jobs()
+    self.assertEqual({}, reproduce.supported_jobs)
 
   def test_get(self):
     """Test getting supported job types."""
     results = reproduce.get_supported_jobs()
     self.assertIn('chromium', results)
     self.assertIn('libfuzzer_chrome_ubsan', results['chromium'])
+    self.assertEqual(
+        binary_providers.ChromiumBuilder,
+        results['chromium']['libfuzzer_chrome_ubsan'].builder)
     self.assertIn('standalone', results)
     self.assertIn('linux_asan_pdfium', results['standalone'])
+
+  def test_memoize(self):
+    """Test that the job types are parsed once."""
+    results = reproduce.get_supported_jobs()
+    self.assertIs(results, reproduce.get_supported_jobs())
+    self.assertEqual(1, self.mock.get.call_count)
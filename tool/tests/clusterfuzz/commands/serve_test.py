@@ -0,0 +1,137 @@
+"""Test the 'serve' command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import cStringIO
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+import mock
+
+from clusterfuzz.commands import serve
+from error import error
+from test_libs import helpers
+
+
+class ReadOutputTest(helpers.ExtendedTestCase):
+  """Tests read_output."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.commands.serve.logger'])
+    self.client = mock.Mock()
+    self.output = cStringIO.StringIO()
+
+  def test_exit_code(self):
+    """Test writing the output, and returning the exit code after it."""
+    data = 'line 1\nline 2\n' + serve.EXIT_MARKER + '3\n'
+    # The marker is split between two chunks.
+    self.client.recv.side_effect = [data[:16], data[16:], '']
+    self.assertEqual(3, serve.read_output(self.client, self.output))
+    self.assertEqual('line 1\nline 2\n', self.output.getvalue())
+
+  def test_daemon_stopped(self):
+    """Test failing when the output ends without the exit code."""
+    self.client.recv.side_effect = ['line 1\n', '']
+    self.assertEqual(1, serve.read_output(self.client, self.output))
+    self.assertEqual('line 1\n', self.output.getvalue())
+
+
+class ServeTest(helpers.ExtendedTestCase):
+  """Tests serving requests over a real socket in forked processes."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.serve.logger',
+        'clusterfuzz.main.execute',
+    ])
+    self.tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp_dir)
+    self.socket_path = os.path.join(self.tmp_dir, 'serve.sock')
+
+  def serve_one(self, server):
+    """Run a single request, and finish it once its process exits."""
+    conn, _ = server.accept()
+    requests = {serve.start_request(server, conn): conn}
+    deadline = time.time() + 10
+    while requests and time.time() < deadline:
+      serve.reap_requests(requests)
+      time.sleep(0.01)
+
+  def test_request(self):
+    """Test running a request with the client's environment, and streaming
+      its output and exit code back."""
+    def execute(argv):
+      os.write(1, 'argv=%s cwd=%s\n' % (' '.join(argv), os.getcwd()))
+      os.write(2, 'FOO=%s\n' % os.environ.get('FOO'))
+      sys.exit(3)
+    self.mock.execute.side_effect = execute
+
+    server = serve.create_server(self.socket_path)
+    self.addCleanup(server.close)
+    thread = threading.Thread(target=self.serve_one, args=(server,))
+    thread.start()
+
+    output = cStringIO.StringIO()
+    with mock.patch.dict(os.environ, {'FOO': 'bar'}), \
+         mock.patch('sys.stdout', output):
+      code = serve.forward(['reproduce', '1234'], self.socket_path)
+    thread.join(10)
+
+    self.assertEqual(3, code)
+    self.assertEqual(
+        'argv=reproduce 1234 cwd=%s\nFOO=bar\n' % os.getcwd(),
+        output.getvalue())
+
+  def test_running(self):
+    """Test refusing to start a second daemon on the same socket."""
+    server = serve.create_server(self.socket_path)
+    self.addCleanup(server.close)
+    with self.assertRaises(error.DaemonRunningError):
+      serve.create_server(self.socket_path)
+
+  def test_stale_socket(self):
+    """Test replacing the socket of a daemon that is gone."""
+    serve.create_server(self.socket_path).close()
+    server = serve.create_server(self.socket_path)
+    server.close()
+
+  def test_not_running(self):
+    """Test failing when no daemon is listening."""
+    self.assertEqual(
+        error.DaemonNotRunningError.EXIT_CODE,
+        serve.forward(['reproduce', '1234'], self.socket_path))
+
+  def test_bad_request(self):
+    """Test refusing to run other commands."""
+    client, conn = socket.socketpair()
+    self.addCleanup(client.close)
+    self.addCleanup(conn.close)
+    client.sendall('{"argv": ["serve"], "env": {}, "cwd": "/"}\n')
+    with self.assertRaises(ValueError):
+      serve.start_request(mock.Mock(), conn)
+    self.assertIsNone(conn.gettimeout())
+
+  def test_silent_client(self):
+    """Test giving up on a client that doesn't send its request."""
+    client, conn = socket.socketpair()
+    self.addCleanup(client.close)
+    self.addCleanup(conn.close)
+    with mock.patch.object(serve, 'REQUEST_TIMEOUT', 0.1):
+      with self.assertRaises(socket.timeout):
+        serve.start_request(mock.Mock(), conn)
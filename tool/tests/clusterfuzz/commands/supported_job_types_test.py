@@ -24,12 +24,13 @@ class ExecuteTest(helpers.ExtendedTestCase):
   """Tests the printing of supported job types."""
 
   def setUp(self):
-    helpers.patch(self, ['yaml.load'])
-    self.mock.load.return_value = {
+    helpers.patch(self, ['clusterfuzz.job_types.get'])
+    self.mock.get.return_value = {
         'chromium': {
-            'chromium_job': 'stuff'},
+            'chromium_job': {'builder': 'Chromium'},
+            'asan_job': {'builder': 'Chromium'}},
         'standalone': {
-            'pdfium_job': 'pdf_stuff'}}
+            'pdfium_job': {'builder': 'Pdfium'}}}
 
   def test_print_supported_jobs(self):
     """Tests that printing is formatted correctly."""
@@ -39,8 +40,9 @@ class ExecuteTest(helpers.ExtendedTestCase):
 
     supported_job_types.execute()
 
-    printed = yaml.dump({'chromium': ['chromium_job'],
-                         'standalone': ['pdfium_job']})
+    printed = yaml.dump({'chromium': ['asan_job', 'chromium_job'],
+                         'standalone': ['pdfium_job']},
+                        default_flow_style=False).strip()
 
     self.assert_exact_calls(self.mock.getLogger.return_value.debug, [
         mock.call('Printing supported job types')])
@@ -0,0 +1,162 @@
+"""Tests the worker command."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import socket
+
+import mock
+
+from clusterfuzz.commands import worker
+from error import error
+from test_libs import helpers
+
+
+OPTIONS = {
+    'current': False, 'build': 'chromium', 'disable_goma': False,
+    'goma_threads': None, 'goma_load': None, 'iterations': 3,
+    'disable_xvfb': False, 'target_args': '', 'edit_mode': False,
+    'disable_gclient': False, 'enable_debug': False, 'gn_check': False,
+    'worktree': False}
+
+
+def make_job(job_id, key):
+  return {'id': job_id, 'testcase_id': str(job_id), 'key': key, 'group': 0}
+
+
+class RunJobTest(helpers.ExtendedTestCase):
+  """Tests Worker.run_job."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.reproduce.ensure_goma',
+        'clusterfuzz.commands.reproduce.get_binary_provider',
+        'clusterfuzz.commands.worker.logger',
+        'clusterfuzz.commands.reproduce.get_definition',
+        'clusterfuzz.commands.reproduce.get_testcase_info',
+        'clusterfuzz.commands.reproduce_batch.reproduce_testcase',
+        'clusterfuzz.testcase.Testcase',
+    ])
+    self.mock.ensure_goma.return_value = '/goma/dir'
+    self.mock.Testcase.return_value = mock.Mock(job_type='job')
+    self.server = mock.Mock()
+    self.worker = worker.Worker(self.server, 'w1')
+
+  def test_reuse_build(self):
+    """Test building once per key, and starting GOMA once."""
+    providers = [mock.Mock(build_directory='/src/out/1'),
+                 mock.Mock(build_directory='/src/out/2')]
+    self.mock.get_binary_provider.side_effect = providers
+    self.worker.run_job(make_job(1, 'a'), OPTIONS)
+    self.worker.run_job(make_job(2, 'a'), OPTIONS)
+    self.worker.run_job(make_job(3, 'b'), OPTIONS)
+
+    self.assertEqual(2, self.mock.get_binary_provider.call_count)
+    for provider in providers:
+      provider.get_binary_path.assert_called_once_with()
+    self.mock.ensure_goma.assert_called_once_with()
+    self.assertEqual(['a', 'b'], sorted(self.worker.binary_providers))
+
+    sender, group, _, _, binary_provider, options = (
+        self.mock.reproduce_testcase.call_args[0])
+    self.assertEqual(('w1', 3), (sender.worker_id, sender.job_id))
+    self.assertEqual(0, group)
+    self.assertEqual(providers[1], binary_provider)
+    self.assertEqual('3', options.testcase_id)
+    self.assertEqual('/goma/dir', options.goma_dir)
+
+  def test_replaced_build(self):
+    """Test forgetting the source build whose out directory is reused by a
+      later build, and keeping the one in another out directory."""
+    providers = [mock.Mock(build_directory='/src/out/1'),
+                 mock.Mock(build_directory='/src/out/2'),
+                 mock.Mock(build_directory='/src/out/1')]
+    self.mock.get_binary_provider.side_effect = providers
+    self.worker.run_job(make_job(1, 'a'), OPTIONS)
+    self.worker.run_job(make_job(2, 'b'), OPTIONS)
+    self.worker.run_job(make_job(3, 'c'), OPTIONS)
+
+    self.assertEqual({'b': providers[1], 'c': providers[2]},
+                     self.worker.binary_providers)
+
+  def test_download(self):
+    """Test not starting GOMA for downloaded builds, and keeping all the
+      downloads."""
+    options = dict(OPTIONS, build='download')
+    self.worker.run_job(make_job(1, 'a'), options)
+    self.worker.run_job(make_job(2, 'b'), options)
+    self.assertEqual(0, self.mock.ensure_goma.call_count)
+    self.assertEqual(['a', 'b'], sorted(self.worker.binary_providers))
+
+  def test_error(self):
+    """Test sending the error of a testcase that can't be prepared."""
+    self.mock.get_definition.side_effect = error.JobTypeNotSupportedError(
+        'job')
+    self.worker.run_job(make_job(1, 'a'), OPTIONS)
+    self.server.put_result.assert_called_once_with(
+        'w1', 1, {'testcase_id': '1', 'status': 'error', 'group': 0,
+                  'error': error.JobTypeNotSupportedError('job').message})
+    self.assertEqual(0, self.mock.reproduce_testcase.call_count)
+
+  def test_unexpected_error(self):
+    """Test sending an unexpected error as the result, instead of stopping
+      the worker with the job leased."""
+    self.mock.get_binary_provider.side_effect = RuntimeError()
+    self.worker.run_job(make_job(1, 'a'), OPTIONS)
+    self.server.put_result.assert_called_once_with(
+        'w1', 1, {'testcase_id': '1', 'status': 'error', 'group': 0,
+                  'error': 'RuntimeError'})
+    self.mock.logger.exception.assert_called_once_with(mock.ANY, '1')
+    self.assertEqual({}, self.worker.binary_providers)
+    self.assertEqual(0, self.mock.reproduce_testcase.call_count)
+
+
+class RunTest(helpers.ExtendedTestCase):
+  """Tests Worker.run."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.worker.Worker.run_job',
+        'time.sleep',
+    ])
+    self.server = mock.Mock()
+    self.worker = worker.Worker(self.server, 'w1')
+
+  def test_run(self):
+    """Test running the jobs, waiting, and stopping when done."""
+    self.server.get_job.side_effect = [
+        {'status': 'job', 'job': 'job', 'options': 'options'},
+        {'status': 'wait'},
+        {'status': 'done'}]
+    self.worker.run()
+    self.mock.run_job.assert_called_once_with(self.worker, 'job', 'options')
+    self.mock.sleep.assert_called_once_with(worker.WAIT_INTERVAL)
+    self.server.get_job.assert_called_with('w1', [])
+
+
+class ExecuteTest(helpers.ExtendedTestCase):
+  """Tests execute."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.commands.worker.logger',
+        'clusterfuzz.commands.worker.Worker.run',
+    ])
+
+  def test_server_gone(self):
+    """Test stopping when the job server is gone."""
+    self.mock.run.side_effect = socket.error('refused')
+    worker.execute('http://localhost:1', 'w1')
+    self.mock.logger.info.assert_called_with(
+        'Stopping, because the job server is unreachable: %s',
+        self.mock.run.side_effect)
@@ -18,6 +18,7 @@ import subprocess
 import os
 import signal
 import stat
+import time
 
 import mock
 
@@ -212,6 +213,166 @@ class ExecuteTest(helpers.ExtendedTestCase):
         error.NotInstalledError.MESSAGE.format(binary='cmd'),
         cm.exception.message)
 
+  def test_large_output(self):
+    """Test capturing the whole output without a buffer, e.g. for the
+      targets of ninja."""
+    self.stdout = 'target: phony\n' * (
+        (common.OUTPUT_HEAD_LENGTH + common.OUTPUT_TAIL_LENGTH) / 10)
+    self.mock.Popen.return_value = self.build_popen_mock(0)
+    self.mock.Popen.return_value.communicate.return_value = ('', '')
+
+    _, output = common.execute(
+        'cmd', '', '~/working/directory', print_output=False)
+    self.assertEqual(self.stdout, output)
+
+  def test_output_buffer(self):
+    """Test capturing into the caller's buffer, which is left open."""
+    self.mock.Popen.return_value = self.build_popen_mock(0)
+    self.mock.Popen.return_value.communicate.return_value = (
+        self.residue_stdout, self.stderr)
+    output_buffer = common.OutputBuffer(head_length=4, tail_length=6)
+    self.addCleanup(output_buffer.close)
+
+    _, output = common.execute(
+        'cmd', '', '~/working/directory', output_buffer=output_buffer)
+
+    self.assertEqual(
+        'Line\n[... %d bytes of output omitted ...]\n\nErr 3' % (
+            len(output_buffer) - 10),
+        output)
+    self.assertEqual(
+        self.stdout + self.residue_stdout + self.stderr,
+        output_buffer.mmap()[:])
+
+
+class JsonTest(helpers.ExtendedTestCase):
+  """Tests read_json and write_json."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_round_trip(self):
+    """Test reading back what's written."""
+    common.write_json('/dir/file.json', {'a': [1]})
+    self.assertEqual({'a': [1]}, common.read_json('/dir/file.json'))
+    self.assertEqual(['file.json'], os.listdir('/dir'))
+
+  def test_missing_or_corrupted(self):
+    """Test returning None on a missing or corrupted file."""
+    self.assertIsNone(common.read_json('/missing.json'))
+    os.makedirs('/dir')
+    with open('/dir/bad.json', 'w') as f:
+      f.write('{')
+    self.assertIsNone(common.read_json('/dir/bad.json'))
+
+
+class NormalizeFrameTest(helpers.ExtendedTestCase):
+  """Tests normalize_frame."""
+
+  def test_normalize(self):
+    """Test removing addresses, parameters and extra whitespace."""
+    self.assertEqual(
+        'blink::Node::remove',
+        common.normalize_frame('  blink::Node::remove(bool, int)  '))
+    self.assertEqual('in libc.so+', common.normalize_frame('in libc.so+0x1f2a'))
+    self.assertEqual('', common.normalize_frame('  '))
+
+
+class GetOrderedOverlapTest(helpers.ExtendedTestCase):
+  """Tests get_ordered_overlap."""
+
+  def test_overlap(self):
+    """Test counting the frames in the same order."""
+    self.assertEqual(3, common.get_ordered_overlap('abc', 'abc'))
+    self.assertEqual(2, common.get_ordered_overlap('abc', 'axc'))
+    self.assertEqual(1, common.get_ordered_overlap('abc', 'cba'))
+    self.assertEqual(0, common.get_ordered_overlap('abc', ''))
+
+
+class CrashSignatureTest(helpers.ExtendedTestCase):
+  """Tests CrashSignature."""
+
+  def test_key(self):
+    """Test that the key ignores the output and the frame details."""
+    self.assertEqual(
+        common.CrashSignature('Heap-use-after-free', ['a(int)', 'b', '']).key,
+        common.CrashSignature(
+            'Heap-use-after-free ', ['a', ' b'], output_digest='abc').key)
+
+  def test_similarity(self):
+    """Test scoring the crash type and the ordered frames."""
+    signature = common.CrashSignature('UAF', ['a', 'b', 'c'])
+    self.assertEqual(
+        1.0, signature.get_similarity(common.CrashSignature('UAF', 'abc')))
+    self.assertEqual(
+        0.75, signature.get_similarity(common.CrashSignature('UAF', 'abd')))
+    self.assertEqual(
+        0.5, signature.get_similarity(common.CrashSignature('UAF', 'cba')))
+    self.assertEqual(
+        0.5, signature.get_similarity(common.CrashSignature('Null', 'ab')))
+    self.assertEqual(
+        0.0, signature.get_similarity(common.CrashSignature('Null', 'xyz')))
+
+
+class CrashSignatureIndexTest(helpers.ExtendedTestCase):
+  """Tests CrashSignatureIndex."""
+
+  def setUp(self):
+    self.index = common.CrashSignatureIndex()
+    self.index.add(common.CrashSignature('UAF', ['a', 'b', 'c']), 1)
+    self.index.add(common.CrashSignature('UAF', ['a', 'b', 'd']), 2)
+    self.index.add(common.CrashSignature('Null', ['x', 'y']), 3)
+    self.index.add(common.CrashSignature('Timeout', []), 4)
+    self.index.add(common.CrashSignature('UAF', ['a(int)', 'b', 'c']), 5)
+
+  def test_find_exact(self):
+    """Test looking up the signatures with the same key."""
+    self.assertEqual(
+        [1, 5], self.index.find_exact(common.CrashSignature('UAF', 'abc')))
+    self.assertEqual(
+        [], self.index.find_exact(common.CrashSignature('UAF', 'a')))
+    self.assertEqual(5, len(self.index))
+
+  def test_find(self):
+    """Test scoring the signatures that share a frame."""
+    self.assertEqual(
+        [(1.0, 1), (1.0, 5), (0.75, 2)],
+        self.index.find(common.CrashSignature('UAF', 'abc')))
+    self.assertEqual(
+        [(0.75, 2), (0.5, 1), (0.5, 5)],
+        self.index.find(common.CrashSignature('Null', 'abd'), min_score=0.5))
+    self.assertEqual(
+        [(0.75, 2)], self.index.find(common.CrashSignature('Null', 'abd')))
+    self.assertEqual(
+        [(1.0, 4)], self.index.find(common.CrashSignature('Timeout', [])))
+    self.assertEqual([], self.index.find(common.CrashSignature('UAF', 'z')))
+
+  def test_match(self):
+    """Test returning the best match."""
+    self.assertEqual(1, self.index.match(common.CrashSignature('UAF', 'abc')))
+    self.assertEqual(2, self.index.match(common.CrashSignature('UAF', 'xbd')))
+    self.assertIsNone(self.index.match(common.CrashSignature('UAF', 'xyz')))
+
+
+class IsStreamIdleTest(helpers.ExtendedTestCase):
+  """Tests is_stream_idle."""
+
+  def test_pipe(self):
+    """Test a pipe with and without data."""
+    read_fd, write_fd = os.pipe()
+    stream = os.fdopen(read_fd, 'r', 0)
+    try:
+      self.assertTrue(common.is_stream_idle(stream))
+      os.write(write_fd, 'a')
+      self.assertFalse(common.is_stream_idle(stream))
+    finally:
+      stream.close()
+      os.close(write_fd)
+
+  def test_no_fileno(self):
+    """Test a stream without a file descriptor."""
+    self.assertFalse(common.is_stream_idle(cStringIO.StringIO('a')))
+
 
 class CheckBinaryTest(helpers.ExtendedTestCase):
   """Test check_binary."""
@@ -344,26 +505,6 @@ class AskTest(helpers.ExtendedTestCase):
     self.assertEqual(result, 'correct')
 
 
-class GetBinaryNameTest(helpers.ExtendedTestCase):
-  """Test get_binary_name."""
-
-  def test_running_command(self):
-    """Test 'Running Command: '."""
-    binary_name = common.get_binary_name([
-        {'content': 'aaa'},
-        {'content': 'Running command: aaa/bbb/some_fuzzer something'},
-        {'content': 'bbb'}
-    ])
-    self.assertEqual('some_fuzzer', binary_name)
-
-  def test_no_command(self):
-    """Raise an exception when there's no command."""
-    with self.assertRaises(error.MinimizationNotFinishedError):
-      common.get_binary_name([
-          {'content': 'aaa'}
-      ])
-
-
 class DefinitionTest(helpers.ExtendedTestCase):
   """Tests the Definition class."""
 
@@ -414,6 +555,79 @@ class WaitTimeoutTest(helpers.ExtendedTestCase):
     self.mock.kill.assert_called_once_with(self.proc)
 
 
+class WaitWithUsageTest(helpers.ExtendedTestCase):
+  """Tests wait_with_usage."""
+
+  def start(self, command):
+    proc = subprocess.Popen(['sh', '-c', command])
+    proc.usage = common.ResourceUsage('/bin/sh')
+    return proc
+
+  def test_exit(self):
+    """Test recording the usage of a command that exits."""
+    proc = self.start('exit 3')
+    self.assertEqual(3, common.wait_with_usage(proc))
+    self.assertEqual(3, proc.returncode)
+    self.assertTrue(proc.usage.is_recorded())
+    self.assertGreater(proc.usage.peak_rss, 0)
+    self.assertEqual(3, common.wait_with_usage(proc))
+
+  def test_signal(self):
+    """Test returning the negative signal of a killed command."""
+    proc = self.start('kill -9 $$')
+    self.assertEqual(-signal.SIGKILL, common.wait_with_usage(proc))
+
+  def test_running(self):
+    """Test polling a command that is still running."""
+    proc = self.start('sleep 5')
+    self.assertIsNone(common.wait_with_usage(proc, os.WNOHANG))
+    self.assertFalse(proc.usage.is_recorded())
+    proc.kill()
+    self.assertEqual(-signal.SIGKILL, common.wait_with_usage(proc))
+
+  def test_reaped(self):
+    """Test assuming success when something else reaped the command."""
+    proc = self.start('exit 3')
+    os.waitpid(proc.pid, 0)
+    self.assertEqual(0, common.wait_with_usage(proc))
+    self.assertFalse(proc.usage.is_recorded())
+
+
+class ResourceAccountTest(helpers.ExtendedTestCase):
+  """Tests ResourceAccount."""
+
+  def create_usage(self, binary, seconds, peak_rss, process_count=None):
+    usage = common.ResourceUsage(binary)
+    usage.record(mock.Mock(
+        ru_utime=seconds, ru_stime=seconds / 2, ru_maxrss=peak_rss / 1024,
+        ru_inblock=2, ru_oublock=4))
+    usage.wall_time = seconds * 2
+    usage.process_count = process_count
+    return usage
+
+  def test_add(self):
+    """Test summing the times and bytes, and keeping the peaks."""
+    account = common.ResourceAccount()
+    account.add(self.create_usage('/out/d8', 1.0, 2048, 3))
+    account.add(self.create_usage('/out/d8', 2.0, 1024, 5))
+    account.add(self.create_usage('/usr/bin/gdb', 0.5, 4096))
+
+    self.assertEqual({
+        'd8': {'count': 2, 'wall_time': 6.0, 'user_time': 3.0,
+               'system_time': 1.5, 'peak_rss': 2048, 'read_bytes': 2048,
+               'write_bytes': 4096, 'process_count': 5},
+        'gdb': {'count': 1, 'wall_time': 1.0, 'user_time': 0.5,
+                'system_time': 0.25, 'peak_rss': 4096, 'read_bytes': 1024,
+                'write_bytes': 2048}}, account.get_totals())
+
+  def test_str(self):
+    """Test formatting the usage of a command."""
+    usage = self.create_usage('/out/d8', 1.0, 3 * 1024 * 1024, 4)
+    self.assertEqual(
+        'd8: 2.0s wall, 1.0s user, 0.5s system, 3 MB peak RSS, 0 MB read, '
+        '0 MB written, 4 processes', str(usage))
+
+
 class KillTest(helpers.ExtendedTestCase):
   """Test kill method."""
 
@@ -422,6 +636,7 @@ class KillTest(helpers.ExtendedTestCase):
     self.proc = mock.Mock()
     self.proc.args = 'cmd'
     self.proc.pid = 1234
+    self.proc.process_tree = None
 
     self.no_process_error = OSError()
     self.no_process_error.errno = common.NO_SUCH_PROCESS_ERRNO
@@ -436,6 +651,17 @@ class KillTest(helpers.ExtendedTestCase):
         mock.call(1234, signal.SIGKILL), mock.call(1234, signal.SIGKILL)
     ])
     self.assert_exact_calls(self.mock.sleep, [mock.call(3)] * 3)
+    self.assert_exact_calls(self.proc.poll, [mock.call()] * 3)
+
+  def test_process_tree(self):
+    """Test killing the process tree at once."""
+    self.proc.process_tree = mock.Mock()
+    common.kill(self.proc)
+
+    self.proc.process_tree.kill.assert_called_once_with()
+    self.proc.wait.assert_called_once_with()
+    self.assertEqual(0, self.mock.killpg.call_count)
+    self.assertEqual(0, self.mock.sleep.call_count)
 
   def test_fail(self):
     """Test failing to kill."""
@@ -466,6 +692,29 @@ class KillTest(helpers.ExtendedTestCase):
     self.assertEqual(4, cm.exception.errno)
 
 
+class GetResourceTest(helpers.ExtendedTestCase):
+  """Tests get_resource."""
+
+  def setUp(self):
+    helpers.patch(self, ['os.chmod', 'os.stat'])
+    self.path = os.path.join(
+        os.path.dirname(common.__file__), 'resources', 'VERSION')
+
+  def test_wrong_permission(self):
+    """Test fixing the permission."""
+    self.mock.stat.return_value = mock.Mock(st_mode=stat.S_IFREG | 0600)
+    self.assertEqual(
+        self.path, common.get_resource(0640, 'resources', 'VERSION'))
+    self.mock.chmod.assert_called_once_with(self.path, 0640)
+
+  def test_right_permission(self):
+    """Test leaving the right permission as it is."""
+    self.mock.stat.return_value = mock.Mock(st_mode=stat.S_IFREG | 0640)
+    self.assertEqual(
+        self.path, common.get_resource(0640, 'resources', 'VERSION'))
+    self.assert_n_calls(0, [self.mock.chmod])
+
+
 class DeleteIfExistsTest(helpers.ExtendedTestCase):
   """Tests the delete_if_exists method."""
 
@@ -627,6 +876,141 @@ class GsutilTest(helpers.ExtendedTestCase):
     self.mock.execute.assert_called_once_with('gsutil', 'test', cwd='source')
 
 
+class OutputBufferTest(helpers.ExtendedTestCase):
+  """Tests OutputBuffer. It uses the real temporary directory because mmap
+    doesn't work with pyfakefs."""
+
+  def setUp(self):
+    self.output_buffer = common.OutputBuffer(head_length=3, tail_length=4)
+    self.addCleanup(self.output_buffer.close)
+
+  def test_short(self):
+    """Test that a short output is kept in memory."""
+    for chunk in ['ab', 'cde', 'f']:
+      self.output_buffer.write(chunk)
+
+    self.assertEqual('abcdef', self.output_buffer.getvalue())
+    self.assertIsNone(self.output_buffer.spill_file)
+    self.assertEqual('abcdef', self.output_buffer.mmap()[:])
+
+  def test_long(self):
+    """Test that only the head and the tail of a long output are kept in
+      memory, and the whole output is spilled."""
+    for char in 'abcdefghijklmnopqrstuvwxyz':
+      self.output_buffer.write(char)
+
+    self.assertEqual(
+        'abc\n[... 19 bytes of output omitted ...]\nwxyz',
+        self.output_buffer.getvalue())
+    self.assertLessEqual(len(self.output_buffer.tail), 8)
+    self.assertEqual(26, len(self.output_buffer))
+    self.assertEqual(
+        'abcdefghijklmnopqrstuvwxyz', self.output_buffer.mmap()[:])
+
+    spill_path = self.output_buffer.spill_file.name
+    self.output_buffer.close()
+    self.assertFalse(os.path.exists(spill_path))
+
+  def test_empty(self):
+    """Test an empty output."""
+    self.assertEqual('', self.output_buffer.getvalue())
+    self.assertEqual('', self.output_buffer.mmap())
+
+
+class CrashReportDetectorTest(helpers.ExtendedTestCase):
+  """Tests CrashReportDetector."""
+
+  def setUp(self):
+    helpers.patch(self, ['time.time'])
+    self.mock.time.return_value = 100
+    self.detector = common.CrashReportDetector(grace_period=2)
+
+  def test_sanitizer_report(self):
+    """Test recognising the end of a report that arrives a byte at a time."""
+    for char in ('==1==ERROR: AddressSanitizer: heap-use-after-free\n'
+                 'SUMMARY: AddressSanitizer: heap-use-after-free'):
+      self.detector.process(char)
+    self.assertIsNone(self.detector.deadline)
+
+    self.detector.process('\n')
+    self.assertEqual(102, self.detector.deadline)
+
+  def test_libfuzzer_report(self):
+    """Test recognising the end of a libFuzzer report."""
+    self.detector.process('==1== ERROR: libFuzzer: timeout\n'
+                          'SUMMARY: libFuzzer: timeout\nmore')
+    self.assertEqual(102, self.detector.deadline)
+
+  def test_no_report(self):
+    """Test that a summary in the middle of a line isn't a report."""
+    self.detector.process('x' * 2000 + 'SUMMARY: AddressSanitizer: a\n')
+    self.detector.process('Not a SUMMARY: AddressSanitizer: a\n')
+    self.assertIsNone(self.detector.deadline)
+    self.assertEqual('', self.detector.partial_line)
+
+
+class ReadUntilCrashTest(helpers.ExtendedTestCase):
+  """Tests read_until_crash with real processes."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.kill'])
+    # kill waits for seconds between signals.
+    self.mock.kill.side_effect = (
+        lambda proc: os.killpg(proc.pid, signal.SIGKILL))
+
+  def read(self, command, timeout):
+    """Return the output of the command and the seconds it took."""
+    proc = subprocess.Popen(
+        command, shell=True, stdout=subprocess.PIPE, preexec_fn=os.setsid)
+    self.addCleanup(proc.wait)
+    detector = common.CrashReportDetector(grace_period=0.1)
+
+    start = time.time()
+    output = ''.join(common.read_until_crash(proc, 100, timeout, detector))
+    return output, time.time() - start
+
+  def test_crash_report(self):
+    """Test stopping the command shortly after its crash report."""
+    output, elapsed = self.read(
+        "echo 'SUMMARY: AddressSanitizer: a'; echo b; sleep 100", 30)
+
+    self.assertEqual('SUMMARY: AddressSanitizer: a\nb\n', output)
+    self.assertLess(elapsed, 10)
+    self.assertEqual(1, self.mock.kill.call_count)
+
+  def test_timeout(self):
+    """Test stopping the command when it times out."""
+    output, elapsed = self.read('echo a; sleep 100', 1)
+
+    self.assertEqual('a\n', output)
+    self.assertLess(elapsed, 10)
+    self.assertEqual(1, self.mock.kill.call_count)
+
+  def test_idle(self):
+    """Test stopping the command when it seems to hang."""
+    idle_detector = mock.Mock(interval=0.1, idle_timeout=1)
+    idle_detector.is_idle.side_effect = [False, True]
+    proc = subprocess.Popen(
+        'echo a; sleep 100', shell=True, stdout=subprocess.PIPE,
+        preexec_fn=os.setsid)
+    self.addCleanup(proc.wait)
+
+    output = ''.join(common.read_until_crash(
+        proc, 100, 30, None, idle_detector))
+
+    self.assertEqual('a\n', output)
+    self.assertEqual(1, self.mock.kill.call_count)
+    idle_detector.record_output.assert_called_once_with()
+    idle_detector.is_idle.assert_called_with(proc.pid)
+
+  def test_exit(self):
+    """Test a command that exits by itself."""
+    output, _ = self.read('echo a', 30)
+
+    self.assertEqual('a\n', output)
+    self.assertEqual(0, self.mock.kill.call_count)
+
+
 class StringStdinTest(helpers.ExtendedTestCase):
   """Tests StringStdin."""
 
@@ -0,0 +1,79 @@
+"""Test the 'crash_times' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from clusterfuzz import common
+from clusterfuzz import crash_times
+from test_libs import helpers
+
+
+class GetTimeoutTest(helpers.ExtendedTestCase):
+  """Tests get_timeout."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_no_crash_times(self):
+    """Test using the default without any crash times."""
+    self.assertEqual(30, crash_times.get_timeout('job', 30))
+
+  def test_crash_times(self):
+    """Test deriving the timeout from the longest crash time."""
+    common.write_json(crash_times.CACHE_PATH, {
+        'fast': [[0.5, True], [1.2, True]] * 3,
+        'medium': [[5.2, True], [2, True]] * 3,
+        'slow': [[100, True]]})
+
+    self.assertEqual(crash_times.MIN_TIMEOUT,
+                     crash_times.get_timeout('fast', 30))
+    self.assertEqual(16, crash_times.get_timeout('medium', 30))
+    self.assertEqual(crash_times.MAX_TIMEOUT,
+                     crash_times.get_timeout('slow', 30))
+    self.assertEqual(30, crash_times.get_timeout('other', 30))
+
+  def test_few_records(self):
+    """Test not going below the default with a few fast crashes."""
+    common.write_json(crash_times.CACHE_PATH, {'job': [[0.5, True]]})
+    self.assertEqual(30, crash_times.get_timeout('job', 30))
+
+  def test_timed_out(self):
+    """Test not going below the timeout of a run that timed out."""
+    common.write_json(crash_times.CACHE_PATH, {
+        'job': [[0.5, True]] * 5 + [[20, False]]})
+    self.assertEqual(20, crash_times.get_timeout('job', 30))
+
+  def test_only_timed_out(self):
+    """Test using the default when no run has crashed."""
+    common.write_json(crash_times.CACHE_PATH, {'job': [[60, False]] * 5})
+    self.assertEqual(30, crash_times.get_timeout('job', 30))
+
+
+class RecordTest(helpers.ExtendedTestCase):
+  """Tests record."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_record(self):
+    """Test keeping the most recent runs of every job type."""
+    for seconds in range(crash_times.MAX_RECORDS + 1):
+      crash_times.record('job', seconds + 0.123)
+    crash_times.record('other', 3)
+    crash_times.record('other', 30, crashed=False)
+
+    self.assertEqual(
+        {'job': [[seconds + 0.12, True]
+                 for seconds in range(1, crash_times.MAX_RECORDS + 1)],
+         'other': [[3, True], [30, False]]},
+        common.read_json(crash_times.CACHE_PATH))
@@ -0,0 +1,168 @@
+"""Test the 'job_types' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+
+import mock
+
+from clusterfuzz import common
+from clusterfuzz import job_types
+from error import error
+from test_libs import helpers
+
+
+JOB_TYPES_YAML = """
+presets:
+  chromium:
+    builder: Chromium
+    source: CHROMIUM_SRC
+    reproducer: Base
+  libfuzzer:
+    preset: chromium
+    reproducer: LibfuzzerJob
+chromium:
+  libfuzzer_chrome_asan:
+    preset: libfuzzer
+    sanitizer: ASAN
+standalone:
+  linux_asan_pdfium:
+    builder: Pdfium
+    source: PDFIUM_SRC
+    reproducer: Base
+"""
+
+
+class ParseJobDefinitionTest(helpers.ExtendedTestCase):
+  """Tests parse_job_definition."""
+
+  def test_nested_presets(self):
+    """Test that presets are resolved recursively and can be overridden."""
+    presets = {
+        'base': {'builder': 'Chromium', 'reproducer': 'Base'},
+        'libfuzzer': {'preset': 'base', 'reproducer': 'LibfuzzerJob'}}
+    self.assertEqual(
+        {'builder': 'Chromium', 'reproducer': 'LibfuzzerJob',
+         'sanitizer': 'ASAN'},
+        job_types.parse_job_definition(
+            {'preset': 'libfuzzer', 'sanitizer': 'ASAN'}, presets))
+
+
+class LoadTest(helpers.ExtendedTestCase):
+  """Tests load."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_load(self):
+    """Test resolving the presets of every job."""
+    self.fs.CreateFile('/job_types.yml', contents=JOB_TYPES_YAML)
+
+    self.assertEqual({
+        'chromium': {
+            'libfuzzer_chrome_asan': {
+                'builder': 'Chromium',
+                'source': 'CHROMIUM_SRC',
+                'reproducer': 'LibfuzzerJob',
+                'sanitizer': 'ASAN'}},
+        'standalone': {
+            'linux_asan_pdfium': {
+                'builder': 'Pdfium',
+                'source': 'PDFIUM_SRC',
+                'reproducer': 'Base'}}
+    }, job_types.load('/job_types.yml'))
+
+  def test_unknown_preset(self):
+    """Test raising when a job refers to a missing preset."""
+    self.fs.CreateFile(
+        '/job_types.yml',
+        contents=JOB_TYPES_YAML.replace('preset: libfuzzer', 'preset: afl'))
+
+    with self.assertRaises(error.BadJobTypeDefinitionError):
+      job_types.load('/job_types.yml')
+
+
+class LoadRealJobTypesTest(helpers.ExtendedTestCase):
+  """Tests load with the shipped job types."""
+
+  def test_real_job_types(self):
+    """Test that the shipped job types resolve."""
+    result = job_types.load(job_types.get_path())
+    self.assertEqual(
+        'Chromium', result['chromium']['libfuzzer_chrome_ubsan']['builder'])
+    self.assertIn('linux_asan_pdfium', result['standalone'])
+
+
+class GetTest(helpers.ExtendedTestCase):
+  """Tests get."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.common.get_version',
+        'clusterfuzz.job_types.get_path',
+        'clusterfuzz.job_types.load'])
+    patcher = mock.patch.dict(job_types.resolved, clear=True)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+    self.mock.get_version.return_value = '1.0'
+    self.mock.get_path.return_value = '/job_types.yml'
+    self.mock.load.return_value = {'chromium': {'job': {'builder': 'V8'}}}
+    self.fs.CreateFile('/job_types.yml', contents=JOB_TYPES_YAML)
+    os.utime('/job_types.yml', (100, 100))
+
+  def test_miss(self):
+    """Test parsing and caching the job types."""
+    self.assertEqual(self.mock.load.return_value, job_types.get())
+
+    self.mock.load.assert_called_once_with('/job_types.yml')
+    self.assertEqual(
+        {'key': {'mtime': 100, 'version': '1.0'},
+         'job_types': self.mock.load.return_value},
+        common.read_json(job_types.CACHE_PATH))
+
+  def test_hit(self):
+    """Test reading the job types from the cache in another process."""
+    job_types.get()
+    job_types.resolved.clear()
+    self.assertEqual(self.mock.load.return_value, job_types.get())
+
+    self.assertEqual(1, self.mock.load.call_count)
+
+  def test_resolved_once(self):
+    """Test reading the cache once per process."""
+    with mock.patch('clusterfuzz.common.read_json') as read_json:
+      read_json.return_value = None
+      first = job_types.get()
+      self.assertIs(first, job_types.get())
+    read_json.assert_called_once_with(job_types.CACHE_PATH)
+
+  def test_read_only(self):
+    """Test that the shared job types can't be changed."""
+    result = job_types.get()
+    with self.assertRaises(TypeError):
+      result['chromium']['job']['builder'] = 'Chromium'
+    with self.assertRaises(TypeError):
+      result.pop('chromium')
+    self.assertEqual('V8', result['chromium']['job']['builder'])
+
+  def test_changed(self):
+    """Test that the cache is invalidated when the file or the tool change."""
+    job_types.get()
+    os.utime('/job_types.yml', (200, 200))
+    job_types.get()
+    self.mock.get_version.return_value = '2.0'
+    job_types.get()
+
+    self.assertEqual(3, self.mock.load.call_count)
@@ -22,6 +22,8 @@ class StartLoggersTest(helpers.ExtendedTestCase):
   def test_start(self):
     """Test starting a logger."""
     rotating_handler = logging.handlers.RotatingFileHandler(filename='test.log')
+    rotating_handler.stream.write('previous run\n')
+    rotating_handler.stream.flush()
     self.mock.getLogger.return_value = (
         mock.Mock(handlers=[logging.NullHandler(), rotating_handler]))
 
@@ -30,3 +32,12 @@ class StartLoggersTest(helpers.ExtendedTestCase):
     self.mock.getLogger.assert_called_once_with('clusterfuzz')
     self.assertTrue(os.path.exists(local_logging.LOG_DIR))
     self.mock.doRollover.assert_called_once_with(rotating_handler)
+
+  def test_empty_log(self):
+    """Test that an empty log isn't rolled over."""
+    rotating_handler = logging.handlers.RotatingFileHandler(filename='test.log')
+    self.mock.getLogger.return_value = mock.Mock(handlers=[rotating_handler])
+
+    local_logging.start_loggers()
+
+    self.assertEqual(0, self.mock.doRollover.call_count)
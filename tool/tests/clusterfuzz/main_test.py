@@ -25,7 +25,15 @@ class MainTest(unittest.TestCase):
 
   def setUp(self):
     helpers.patch(self, [
+        ('export_execute', 'clusterfuzz.commands.export.execute'),
+        ('prefetch_execute', 'clusterfuzz.commands.prefetch.execute'),
+        ('out_dirs_execute', 'clusterfuzz.commands.out_dirs.execute'),
+        ('serve_execute', 'clusterfuzz.commands.serve.execute'),
+        'clusterfuzz.commands.serve.forward',
         'clusterfuzz.commands.reproduce.execute',
+        ('batch_execute', 'clusterfuzz.commands.reproduce_batch.execute'),
+        ('job_server_execute', 'clusterfuzz.commands.job_server.execute'),
+        ('worker_execute', 'clusterfuzz.commands.worker.execute'),
         'clusterfuzz.local_logging.start_loggers'
     ])
 
@@ -35,17 +43,89 @@ class MainTest(unittest.TestCase):
     main.execute(
         ['reproduce', '1234', '--disable-xvfb', '-j', '25', '--current',
          '--disable-goma', '-i', '500', '--target-args', '--test --test2',
-         '--edit-mode', '--disable-gclient', '--enable-debug', '-l', '20'])
+         '--edit-mode', '--disable-gclient', '--enable-debug', '-l', '20',
+         '--gn-check', '--worktree', '--bundle', 'b.zip'])
 
     self.mock.start_loggers.assert_has_calls([mock.call()])
     self.mock.execute.assert_has_calls([
         mock.call(build='chromium', current=False, disable_goma=False,
                   goma_threads=None, testcase_id='1234', iterations=3,
                   disable_xvfb=False, target_args='', edit_mode=False,
-                  disable_gclient=False, enable_debug=False, goma_load=None),
+                  disable_gclient=False, enable_debug=False, goma_load=None,
+                  gn_check=False, worktree=False, bundle_path=None),
         mock.call(build='chromium', current=True, disable_goma=True,
                   goma_threads=25, testcase_id='1234', iterations=500,
                   disable_xvfb=True, target_args='--test --test2',
                   edit_mode=True, disable_gclient=True, enable_debug=True,
-                  goma_load=20),
+                  goma_load=20, gn_check=True, worktree=True,
+                  bundle_path='b.zip'),
     ])
+
+  def test_parse_prefetch(self):
+    """Test parse prefetch command."""
+    main.execute(['prefetch', '1234', '5678'])
+    self.mock.prefetch_execute.assert_called_once_with(
+        testcase_ids=['1234', '5678'])
+
+  def test_parse_out_dirs(self):
+    """Test parse out-dirs command."""
+    main.execute(['out-dirs'])
+    main.execute(['out-dirs', '--prune', '30'])
+    self.mock.out_dirs_execute.assert_has_calls([
+        mock.call(prune=None), mock.call(prune=30)])
+
+  def test_parse_serve(self):
+    """Test parse serve command."""
+    main.execute(['serve'])
+    self.mock.serve_execute.assert_called_once_with()
+
+  def test_forward_reproduce(self):
+    """Test forwarding reproduce to the daemon with its exit code."""
+    self.mock.forward.return_value = 3
+    with self.assertRaises(SystemExit) as cm:
+      main.execute(['reproduce', '--daemon', '1234', '-i', '5'])
+
+    self.assertEqual(3, cm.exception.code)
+    self.mock.forward.assert_called_once_with(['reproduce', '1234', '-i', '5'])
+    self.assertEqual(0, self.mock.execute.call_count)
+
+  def test_parse_export(self):
+    """Test parse export command."""
+    main.execute(['export', '1234'])
+    main.execute(['export', '1234', '-o', 'out.zip'])
+    self.mock.export_execute.assert_has_calls([
+        mock.call(testcase_id='1234', output=None),
+        mock.call(testcase_id='1234', output='out.zip')])
+
+  def test_parse_reproduce_batch(self):
+    """Test parse reproduce-batch command."""
+    main.execute(['reproduce-batch', 'ids.txt', '--jobs', '8', '-b',
+                  'download', '-o', 'out.jsonl'])
+    self.mock.batch_execute.assert_called_once_with(
+        input_file='ids.txt', output='out.jsonl', jobs=8, build='download',
+        current=False, disable_goma=False, goma_threads=None, goma_load=None,
+        iterations=3, disable_xvfb=False, target_args='',
+        disable_gclient=False, gn_check=False, worktree=False)
+
+  def test_parse_reproduce_batch_without_output(self):
+    """Test requiring a results file, because stdout gets the logs."""
+    with self.assertRaises(SystemExit):
+      main.execute(['reproduce-batch', 'ids.txt'])
+    self.assertEqual(0, self.mock.batch_execute.call_count)
+
+  def test_parse_job_server(self):
+    """Test parse job-server command."""
+    main.execute(['job-server', 'ids.txt', '-o', 'out.jsonl', '--host',
+                  '0.0.0.0', '--port', '9000'])
+    self.mock.job_server_execute.assert_called_once_with(
+        input_file='ids.txt', output='out.jsonl', host='0.0.0.0', port=9000,
+        build='chromium', current=False, disable_goma=False,
+        goma_threads=None, goma_load=None, iterations=3, disable_xvfb=False,
+        target_args='', disable_gclient=False, gn_check=False,
+        worktree=False)
+
+  def test_parse_worker(self):
+    """Test parse worker command."""
+    main.execute(['worker', '--server', 'http://host:9000'])
+    self.mock.worker_execute.assert_called_once_with(
+        server='http://host:9000', worker_id=None)
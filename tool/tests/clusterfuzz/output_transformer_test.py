@@ -2,10 +2,55 @@
 
 import StringIO
 
+import mock
+
 from clusterfuzz import output_transformer
 from test_libs import helpers
 
 
+class BaseTest(helpers.ExtendedTestCase):
+  """Test the buffering in Base."""
+
+  def setUp(self):
+    helpers.patch(self, ['time.time'])
+    self.mock.time.return_value = 100
+    self.output = mock.Mock()
+    self.transformer = output_transformer.Base()
+    self.transformer.set_output(self.output)
+
+  def test_newline(self):
+    """Test sending the buffer on a newline."""
+    self.transformer.write('ab')
+    self.transformer.write('c')
+    self.assertTrue(self.transformer.has_pending_output())
+    self.assert_n_calls(0, [self.output.write])
+
+    self.transformer.write('d\ne')
+    self.assert_exact_calls(self.output.write, [mock.call('abcd\ne')])
+    self.assert_exact_calls(self.output.flush, [mock.call()])
+    self.assertFalse(self.transformer.has_pending_output())
+
+  def test_size(self):
+    """Test sending the buffer when it's big."""
+    self.transformer.write('a' * (output_transformer.FLUSH_SIZE - 1))
+    self.transformer.write('b')
+    self.assert_exact_calls(self.output.write, [
+        mock.call('a' * (output_transformer.FLUSH_SIZE - 1) + 'b')])
+
+  def test_interval(self):
+    """Test sending the buffer when it's old."""
+    self.transformer.write('a')
+    self.mock.time.return_value = 101
+    self.transformer.write('b')
+    self.assert_exact_calls(self.output.write, [mock.call('ab')])
+
+  def test_flush_output(self):
+    """Test sending the buffer explicitly, e.g. for a prompt."""
+    self.transformer.write('(gdb) ')
+    self.transformer.flush_output()
+    self.assert_exact_calls(self.output.write, [mock.call('(gdb) ')])
+
+
 class HiddenTest(helpers.ExtendedTestCase):
   """Test Hidden."""
 
@@ -41,19 +86,53 @@ class IdentityTest(helpers.ExtendedTestCase):
 class NinjaTest(helpers.ExtendedTestCase):
   """Test Ninja."""
 
-  def test_print(self):
-    """Test ninja output."""
+  def setUp(self):
+    helpers.patch(self, ['time.time'])
+    self.mock.time.return_value = 100
     self.output = StringIO.StringIO()
+    self.transformer = output_transformer.Ninja(interval=1, width=20)
+    self.transformer.set_output(self.output)
 
-    transformer = output_transformer.Ninja()
-    transformer.set_output(self.output)
-    transformer.process('aaaaa\n')
-    transformer.process('bbb')
-    transformer.process('\nccc')
-    transformer.process('c\ndddddd')
-    transformer.flush()
+  def tearDown(self):
+    self.output.close()
+
+  def test_progress(self):
+    """Test replacing the progress line."""
+    self.transformer.process('[1/4] CXX obj/a.o\n[2/4')
+    self.mock.time.return_value = 101
+    self.transformer.process('] CC b.o\n')
+    self.transformer.flush()
 
     self.assertEqual(
-        'aaaaa\b\b\b\b\bbbb  \b\b\b\b\bcccc \b\b\b\b\bdddddd\n',
+        '\r[1/4] 25% CXX obj/a.\r[2/4] 50% CC b.o    \n',
         self.output.getvalue())
-    self.output.close()
+
+  def test_throttle(self):
+    """Test skipping the progress updates within the interval."""
+    self.transformer.process('[1/3] a\n')
+    self.transformer.process('[2/3] b\n')
+    self.mock.time.return_value = 100.5
+    self.transformer.process('[3/3] c\n')
+    self.assertEqual('\r[1/3] 33% a', self.output.getvalue())
+
+    self.transformer.flush()
+    self.assertEqual(
+        '\r[1/3] 33% a\r[3/3] 100% c\n', self.output.getvalue())
+
+  def test_other_lines(self):
+    """Test printing the other lines in full above the progress."""
+    self.transformer.process('[1/2] CXX a.o\n')
+    self.transformer.process('FAILED: a.o\nerror: a very long message\n')
+    self.transformer.flush()
+
+    self.assertEqual(
+        '\r[1/2] 50% CXX a.o\r' + ' ' * 17 + '\rFAILED: a.o\n'
+        'error: a very long message\n\r[1/2] 50% CXX a.o\n',
+        self.output.getvalue())
+
+  def test_no_progress(self):
+    """Test printing the residue without progress."""
+    self.transformer.process('ninja: no work to do.')
+    self.transformer.flush()
+
+    self.assertEqual('ninja: no work to do.\n', self.output.getvalue())
@@ -0,0 +1,271 @@
+"""Tests process_tree."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import signal
+
+import mock
+import psutil
+
+from clusterfuzz import process_tree
+from test_libs import helpers
+
+
+CGROUP_ROOT = '/sys/fs/cgroup/user.slice'
+CGROUP_PATH = os.path.join(CGROUP_ROOT, 'clusterfuzz')
+
+
+class GetCgroupRootTest(helpers.ExtendedTestCase):
+  """Tests get_cgroup_root."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.fs.CreateFile(process_tree.SELF_CGROUP_PATH,
+                       contents='0::/user.slice\n')
+
+  def test_cgroup2(self):
+    """Test getting the cgroup of this process."""
+    self.fs.CreateFile(process_tree.MOUNTS_PATH, contents=(
+        'proc /proc proc rw 0 0\n'
+        'cgroup2 /sys/fs/cgroup cgroup2 rw 0 0\n'))
+    self.assertEqual(CGROUP_ROOT, process_tree.get_cgroup_root())
+
+  def test_no_cgroup2(self):
+    """Test returning None without cgroup v2."""
+    self.fs.CreateFile(process_tree.MOUNTS_PATH, contents=(
+        'cgroup /sys/fs/cgroup/memory cgroup rw,memory 0 0\n'))
+    self.assertIsNone(process_tree.get_cgroup_root())
+
+
+class ProcessTreeTest(helpers.ExtendedTestCase):
+  """Tests the sampling of ProcessTree."""
+
+  def setUp(self):
+    self.tree = process_tree.ProcessTree(memory_limit=100)
+    self.tree.get_memory = mock.Mock()
+    self.tree.get_cpu_time = mock.Mock(return_value=1.5)
+    self.tree.get_pids = mock.Mock(return_value=[])
+
+  def test_check_limits(self):
+    """Test keeping the peak memory, and checking the limit."""
+    self.tree.get_memory.side_effect = [80, 50, 120]
+    self.tree.get_pids.side_effect = [[1], [1, 2], [1, 3]]
+    self.assertFalse(self.tree.check_limits())
+    self.assertFalse(self.tree.check_limits())
+    self.assertEqual(80, self.tree.get_peak_memory())
+    self.assertTrue(self.tree.check_limits())
+    self.assertEqual(process_tree.Usage(120, 1.5, 3), self.tree.get_usage())
+
+  def test_no_limit(self):
+    """Test never stopping without a memory limit."""
+    self.tree.memory_limit = None
+    self.tree.get_memory.return_value = 1000
+    self.assertFalse(self.tree.check_limits())
+
+
+class CgroupTreeTest(helpers.ExtendedTestCase):
+  """Tests CgroupTree."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    self.fs.CreateDirectory(CGROUP_ROOT)
+    helpers.patch(self, ['os.kill', 'os.killpg'])
+
+  def create_tree(self, memory_limit=None, cpu_limit=None):
+    """Create a tree, and the files that the kernel would create."""
+    original_mkdir = os.mkdir
+
+    def mkdir(path):
+      original_mkdir(path)
+      for name in ['cgroup.procs', 'cgroup.freeze', 'cpu.max', 'memory.max']:
+        self.fs.CreateFile(os.path.join(path, name))
+      self.fs.CreateFile(os.path.join(path, 'cgroup.events'),
+                         contents='populated 1\nfrozen 0\n')
+      self.fs.CreateFile(os.path.join(path, 'cpu.stat'),
+                         contents='usage_usec 2500000\nuser_usec 2000000\n')
+
+    with mock.patch('clusterfuzz.process_tree.os.mkdir', side_effect=mkdir):
+      return process_tree.CgroupTree(CGROUP_PATH, memory_limit, cpu_limit)
+
+  def read(self, name):
+    with open(os.path.join(CGROUP_PATH, name)) as f:
+      return f.read()
+
+  def test_limits(self):
+    """Test setting the limits."""
+    self.create_tree(memory_limit=1024, cpu_limit=2)
+    self.assertEqual('1024', self.read('memory.max'))
+    self.assertEqual('200000 100000', self.read('cpu.max'))
+
+  def test_disabled_controller(self):
+    """Test not setting the limit of a disabled controller."""
+    process_tree.CgroupTree(CGROUP_PATH, memory_limit=1024)
+    self.assertFalse(os.path.exists(os.path.join(CGROUP_PATH, 'memory.max')))
+
+  def test_preexec(self):
+    """Test moving the child into the cgroup."""
+    tree = self.create_tree()
+    with mock.patch('os.getpid', return_value=1234), \
+         mock.patch('os.setsid') as setsid:
+      tree.preexec()
+    self.assertEqual('1234', self.read('cgroup.procs'))
+    setsid.assert_called_once_with()
+
+  def test_usage(self):
+    """Test reading the memory and CPU usage, and counting the processes."""
+    tree = self.create_tree()
+    with open(os.path.join(CGROUP_PATH, 'cgroup.procs'), 'w') as f:
+      f.write('1234\n1240\n')
+    self.fs.CreateFile(os.path.join(CGROUP_PATH, 'memory.current'),
+                       contents='2048\n')
+    self.fs.CreateFile(os.path.join(CGROUP_PATH, 'memory.peak'),
+                       contents='4096\n')
+    self.assertFalse(tree.check_limits())
+    self.assertEqual(process_tree.Usage(4096, 2.5, 2), tree.get_usage())
+
+  def test_kill(self):
+    """Test killing with cgroup.kill."""
+    tree = self.create_tree()
+    self.fs.CreateFile(os.path.join(CGROUP_PATH, 'cgroup.kill'))
+    tree.start(1234)
+    tree.kill()
+
+    self.assertEqual('1', self.read('cgroup.kill'))
+    self.assertEqual(0, self.mock.kill.call_count)
+    self.mock.killpg.assert_called_once_with(1234, signal.SIGKILL)
+
+  def test_kill_frozen(self):
+    """Test freezing the cgroup to kill it without cgroup.kill."""
+    tree = self.create_tree()
+    tree.freeze = mock.Mock()
+    tree.start(1234)
+    with open(os.path.join(CGROUP_PATH, 'cgroup.procs'), 'w') as f:
+      f.write('1234\n1240\n')
+    self.mock.kill.side_effect = [None, OSError()]
+    tree.kill()
+
+    self.assert_exact_calls(tree.freeze, [mock.call(True), mock.call(False)])
+    self.assert_exact_calls(self.mock.kill, [
+        mock.call(1234, signal.SIGKILL), mock.call(1240, signal.SIGKILL)])
+    self.mock.killpg.assert_called_once_with(1234, signal.SIGKILL)
+
+  def test_close(self):
+    """Test killing the processes that are left, and removing the cgroup."""
+    tree = self.create_tree()
+    tree.kill_processes = mock.Mock()
+    with open(os.path.join(CGROUP_PATH, 'cgroup.events'), 'w') as f:
+      f.write('populated 0\nfrozen 0\n')
+    with mock.patch('clusterfuzz.process_tree.os.rmdir') as rmdir:
+      tree.close()
+
+    tree.kill_processes.assert_called_once_with()
+    rmdir.assert_called_once_with(CGROUP_PATH)
+    self.assertEqual(0, self.mock.killpg.call_count)
+
+
+class TrackedTreeTest(helpers.ExtendedTestCase):
+  """Tests TrackedTree."""
+
+  def setUp(self):
+    helpers.patch(self, ['psutil.Process'])
+    self.command = self.create_process(1, 1.0)
+    self.child = self.create_process(2, 0.5)
+    self.grandchild = self.create_process(3, 0.25)
+    self.command.children.return_value = [self.child, self.grandchild]
+    self.child.children.return_value = [self.grandchild]
+    self.grandchild.children.return_value = []
+    self.mock.Process.side_effect = lambda pid: {
+        1: self.command, 2: self.child, 3: self.grandchild}[pid]
+
+    self.tree = process_tree.TrackedTree(memory_limit=1000)
+    self.tree.start(1)
+
+  def create_process(self, pid, cpu_time):
+    process = mock.Mock(pid=pid)
+    process.cpu_times.return_value = mock.Mock(
+        user=cpu_time / 2, system=cpu_time / 2)
+    process.memory_info.return_value = mock.Mock(rss=pid * 100)
+    return process
+
+  def test_usage(self):
+    """Test summing the usage of the descendants."""
+    self.assertEqual(600, self.tree.get_memory())
+    self.assertEqual(1.75, self.tree.get_cpu_time())
+    self.assertEqual([1, 2, 3], sorted(self.tree.get_pids()))
+
+  def test_exited(self):
+    """Test keeping the CPU time of a process that exited."""
+    self.tree.update()
+    self.child.cpu_times.side_effect = psutil.NoSuchProcess(2)
+    self.child.memory_info.side_effect = psutil.NoSuchProcess(2)
+    self.assertEqual(1.75, self.tree.get_cpu_time())
+    self.assertEqual(400, self.tree.get_memory())
+
+  def test_orphan(self):
+    """Test tracking the descendants of a process whose parent exited."""
+    self.tree.update()
+    self.command.children.side_effect = psutil.NoSuchProcess(1)
+    new_process = self.create_process(4, 0)
+    self.grandchild.children.return_value = [new_process]
+    self.tree.update()
+    self.assertIn(4, self.tree.processes)
+
+  def test_kill(self):
+    """Test stopping every process before killing them."""
+    self.tree.kill()
+    for process in [self.command, self.child, self.grandchild]:
+      self.assert_exact_calls(process.send_signal, [
+          mock.call(signal.SIGSTOP), mock.call(signal.SIGKILL)])
+
+
+class CreateTest(helpers.ExtendedTestCase):
+  """Tests create."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.process_tree.CgroupTree',
+        'clusterfuzz.process_tree.enable_controllers',
+        'clusterfuzz.process_tree.get_cgroup_root',
+        'os.access',
+        'os.getpid',
+    ])
+    self.mock.get_cgroup_root.return_value = CGROUP_ROOT
+    self.mock.getpid.return_value = 1234
+
+  def test_cgroup(self):
+    """Test creating a cgroup."""
+    self.mock.access.return_value = True
+    tree = process_tree.create(memory_limit=100, cpu_limit=2)
+
+    self.assertEqual(self.mock.CgroupTree.return_value, tree)
+    self.mock.enable_controllers.assert_called_once_with(CGROUP_ROOT)
+    path, memory_limit, cpu_limit = self.mock.CgroupTree.call_args[0]
+    self.assertTrue(path.startswith(CGROUP_ROOT + '/clusterfuzz-1234-'))
+    self.assertEqual((100, 2), (memory_limit, cpu_limit))
+
+  def test_not_delegated(self):
+    """Test tracking the processes when cgroups aren't delegated."""
+    self.mock.access.return_value = False
+    tree = process_tree.create(memory_limit=100)
+
+    self.assertIsInstance(tree, process_tree.TrackedTree)
+    self.assertEqual(100, tree.memory_limit)
+    self.assertEqual(0, self.mock.CgroupTree.call_count)
+
+  def test_error(self):
+    """Test tracking the processes when creating the cgroup fails."""
+    self.mock.access.return_value = True
+    self.mock.CgroupTree.side_effect = OSError()
+    self.assertIsInstance(process_tree.create(), process_tree.TrackedTree)
@@ -16,9 +16,11 @@
 import os
 import json
 import mock
+import psutil
 
 from clusterfuzz import common
 from clusterfuzz import output_transformer
+from clusterfuzz import process_tree
 from clusterfuzz import reproducers
 from error import error
 from tests import libs
@@ -42,8 +44,10 @@ def create_reproducer(klass):
   binary_provider = mock.Mock(symbolizer_path='/path/to/symbolizer')
   binary_provider.get_binary_path.return_value = '/fake/build_dir/test_binary'
   binary_provider.get_build_directory.return_value = '/fake/build_dir'
-  testcase = mock.Mock(gestures=None, stacktrace_lines=[{'content': 'line'}],
-                       job_type='job_type', reproduction_args='--original')
+  testcase = mock.Mock(gestures=None,
+                       stacktrace=mock.Mock(first_stacktrace=['line']),
+                       job_type='job_type', reproduction_args='--original',
+                       crash_signature=None)
   reproducer = klass(
       definition=mock.Mock(),
       binary_provider=binary_provider,
@@ -81,8 +85,9 @@ class SetUpSymbolizersSuppressionsTest(helpers.ExtendedTestCase):
 
     self.binary_provider = mock.Mock()
     self.definition = mock.Mock()
-    self.testcase = mock.Mock(gestures=None, stacktrace_lines=[
-        {'content': 'line'}], job_type='job_type', reproduction_args='--orig')
+    self.testcase = mock.Mock(
+        gestures=None, stacktrace=mock.Mock(first_stacktrace=['line']),
+        job_type='job_type', reproduction_args='--orig', crash_signature=None)
     self.reproducer = reproducers.BaseReproducer(
         self.definition, self.binary_provider, self.testcase, 'UBSAN',
         libs.make_options(target_args='--test'))
@@ -152,7 +157,12 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
         'clusterfuzz.reproducers.Xvfb.__exit__',
         'clusterfuzz.common.get_resource',
         'clusterfuzz.reproducers.LinuxChromeJobReproducer.post_run_symbolize',
+        'clusterfuzz.reproducers.BaseReproducer.create_process_tree',
+        'clusterfuzz.common.OutputBuffer',
     ])
+    self.tree = self.mock.create_process_tree.return_value
+    self.output_buffer = self.mock.OutputBuffer.return_value
+    self.tree.get_usage.return_value = process_tree.Usage(1024 * 1024, 1.5, 2)
     self.mock.get_resource.return_value = (
         '/chrome/source/folder/llvm-symbolizer')
     self.mock.wait_execute.return_value = (0, 'lines')
@@ -168,8 +178,8 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
     mocked_testcase = mock.Mock(
         id=1234, reproduction_args='--repro',
         environment={'ASAN_OPTIONS': 'test-asan'}, gestures=None,
-        stacktrace_lines=[{'content': 'line'}],
-        job_type='job_type')
+        stacktrace=mock.Mock(first_stacktrace=['line']),
+        job_type='job_type', crash_signature=None)
     mocked_testcase.get_testcase_path.return_value = self.testcase_path
     mocked_provider = mock.Mock(
         symbolizer_path='%s/llvm-symbolizer' % self.app_directory)
@@ -192,8 +202,13 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
             stdout_transformer=mock.ANY,
             redirect_stderr_to_stdout=True,
             stdin=self.mock.UserStdin.return_value,
-            read_buffer_length=1)
+            read_buffer_length=1,
+            output_buffer=self.output_buffer,
+            crash_detector=mock.ANY, idle_detector=mock.ANY,
+            process_tree=self.tree)
     ])
+    self.tree.close.assert_called_once_with()
+    self.output_buffer.close.assert_called_once_with()
 
   def test_base_with_env_args(self):
     """Test base's reproduce_crash with environment args."""
@@ -201,8 +216,8 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
     mocked_testcase = mock.Mock(
         id=1234, reproduction_args='--app-dir=%APP_DIR% --testcase=%TESTCASE%',
         environment={'ASAN_OPTIONS': 'test-asan'}, gestures=None,
-        stacktrace_lines=[{'content': 'line'}],
-        job_type='job_type')
+        stacktrace=mock.Mock(first_stacktrace=['line']),
+        job_type='job_type', crash_signature=None)
     mocked_testcase.get_testcase_path.return_value = self.testcase_path
     mocked_provider = mock.Mock(
         symbolizer_path='%s/llvm-symbolizer' % self.app_directory)
@@ -226,8 +241,13 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
             stdout_transformer=mock.ANY,
             redirect_stderr_to_stdout=True,
             stdin=self.mock.UserStdin.return_value,
-            read_buffer_length=1)
+            read_buffer_length=1,
+            output_buffer=self.output_buffer,
+            crash_detector=mock.ANY, idle_detector=mock.ANY,
+            process_tree=self.tree)
     ])
+    self.tree.close.assert_called_once_with()
+    self.output_buffer.close.assert_called_once_with()
 
   def test_chromium(self):
     """Test chromium's reproduce_crash."""
@@ -237,8 +257,8 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
     mocked_testcase = mock.Mock(
         id=1234, reproduction_args='--repro',
         environment={'ASAN_OPTIONS': 'test-asan'}, gestures=None,
-        stacktrace_lines=[{'content': 'line'}],
-        job_type='job_type')
+        stacktrace=mock.Mock(first_stacktrace=['line']),
+        job_type='job_type', crash_signature=None)
     mocked_testcase.get_testcase_path.return_value = self.testcase_path
     mocked_provider = mock.Mock(
         symbolizer_path='%s/llvm-symbolizer' % self.app_directory)
@@ -263,19 +283,114 @@ class ReproduceCrashTest(helpers.ExtendedTestCase):
                 'ASAN_OPTIONS': 'test-asan',
             },
             redirect_stderr_to_stdout=True,
-            stdin=self.mock.UserStdin.return_value)
+            stdin=self.mock.UserStdin.return_value,
+            process_tree=self.tree)
     ])
+    self.tree.close.assert_called_once_with()
     self.assert_exact_calls(self.mock.wait_execute, [
         mock.call(
             self.mock.start_execute.return_value, exit_on_error=False,
             timeout=30,
             stdout_transformer=mock.ANY,
-            read_buffer_length=1)
+            read_buffer_length=1,
+            output_buffer=self.output_buffer,
+            crash_detector=mock.ANY, idle_detector=mock.ANY)
     ])
+    self.output_buffer.close.assert_called_once_with()
     self.assert_exact_calls(self.mock.run_gestures, [mock.call(
         reproducer, self.mock.start_execute.return_value, ':display')])
 
 
+class ProcessTreeTest(helpers.ExtendedTestCase):
+  """Tests create_process_tree and close_process_tree."""
+
+  def setUp(self):
+    patch_stacktrace_info(self)
+    helpers.patch(self, [
+        'clusterfuzz.process_tree.create',
+        'psutil.cpu_count',
+        'psutil.virtual_memory',
+    ])
+    self.mock.cpu_count.return_value = 8
+    self.mock.virtual_memory.return_value = mock.Mock(total=1000)
+    self.reproducer = create_reproducer(reproducers.BaseReproducer)
+
+  def test_create(self):
+    """Test leaving memory and a CPU to the rest of the machine."""
+    self.assertEqual(
+        self.mock.create.return_value, self.reproducer.create_process_tree())
+    self.mock.create.assert_called_once_with(memory_limit=800, cpu_limit=7)
+
+  def test_create_debug(self):
+    """Test not running gdb in a process tree."""
+    self.reproducer.options.enable_debug = True
+    self.assertIsNone(self.reproducer.create_process_tree())
+    self.assertEqual(0, self.mock.create.call_count)
+
+  def test_close(self):
+    """Test reporting the usage before closing the tree."""
+    tree = mock.Mock()
+    tree.get_usage.return_value = process_tree.Usage(3 * 1024 * 1024, 2.5, 4)
+    tree.close.side_effect = lambda: tree.get_usage.assert_called_once_with()
+    self.reproducer.close_process_tree(tree)
+    tree.close.assert_called_once_with()
+
+
+class GetDetectorsTest(helpers.ExtendedTestCase):
+  """Tests get_detectors."""
+
+  def setUp(self):
+    patch_stacktrace_info(self)
+    self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
+
+  def test_detectors(self):
+    """Test detecting the crash report and the hangs."""
+    crash_detector, idle_detector = self.reproducer.get_detectors()
+    self.assertIsInstance(crash_detector, common.CrashReportDetector)
+    self.assertIsInstance(idle_detector, reproducers.IdleDetector)
+
+  def test_gestures(self):
+    """Test not detecting hangs while the target waits for gestures."""
+    self.reproducer.gestures = ['type,abc']
+    crash_detector, idle_detector = self.reproducer.get_detectors()
+    self.assertIsInstance(crash_detector, common.CrashReportDetector)
+    self.assertIsNone(idle_detector)
+
+  def test_debug(self):
+    """Test not stopping gdb."""
+    self.reproducer.options.enable_debug = True
+    self.assertEqual((None, None), self.reproducer.get_detectors())
+
+
+class RecordCrashTimeTest(helpers.ExtendedTestCase):
+  """Tests record_crash_time."""
+
+  def setUp(self):
+    patch_stacktrace_info(self)
+    helpers.patch(self, ['clusterfuzz.crash_times.record', 'time.time'])
+    self.mock.time.return_value = 130
+    self.reproducer = create_reproducer(reproducers.BaseReproducer)
+    self.reproducer.timeout = 30
+    self.detector = mock.Mock(report_time=None)
+
+  def test_crashed(self):
+    """Test recording the time of the crash report."""
+    self.detector.report_time = 105
+    self.reproducer.record_crash_time(self.detector, 100)
+    self.mock.record.assert_called_once_with('job_type', 5)
+
+  def test_timed_out(self):
+    """Test recording a run that timed out."""
+    self.reproducer.record_crash_time(self.detector, 100)
+    self.mock.record.assert_called_once_with('job_type', 30, crashed=False)
+
+  def test_exited(self):
+    """Test not recording a run that exited before its timeout."""
+    self.reproducer.record_crash_time(self.detector, 110)
+    self.reproducer.record_crash_time(None, 100)
+    self.assertEqual(0, self.mock.record.call_count)
+
+
 class SetupArgsTest(helpers.ExtendedTestCase):
   """Test setup_args."""
 
@@ -287,8 +402,8 @@ class SetupArgsTest(helpers.ExtendedTestCase):
     self.testcase = mock.Mock(
         id=1234, reproduction_args='--repro',
         environment={'ASAN_OPTIONS': 'test-asan'}, gestures=None,
-        stacktrace_lines=[{'content': 'line'}],
-        job_type='job_type')
+        stacktrace=mock.Mock(first_stacktrace=['line']),
+        job_type='job_type', crash_signature=None)
     self.testcase_path = os.path.expanduser(
         os.path.join('~', '.clusterfuzz', '1234_testcase', 'testcase.js'))
     self.testcase.get_testcase_path.return_value = self.testcase_path
@@ -335,6 +450,86 @@ class SetupArgsTest(helpers.ExtendedTestCase):
         reproducer.args, prefix=mock.ANY, comment=mock.ANY,
         should_edit=reproducer.options.edit_mode)
 
+  def test_adaptive_timeout(self):
+    """Test using the timeout derived from the previous crash times."""
+    helpers.patch(self, ['clusterfuzz.crash_times.get_timeout'])
+    self.mock.get_timeout.return_value = 12
+    self.testcase.crash_signature = common.CrashSignature('type', ['a'])
+    reproducer = reproducers.BaseReproducer(
+        self.definition, self.provider, self.testcase, 'UBSAN',
+        libs.make_options())
+
+    reproducer.setup_args()
+    self.assertEqual(12, reproducer.timeout)
+    self.mock.get_timeout.assert_called_once_with(
+        'job_type', reproducers.TEST_TIMEOUT)
+
+
+class GetCpuTimeTest(helpers.ExtendedTestCase):
+  """Tests get_cpu_time."""
+
+  def setUp(self):
+    helpers.patch(self, ['psutil.Process'])
+    self.child = mock.Mock()
+    self.child.cpu_times.return_value = mock.Mock(user=1.0, system=0.5)
+    self.exited_child = mock.Mock()
+    self.exited_child.cpu_times.side_effect = psutil.NoSuchProcess(2)
+    self.mock.Process.return_value.cpu_times.return_value = mock.Mock(
+        user=2.0, system=0.25)
+    self.mock.Process.return_value.children.return_value = [
+        self.child, self.exited_child]
+
+  def test_tree(self):
+    """Test adding up the CPU time of the process tree."""
+    self.assertEqual(3.75, reproducers.get_cpu_time(1))
+    self.mock.Process.return_value.children.assert_called_once_with(
+        recursive=True)
+
+  def test_exited(self):
+    """Test a process that has exited."""
+    self.mock.Process.side_effect = psutil.NoSuchProcess(1)
+    self.assertIsNone(reproducers.get_cpu_time(1))
+
+
+class IdleDetectorTest(helpers.ExtendedTestCase):
+  """Tests IdleDetector."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.reproducers.get_cpu_time', 'time.time'])
+    self.mock.time.return_value = 0
+    self.detector = reproducers.IdleDetector(idle_timeout=10, interval=1)
+
+  def sample(self, now, cpu_time):
+    """Return is_idle at the time with the CPU time."""
+    self.mock.time.return_value = now
+    self.mock.get_cpu_time.return_value = cpu_time
+    return self.detector.is_idle(1234)
+
+  def test_idle(self):
+    """Test a target that neither prints nor uses the CPU."""
+    self.assertFalse(self.sample(1, 5))
+    self.assertFalse(self.sample(9, 5.01))
+    self.assertTrue(self.sample(10, 5.01))
+
+  def test_busy(self):
+    """Test a target that uses the CPU without printing."""
+    self.assertFalse(self.sample(1, 5))
+    self.assertFalse(self.sample(8, 6))
+    self.assertFalse(self.sample(17, 6))
+    self.assertTrue(self.sample(18, 6))
+
+  def test_printing(self):
+    """Test a target that prints without using the CPU."""
+    self.mock.time.return_value = 8
+    self.detector.record_output()
+    self.assertFalse(self.sample(12, 5))
+    self.assertTrue(self.sample(18, 5))
+
+  def test_exited(self):
+    """Test that a target that has exited isn't idle."""
+    self.assertFalse(self.sample(20, None))
+
+
 class LinuxChromeJobReproducerTest(helpers.ExtendedTestCase):
   """Tests the extra functions of LinuxUbsanChromeReproducer."""
 
@@ -348,7 +543,8 @@ class LinuxChromeJobReproducerTest(helpers.ExtendedTestCase):
     ])
     self.mock.get_resource.return_value = 'llvm'
     self.mock.ensure_user_data_dir_if_needed.side_effect = (
-        lambda args, require_user_data_dir: args + ' --test-user-data-dir')
+        lambda args, require_user_data_dir, testcase_id: (
+            args + ' --test-user-data-dir'))
     self.mock.update_testcase_path_in_layout_test.return_value = '/new-path'
     patch_stacktrace_info(self)
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
@@ -365,7 +561,7 @@ class LinuxChromeJobReproducerTest(helpers.ExtendedTestCase):
     self.assertEqual(
         self.reproducer.args, '--always-opt --test-user-data-dir')
     self.mock.ensure_user_data_dir_if_needed.assert_called_once_with(
-        '--always-opt', False)
+        '--always-opt', False, self.reproducer.testcase_id)
     self.mock.update_testcase_path_in_layout_test.assert_called_once_with(
         '/fake/testcase_dir/testcase', '/fake/LayoutTests/testcase',
         '/fake/source_dir')
@@ -716,7 +912,7 @@ class PostRunSymbolizeTest(helpers.ExtendedTestCase):
         'clusterfuzz.common.execute',
         'clusterfuzz.common.get_resource',
         'clusterfuzz.common.StringStdin',
-        'clusterfuzz.reproducers.LinuxChromeJobReproducer.get_stacktrace_info'
+        'clusterfuzz.reproducers.get_original_crash_signature'
     ])
     self.reproducer = create_reproducer(reproducers.LinuxChromeJobReproducer)
     self.reproducer.source_directory = '/path/to/chromium'
@@ -753,39 +949,6 @@ class PostRunSymbolizeTest(helpers.ExtendedTestCase):
     self.assertEqual(result, 'symbolized')
 
 
-class StripHtmlTest(helpers.ExtendedTestCase):
-  """Test strip_html."""
-
-  def test_strip_html(self):
-    """Test strip <a> tag."""
-    self.assertEqual(
-        ['aa test &'],
-        reproducers.strip_html(['aa <a href="sadfsd">test</a> &amp;']))
-
-
-class GetOnlyFirstStacktraceTest(helpers.ExtendedTestCase):
-  """Test get_only_first_stacktrace."""
-
-  def test_one_trace(self):
-    """Test having only one trace."""
-    self.assertEqual(
-        ['aa', 'bb'],
-        reproducers.get_only_first_stacktrace(['  ', 'aa  ', 'bb']))
-
-  def test_unsymbolized_stacktrace(self):
-    """Test unsymbolized stacktrace."""
-    self.assertEqual(
-        ['+------- fake trace ----+', 'aa', 'bb'],
-        reproducers.get_only_first_stacktrace([
-            '   ',
-            '+------- fake trace ----+',
-            'aa',
-            'bb',
-            '+------Release Build Unsymbolized Stacktrace (diff)------+',
-            'cc'
-        ]))
-
-
 class LibfuzzerJobReproducerPreBuildStepsTest(helpers.ExtendedTestCase):
   """Test Libfuzzer.pre_build_steps."""
 
@@ -887,29 +1050,38 @@ class EnsureUserDataDirIfNeededTest(helpers.ExtendedTestCase):
 
   def setUp(self):
     self.setup_fake_filesystem()
-    os.makedirs(reproducers.USER_DATA_DIR_PATH)
-    self.assertTrue(os.path.exists(reproducers.USER_DATA_DIR_PATH))
+    self.user_data_dir = '%s-1234' % reproducers.USER_DATA_DIR_PATH
+    os.makedirs(self.user_data_dir)
+    self.assertTrue(os.path.exists(self.user_data_dir))
 
   def test_doing_nothing(self):
     """Test doing nothing."""
     self.assertEqual(
         '--something',
-        reproducers.ensure_user_data_dir_if_needed('--something', False))
+        reproducers.ensure_user_data_dir_if_needed('--something', False, 1234))
 
   def test_add_because_it_should(self):
     """Test adding arg because it should have."""
     self.assertEqual(
-        '--something --user-data-dir=%s' % reproducers.USER_DATA_DIR_PATH,
-        reproducers.ensure_user_data_dir_if_needed('--something', True))
-    self.assertFalse(os.path.exists(reproducers.USER_DATA_DIR_PATH))
+        '--something --user-data-dir=%s' % self.user_data_dir,
+        reproducers.ensure_user_data_dir_if_needed('--something', True, 1234))
+    self.assertFalse(os.path.exists(self.user_data_dir))
 
   def test_add_because_of_previous_args(self):
     """Test replacing arg because it exists."""
     self.assertEqual(
-        '--something  --user-data-dir=%s' % reproducers.USER_DATA_DIR_PATH,
+        '--something  --user-data-dir=%s' % self.user_data_dir,
         reproducers.ensure_user_data_dir_if_needed(
-            '--something --user-data-dir=/tmp/random', False))
-    self.assertFalse(os.path.exists(reproducers.USER_DATA_DIR_PATH))
+            '--something --user-data-dir=/tmp/random', False, 1234))
+    self.assertFalse(os.path.exists(self.user_data_dir))
+
+  def test_per_testcase(self):
+    """Test not sharing the user-data-dir with another testcase."""
+    self.assertEqual(
+        '--something --user-data-dir=%s-5678' % (
+            reproducers.USER_DATA_DIR_PATH),
+        reproducers.ensure_user_data_dir_if_needed('--something', True, 5678))
+    self.assertTrue(os.path.exists(self.user_data_dir))
 
 
 class UpdateTestcasePathInLayoutTestTest(helpers.ExtendedTestCase):
@@ -29,7 +29,7 @@ class TestSendLog(helpers.ExtendedTestCase):
   def setUp(self):
     self.mock_os_environment({'USER': 'name'})
     helpers.patch(self, [
-        'clusterfuzz.stackdriver_logging.ServiceAccountCredentials',
+        'oauth2client.service_account.ServiceAccountCredentials',
         'httplib2.Http',
         'clusterfuzz.stackdriver_logging.get_session_id',
     ])
@@ -233,7 +233,11 @@ class SendSuccessFailureTest(helpers.ExtendedTestCase):
   """Test send_failure and send_success."""
 
   def setUp(self):
-    helpers.patch(self, ['clusterfuzz.stackdriver_logging.send_log'])
+    helpers.patch(self, [
+        'clusterfuzz.common.resource_account.get_totals',
+        'clusterfuzz.stackdriver_logging.send_log',
+    ])
+    self.mock.get_totals.return_value = {'d8': {'count': 1}}
 
   def test_send_failure(self):
     """Test send failure."""
@@ -241,10 +245,12 @@ class SendSuccessFailureTest(helpers.ExtendedTestCase):
     stackdriver_logging.send_failure(exception, 'trace', {'test': 'yes'})
     self.mock.send_log.assert_called_once_with(
         {'test': 'yes', 'exception': 'ExpectedException', 'success': False,
-         'extras': {'a': 'b'}},
+         'extras': {'a': 'b'}, 'resource_usage': {'d8': {'count': 1}}},
         'trace')
 
   def test_send_success(self):
     """Test send success."""
     stackdriver_logging.send_success({'test': 'yes'})
-    self.mock.send_log.assert_called_once_with({'test': 'yes', 'success': True})
+    self.mock.send_log.assert_called_once_with(
+        {'test': 'yes', 'success': True,
+         'resource_usage': {'d8': {'count': 1}}})
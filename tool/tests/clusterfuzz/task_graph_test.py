@@ -0,0 +1,108 @@
+"""Tests task_graph."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import threading
+
+import mock
+
+from clusterfuzz import task_graph
+from test_libs import helpers
+
+
+class RunTest(helpers.ExtendedTestCase):
+  """Tests TaskGraph.run."""
+
+  def setUp(self):
+    self.graph = task_graph.TaskGraph('test')
+
+  def test_results(self):
+    """Test passing the results of the dependencies to a task."""
+    self.graph.add('a', lambda: 2)
+    self.graph.add('b', lambda: 3)
+    self.graph.add('c', lambda a, b: a * b, deps=['a', 'b'])
+    self.assertEqual({'a': 2, 'b': 3, 'c': 6}, self.graph.run())
+
+  def test_concurrent(self):
+    """Test running the independent tasks at the same time."""
+    # Each task waits for the other one; therefore, they can only finish
+    # together.
+    barrier = [threading.Event(), threading.Event()]
+
+    def wait(index):
+      barrier[index].set()
+      return barrier[1 - index].wait(5)
+
+    self.graph.add('a', lambda: wait(0))
+    self.graph.add('b', lambda: wait(1))
+    self.assertEqual({'a': True, 'b': True}, self.graph.run())
+
+  def test_order(self):
+    """Test running a task only after its dependencies."""
+    order = []
+    self.graph.add('a', lambda: order.append('a'))
+    self.graph.add('b', lambda _: order.append('b'), deps=['a'])
+    self.graph.add('c', lambda *_: order.append('c'), deps=['a', 'b'])
+    self.graph.run()
+    self.assertEqual(['a', 'b', 'c'], order)
+
+  def test_error(self):
+    """Test raising the first error, without running its dependents."""
+    dependent = mock.Mock()
+    self.graph.add('a', mock.Mock(side_effect=KeyError('a')))
+    self.graph.add('b', dependent, deps=['a'])
+    with self.assertRaises(KeyError):
+      self.graph.run()
+    self.assertEqual(0, dependent.call_count)
+
+  def test_unknown_dependency(self):
+    """Test refusing a dependency that isn't added yet."""
+    with self.assertRaises(ValueError):
+      self.graph.add('b', mock.Mock(), deps=['a'])
+
+
+class CriticalPathTest(helpers.ExtendedTestCase):
+  """Tests get_critical_path and log_critical_path."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.task_graph.logger'])
+    self.graph = task_graph.TaskGraph('preparation')
+    self.graph.add('info', mock.Mock())
+    self.graph.add('goma', mock.Mock())
+    self.graph.add('sha', mock.Mock(), deps=['info'])
+    self.graph.add('build', mock.Mock(), deps=['sha', 'goma'])
+    for name, start_time, end_time in [
+        ('info', 0, 1), ('goma', 0, 3), ('sha', 1, 4), ('build', 4, 10)]:
+      self.graph.tasks[name].start_time = start_time
+      self.graph.tasks[name].end_time = end_time
+
+  def test_path(self):
+    """Test following the dependencies that ended last."""
+    self.assertEqual(
+        ['info', 'sha', 'build'],
+        [task.name for task in self.graph.get_critical_path()])
+
+  def test_log(self):
+    """Test logging the critical path and the saved time."""
+    self.graph.log_critical_path()
+    self.mock.logger.log.assert_called_once_with(
+        mock.ANY, mock.ANY, 'preparation', 10, 13,
+        'info (1.0s) -> sha (3.0s) -> build (6.0s)')
+
+  def test_not_run(self):
+    """Test logging nothing before the tasks run."""
+    graph = task_graph.TaskGraph('preparation')
+    graph.add('info', mock.Mock())
+    graph.log_critical_path()
+    self.assertEqual(0, self.mock.logger.log.call_count)
@@ -14,16 +14,20 @@
 # limitations under the License.
 
 import os
+import subprocess
+import sys
 import mock
+import requests
 
 from clusterfuzz import common
 from clusterfuzz import testcase
+from error import error
 from test_libs import helpers
 
 
 def build_base_testcase(stacktrace_lines=None, revision=None, build_url=None,
                         window_arg='', minimized_args='', extension='.js',
-                        gestures=None):
+                        gestures=None, bundle=None):
   """Builds a testcase instance that can be used for testing."""
   if extension is not None:
     extension = '.%s' % extension
@@ -46,7 +50,7 @@ def build_base_testcase(stacktrace_lines=None, revision=None, build_url=None,
   if gestures:
     testcase_json['testcase']['gestures'] = []
 
-  return testcase.Testcase(testcase_json)
+  return testcase.Testcase(testcase_json, bundle=bundle)
 
 
 class TestcaseFileExtensionTest(helpers.ExtendedTestCase):
@@ -123,6 +127,90 @@ class TestcaseSetupTest(helpers.ExtendedTestCase):
     self.assertEqual(result.gestures, [])
 
 
+class CleanStacktraceLineTest(helpers.ExtendedTestCase):
+  """Tests clean_stacktrace_line."""
+
+  def test_strip_html(self):
+    """Test stripping <a> tags and unescaping entities."""
+    self.assertEqual(
+        u'aa test & "b" < \'c\' \xe9 &unknown; &#x27',
+        testcase.clean_stacktrace_line(
+            u'aa <a href="sadfsd">test</a> &amp; &quot;b&quot; &lt; '
+            u'&#39;c&#x27; &eacute; &unknown; &#x27'))
+
+  def test_plain(self):
+    """Test that a line without HTML is unchanged."""
+    self.assertEqual('a < b', testcase.clean_stacktrace_line('a < b'))
+
+
+class StacktraceTest(helpers.ExtendedTestCase):
+  """Tests Stacktrace."""
+
+  def test_binary_name(self):
+    """Test that the binary of the first command is used."""
+    stacktrace = testcase.Stacktrace([
+        {'content': 'aaa'},
+        {'content': 'Running command: aaa/bbb/some_fuzzer -a=1 /testcase'},
+        {'content': 'Running command: aaa/bbb/other_fuzzer -b=2 /testcase'},
+        {'content': 'bbb'}])
+    self.assertEqual('some_fuzzer', stacktrace.binary_name)
+    self.assertEqual('-b=2', stacktrace.args)
+
+  def test_no_command(self):
+    """Test a stacktrace without a command."""
+    stacktrace = testcase.Stacktrace([{'content': 'aaa'}])
+    self.assertIsNone(stacktrace.binary_name)
+    self.assertEqual('', stacktrace.args)
+    self.assertEqual({}, stacktrace.environment)
+
+  def test_one_trace(self):
+    """Test having only one trace."""
+    stacktrace = testcase.Stacktrace([
+        {'content': '  '}, {'content': 'aa  '}, {'content': 'bb'}])
+    self.assertEqual(['aa', 'bb'], stacktrace.first_stacktrace)
+
+  def test_unsymbolized_stacktrace(self):
+    """Test that only the first of several traces is kept."""
+    stacktrace = testcase.Stacktrace([
+        {'content': '   '},
+        {'content': '+------- fake trace ----+'},
+        {'content': 'aa &amp; <a href="x">bb</a>'},
+        {'content': '+------Release Build Unsymbolized Stacktrace (diff)---+'},
+        {'content': 'cc'},
+        {'content': 'Running command: /path/to/binary /path/to/testcase'}])
+    self.assertEqual(
+        ['+------- fake trace ----+', 'aa & bb'], stacktrace.first_stacktrace)
+    self.assertEqual('binary', stacktrace.binary_name)
+
+
+  def test_non_ascii_environment_and_args(self):
+    """Test that unescaped non-ASCII characters in the environment and the
+      args are UTF-8 strs, which can be passed to processes."""
+    stacktrace = testcase.Stacktrace([
+        {'content': u'[Environment] FOO = caf&#233;'},
+        {'content': u'Running command: /bin/binary --name=&#233; /testcase'}])
+    self.assertEqual({'FOO': 'caf\xc3\xa9'}, stacktrace.environment)
+    self.assertIsInstance(stacktrace.environment.values()[0], str)
+    self.assertEqual('--name=\xc3\xa9', stacktrace.args)
+    self.assertIsInstance(stacktrace.args, str)
+
+
+class GetBinaryNameTest(helpers.ExtendedTestCase):
+  """Tests get_binary_name."""
+
+  def test_running_command(self):
+    """Test 'Running command: '."""
+    test = build_base_testcase(stacktrace_lines=[
+        {'content': 'Running command: aaa/bbb/some_fuzzer something'}])
+    self.assertEqual('some_fuzzer', test.get_binary_name())
+
+  def test_no_command(self):
+    """Raise an exception when there's no command."""
+    test = build_base_testcase(stacktrace_lines=[{'content': 'aaa'}])
+    with self.assertRaises(error.MinimizationNotFinishedError):
+      test.get_binary_name()
+
+
 class GetTestcasePathTest(helpers.ExtendedTestCase):
   """Tests the get_testcase_path method."""
 
@@ -131,21 +219,19 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
     helpers.patch(self, [
         'clusterfuzz.common.get_stored_auth_header',
         'clusterfuzz.common.execute',
-        'clusterfuzz.common.delete_if_exists',
-        'os.listdir',
         'clusterfuzz.testcase.Testcase.get_true_testcase_path'])
     self.mock.get_stored_auth_header.return_value = 'Bearer 1a2s3d4f'
     self.testcase_dir = os.path.join(
         common.CLUSTERFUZZ_TESTCASES_DIR, '12345_testcase')
+    self.download_dir = os.path.join(
+        testcase.get_cache_dir('12345'), 'download')
     self.test = build_base_testcase()
 
   def test_downloading_testcase(self):
     """Tests the creation of folders & downloading of the testcase"""
 
     def do_wget(*unused_args):
-      path = os.path.join(
-          common.CLUSTERFUZZ_TESTCASES_DIR, '12345_testcase/testcase.js')
-      with open(path, 'w') as f:
+      with open(os.path.join(self.download_dir, 'fuzz-1.js'), 'w') as f:
         f.write('Fake testcase')
     self.mock.execute.side_effect = do_wget
     file_path = os.path.join(self.testcase_dir, 'testcase.js')
@@ -164,9 +250,131 @@ class GetTestcasePathTest(helpers.ExtendedTestCase):
                  testcase.DOWNLOAD_TIMEOUT,
                  self.mock.get_stored_auth_header.return_value,
                  testcase.CLUSTERFUZZ_TESTCASE_URL % str(12345))),
-            self.testcase_dir)
+            self.download_dir)
     ])
-    self.assertTrue(os.path.exists(self.testcase_dir))
+    self.assert_exact_calls(
+        self.mock.get_true_testcase_path, [mock.call(self.test, 'fuzz-1.js')])
+    with open(os.path.join(self.testcase_dir, 'fuzz-1.js')) as f:
+      self.assertEqual('Fake testcase', f.read())
+
+  def test_downloaded_ahead(self):
+    """Tests copying the testcase that was downloaded ahead of time."""
+
+    def do_wget(*unused_args):
+      with open(os.path.join(self.download_dir, 'fuzz-1.js'), 'w') as f:
+        f.write('Fake testcase')
+    self.mock.execute.side_effect = do_wget
+
+    path = self.test.get_downloaded_testcase_file()
+    self.assertEqual(os.path.join(self.download_dir, 'fuzz-1.js'), path)
+    self.test.get_testcase_path()
+
+    self.assertEqual(1, self.mock.execute.call_count)
+    self.assertTrue(
+        os.path.exists(os.path.join(self.testcase_dir, 'fuzz-1.js')))
+
+
+class GetCachedTestcaseFileTest(helpers.ExtendedTestCase):
+  """Tests reusing the downloaded testcase file."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+    helpers.patch(self, [
+        'clusterfuzz.testcase.get_remote_testcase_size',
+        'time.time'])
+    self.mock.time.return_value = 100000
+    self.test = build_base_testcase()
+    self.path = os.path.join(
+        testcase.get_cache_dir('12345'), 'download', 'fuzz-1.js')
+    os.makedirs(os.path.dirname(self.path))
+    with open(self.path, 'w') as f:
+      f.write('testcase')
+    self.manifest = {
+        'filename': 'fuzz-1.js', 'size': 8,
+        'sha256': testcase.get_file_sha256(self.path), 'fetched_at': 100000}
+    common.write_json(self.test.get_download_manifest_path(), self.manifest)
+
+  def test_fresh(self):
+    """Test reusing the file within the TTL."""
+    self.assertEqual(self.path, self.test.get_cached_testcase_file())
+    self.assert_n_calls(0, [self.mock.get_remote_testcase_size])
+
+  def test_no_manifest(self):
+    """Test no reuse without a manifest."""
+    os.remove(self.test.get_download_manifest_path())
+    self.assertIsNone(self.test.get_cached_testcase_file())
+
+  def test_modified(self):
+    """Test no reuse when the file was modified locally."""
+    with open(self.path, 'w') as f:
+      f.write('modified')
+    self.assertIsNone(self.test.get_cached_testcase_file())
+
+  def test_same_remote_size(self):
+    """Test reusing an old file when the size on Clusterfuzz is the same."""
+    self.mock.time.return_value += testcase.TESTCASE_FILE_TTL
+    self.mock.get_remote_testcase_size.return_value = 8
+    self.assertEqual(self.path, self.test.get_cached_testcase_file())
+    self.assertEqual(
+        self.mock.time.return_value,
+        common.read_json(self.test.get_download_manifest_path())['fetched_at'])
+
+  def test_different_remote_size(self):
+    """Test no reuse of an old file when the size on Clusterfuzz changed."""
+    self.mock.time.return_value += testcase.TESTCASE_FILE_TTL
+    self.mock.get_remote_testcase_size.return_value = 9
+    self.assertIsNone(self.test.get_cached_testcase_file())
+
+
+class GetRemoteTestcaseSizeTest(helpers.ExtendedTestCase):
+  """Tests get_remote_testcase_size."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'clusterfuzz.common.get_stored_auth_header',
+        'clusterfuzz.common.head'])
+    self.mock.get_stored_auth_header.return_value = 'Bearer 1'
+
+  def test_size(self):
+    """Test reading the content length."""
+    self.mock.head.return_value = mock.Mock(
+        status_code=200, headers={'content-length': '12'})
+    self.assertEqual(12, testcase.get_remote_testcase_size(1234))
+    self.mock.head.assert_called_once_with(
+        testcase.CLUSTERFUZZ_TESTCASE_URL % 1234,
+        headers={'Authorization': 'Bearer 1',
+                 'User-Agent': 'clusterfuzz-tools'},
+        allow_redirects=True)
+
+  def test_error(self):
+    """Test an unknown size on errors."""
+    self.mock.head.return_value = mock.Mock(status_code=401, headers={})
+    self.assertIsNone(testcase.get_remote_testcase_size(1234))
+
+    self.mock.head.side_effect = requests.exceptions.ConnectionError()
+    self.assertIsNone(testcase.get_remote_testcase_size(1234))
+
+
+class DownloadTestcaseTest(helpers.ExtendedTestCase):
+  """Tests the download_testcase method."""
+
+  def setUp(self):
+    helpers.patch(self, ['clusterfuzz.common.execute'])
+
+  def test_bundle(self):
+    """Test extracting the testcase from the bundle instead of wget."""
+    testcase_bundle = mock.Mock(
+        path='/bundle.zip', gn_args='is_asan = true\n',
+        crash_signature=common.CrashSignature('type', ['state']))
+    testcase_bundle.extract_testcase_files.return_value = ['fuzz.js']
+    test = build_base_testcase(bundle=testcase_bundle)
+
+    self.assertEqual('fuzz.js', test.download_testcase('/testcase_dir'))
+    testcase_bundle.extract_testcase_files.assert_called_once_with(
+        '/testcase_dir')
+    self.assert_n_calls(0, [self.mock.execute])
+    self.assertEqual('is_asan = true', test.gn_args)
+    self.assertEqual(testcase_bundle.crash_signature, test.crash_signature)
 
 
 class GetTrueTestcasePathTest(helpers.ExtendedTestCase):
@@ -208,3 +416,17 @@ class GetTrueTestcasePathTest(helpers.ExtendedTestCase):
     self.assert_exact_calls(self.mock.rename, [
         mock.call(os.path.join(testcase_dir, 'abcd.js'),
                   os.path.join(testcase_dir, 'testcase.js'))])
+
+
+class ImportTest(helpers.ExtendedTestCase):
+  """Tests the imports of the module."""
+
+  def test_no_requests(self):
+    """Test that importing the reproduce command doesn't import requests,
+      which is slow."""
+    output = subprocess.check_output(
+        [sys.executable, '-c',
+         'import sys; from clusterfuzz.commands import reproduce; '
+         'print "requests" in sys.modules'],
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)))
+    self.assertEqual('False', output.strip())
@@ -19,6 +19,8 @@ def make_options(
     edit_mode=False,
     disable_gclient=False,
     enable_debug=False,
+    gn_check=False,
+    worktree=False,
     goma_dir=None):
   return common.Options(
       testcase_id=testcase_id,
@@ -33,4 +35,6 @@ def make_options(
       edit_mode=edit_mode,
       disable_gclient=disable_gclient,
       enable_debug=enable_debug,
+      gn_check=gn_check,
+      worktree=worktree,
       goma_dir=goma_dir)
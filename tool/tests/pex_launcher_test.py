@@ -0,0 +1,135 @@
+"""Test the 'pex_launcher' module."""
+# Copyright 2016 Google Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+import pex_launcher
+from test_libs import helpers
+
+
+def write_pex(path, main_source='def execute():\n  return 0\n'):
+  """Write a minimal pex with the layout of a zip_safe=False pex."""
+  with zipfile.ZipFile(path, 'w') as pex:
+    pex.writestr('PEX-INFO', json.dumps(
+        {'entry_point': 'tool.main:execute', 'zip_safe': False}))
+    pex.writestr('__main__.py', 'import bootstrap\n')
+    pex.writestr('.bootstrap/_pex/__init__.py', '')
+    pex.writestr('tool/__init__.py', '')
+    pex.writestr('tool/__init__.pyc', 'stale')
+    pex.writestr('tool/main.py', main_source)
+    pex.writestr('.deps/dep-1.0-py2-none-any.whl/dep/__init__.py', '')
+
+
+class InstallTest(helpers.ExtendedTestCase):
+  """Tests install. It uses a real directory because compiling doesn't work
+    with pyfakefs."""
+
+  def setUp(self):
+    self.tmp_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.tmp_dir)
+    self.pex_path = os.path.join(self.tmp_dir, 'tool.pex')
+    self.root = os.path.join(self.tmp_dir, 'root')
+    write_pex(self.pex_path)
+
+  def test_install(self):
+    """Test extracting, compiling and writing the launcher."""
+    launcher_path = pex_launcher.install(self.pex_path, self.root)
+
+    dest = os.path.dirname(launcher_path)
+    self.assertEqual(
+        os.path.join(
+            self.root, pex_launcher.get_install_name(self.pex_path)), dest)
+    self.assertEqual(['tool-'], [
+        name[:-pex_launcher.HASH_LENGTH] for name in os.listdir(self.root)])
+    self.assertTrue(os.path.exists(os.path.join(dest, 'tool', 'main.pyc')))
+    self.assertTrue(os.path.exists(
+        os.path.join(dest, '.deps', 'dep-1.0-py2-none-any.whl', 'dep',
+                     '__init__.py')))
+    self.assertFalse(os.path.exists(os.path.join(dest, '__main__.py')))
+    self.assertFalse(os.path.exists(os.path.join(dest, '.bootstrap')))
+    self.assert_file_permissions(launcher_path, 755)
+
+    with open(launcher_path) as f:
+      launcher = f.read()
+    self.assertIn("for path in ['.deps/dep-1.0-py2-none-any.whl']:", launcher)
+    self.assertIn('from tool.main import execute\nsys.exit(execute())',
+                  launcher)
+    compile(launcher, launcher_path, 'exec')
+
+  def test_installed(self):
+    """Test that an installed pex isn't extracted again."""
+    launcher_path = pex_launcher.install(self.pex_path, self.root)
+    os.remove(os.path.join(os.path.dirname(launcher_path), 'tool', 'main.py'))
+
+    self.assertEqual(
+        launcher_path, pex_launcher.install(self.pex_path, self.root))
+    self.assertFalse(os.path.exists(
+        os.path.join(os.path.dirname(launcher_path), 'tool', 'main.py')))
+
+  def test_new_version(self):
+    """Test that a changed pex is installed next to the old one."""
+    old_launcher_path = pex_launcher.install(self.pex_path, self.root)
+    write_pex(self.pex_path, main_source='def execute():\n  return 1\n')
+
+    new_launcher_path = pex_launcher.install(self.pex_path, self.root)
+    self.assertNotEqual(old_launcher_path, new_launcher_path)
+    self.assertTrue(os.path.exists(old_launcher_path))
+    self.assertTrue(os.path.exists(new_launcher_path))
+
+
+class PruneTest(helpers.ExtendedTestCase):
+  """Tests prune."""
+
+  def setUp(self):
+    self.setup_fake_filesystem()
+
+  def test_prune(self):
+    """Test keeping the most recent installs of the pex."""
+    for i, install_hash in enumerate(['a' * 12, 'b' * 12, 'c' * 12]):
+      os.makedirs('/root/tool-%s' % install_hash)
+      os.utime('/root/tool-%s' % install_hash, (i, i))
+    os.makedirs('/root/other-%s' % ('d' * 12))
+    os.makedirs('/root/tool-ci-%s' % ('e' * 12))
+
+    pex_launcher.prune('/dist/tool.pex', '/root', 2)
+
+    self.assertItemsEqual(
+        ['tool-%s' % ('b' * 12), 'tool-%s' % ('c' * 12),
+         'other-%s' % ('d' * 12), 'tool-ci-%s' % ('e' * 12)],
+        os.listdir('/root'))
+
+
+class MainTest(helpers.ExtendedTestCase):
+  """Tests main."""
+
+  def setUp(self):
+    helpers.patch(self, [
+        'pex_launcher.install',
+        'pex_launcher.link',
+        'pex_launcher.prune'])
+    self.mock.install.return_value = '/root/tool-abc/launcher'
+
+  def test_link(self):
+    """Test installing and linking."""
+    pex_launcher.main(['/dist/tool.pex', '--root', '/root', '--link', '/bin/t'])
+
+    self.mock.install.assert_called_once_with('/dist/tool.pex', '/root')
+    self.mock.link.assert_called_once_with(
+        '/root/tool-abc/launcher', '/bin/t')
+    self.mock.prune.assert_called_once_with('/dist/tool.pex', '/root', 3)